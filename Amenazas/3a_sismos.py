@@ -11,10 +11,11 @@ from datetime import datetime, timedelta, timezone
 import sys
 import os
 
-def extraer_sismos_usgs():
+def consultar_sismos_usgs(session=None):
     """
-    Extrae sismos de la API de USGS para las últimas 24 horas
-    Filtra por magnitud >= 5.0 y proximidad a Chile
+    Consulta la API de USGS (últimas 24 horas, magnitud >= 5.0, proximidad a Chile)
+    y devuelve los sismos transformados. Lanza requests.RequestException si falla.
+    `session` permite reutilizar conexiones entre fuentes.
     """
     
     # Configurar fechas (últimas 24 horas) - usando timezone aware
@@ -39,15 +40,21 @@ def extraer_sismos_usgs():
     
     print(f"[INFO] Consultando USGS API desde {start_time}...")
     
+    # Usar certifi para los certificados SSL
+    response = (session or requests).get(url, params=params, timeout=30, verify=certifi.where())
+    response.raise_for_status()
+    
+    # Transformar a formato específico del proyecto
+    return transformar_sismos(response.json())
+
+def extraer_sismos_usgs():
+    """
+    Extrae sismos de la API de USGS para las últimas 24 horas
+    Filtra por magnitud >= 5.0 y proximidad a Chile
+    """
+    
     try:
-        # Usar certifi para los certificados SSL
-        response = requests.get(url, params=params, timeout=30, verify=certifi.where())
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        # Transformar a formato específico del proyecto
-        sismos_transformados = transformar_sismos(data)
+        sismos_transformados = consultar_sismos_usgs()
         
         print(f"[OK] Se obtuvieron {len(sismos_transformados['features'])} sismos")
         
@@ -74,6 +81,7 @@ def transformar_sismos(data_usgs):
             'geometry': geom,
             'properties': {
                 'tipo_amenaza': 'sismo',
+                'id_evento': feature.get('id'),
                 'magnitud': props.get('mag'),
                 'profundidad_km': geom['coordinates'][2] if len(geom['coordinates']) > 2 else None,
                 'lugar': props.get('place'),
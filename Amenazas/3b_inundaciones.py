@@ -13,9 +13,10 @@ import urllib3
 # Deshabilitar warnings de SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-def extraer_alertas_dga():
+def consultar_alertas_dga(session=None):
     """
-    Extrae alertas hidrológicas del servicio MapServer de la DGA
+    Consulta el servicio MapServer de la DGA y devuelve las alertas transformadas.
+    Lanza requests.RequestException si falla.
     """
     
     url = "https://rest-sit.mop.gob.cl/arcgis/rest/services/DGA/ALERTAS/MapServer/0/query"
@@ -29,14 +30,19 @@ def extraer_alertas_dga():
     
     print("[INFO] Consultando DGA ALERTAS MapServer...")
     
+    response = (session or requests).get(url, params=params, timeout=30, verify=False)
+    response.raise_for_status()
+    
+    # Transformar a GeoJSON
+    return transformar_alertas_dga(response.json())
+
+def extraer_alertas_dga():
+    """
+    Extrae alertas hidrológicas del servicio MapServer de la DGA
+    """
+    
     try:
-        response = requests.get(url, params=params, timeout=30, verify=False)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        # Transformar a GeoJSON
-        alertas_transformadas = transformar_alertas_dga(data)
+        alertas_transformadas = consultar_alertas_dga()
         
         print(f"[OK] Se obtuvieron {len(alertas_transformadas['features'])} alertas")
         
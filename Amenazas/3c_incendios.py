@@ -13,9 +13,10 @@ import urllib3
 # Deshabilitar warnings de SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-def extraer_incendios_nasa():
+def consultar_incendios_nasa(session=None):
     """
-    Extrae incendios forestales activos de la API de NASA EONET
+    Consulta la API de NASA EONET y devuelve los incendios en Chile transformados.
+    Lanza requests.RequestException si falla.
     """
     
     url = "https://eonet.gsfc.nasa.gov/api/v3/events?status=open&category=wildfires&bbox=-75,-56,-66,-17.5"
@@ -28,14 +29,19 @@ def extraer_incendios_nasa():
     
     print("[INFO] Consultando NASA EONET API...")
     
+    response = (session or requests).get(url, params=params, timeout=30, verify=False)
+    response.raise_for_status()
+    
+    # Filtrar incendios en Chile y transformar
+    return transformar_incendios_chile(response.json())
+
+def extraer_incendios_nasa():
+    """
+    Extrae incendios forestales activos de la API de NASA EONET
+    """
+    
     try:
-        response = requests.get(url, params=params, timeout=30, verify=False)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        # Filtrar incendios en Chile y transformar
-        incendios_transformados = transformar_incendios_chile(data)
+        incendios_transformados = consultar_incendios_nasa()
         
         print(f"[OK] Se obtuvieron {len(incendios_transformados['features'])} incendios en Chile")
         
@@ -81,6 +87,7 @@ def transformar_incendios_chile(data_nasa):
             },
             'properties': {
                 'tipo_amenaza': 'incendio_forestal',
+                'id_evento': event.get('id'),
                 'titulo': event.get('title'),
                 'descripcion': event.get('description', 'Incendio forestal activo'),
                 'fecha_inicio': latest_geom.get('date'),
@@ -49,9 +49,10 @@ SEGMENTOS_RUTA = [
     }
 ]
 
-def extraer_trafico_google():
+def extraer_trafico_google(session=None):
     """
     Extrae datos de tráfico en tiempo real de segmentos predeterminados
+    `session` permite reutilizar conexiones entre segmentos y fuentes
     """
     
     if not GOOGLE_MAPS_API_KEY:
@@ -66,7 +67,7 @@ def extraer_trafico_google():
     for i, segmento in enumerate(SEGMENTOS_RUTA, 1):
         print(f"[INFO] Consultando segmento {i}/{len(SEGMENTOS_RUTA)}: {segmento['nombre']}")
         
-        datos_trafico = consultar_trafico_segmento(segmento)
+        datos_trafico = consultar_trafico_segmento(segmento, session)
         
         if datos_trafico:
             segmentos_con_trafico.append(datos_trafico)
@@ -82,7 +83,7 @@ def extraer_trafico_google():
     
     return trafico_geojson
 
-def consultar_trafico_segmento(segmento):
+def consultar_trafico_segmento(segmento, session=None):
     """
     Consulta el tráfico de un segmento específico usando Google Directions API
     """
@@ -101,7 +102,7 @@ def consultar_trafico_segmento(segmento):
     }
     
     try:
-        response = requests.get(url, params=params, timeout=10, verify=False)
+        response = (session or requests).get(url, params=params, timeout=10, verify=False)
         response.raise_for_status()
         
         data = response.json()
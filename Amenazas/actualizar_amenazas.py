@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Pipeline único de amenazas: descarga todas las fuentes en paralelo con una sesión HTTP
+compartida, las transforma en memoria y las carga directo a PostgreSQL/PostGIS, sin pasar
+por los archivos GeoJSON intermedios (que se pueden seguir escribiendo para depuración).
+"""
+
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from load_amenazas_to_db import AMENAZAS_JSON_DIR, BASE_DIR, cargar_amenazas, get_db_connection
+
+logger = logging.getLogger(__name__)
+
+ESTADO_PATH = BASE_DIR / ".estado_amenazas.json"
+
+
+@dataclass(frozen=True)
+class Fuente:
+    nombre: str
+    modulo: str
+    funcion: str
+    archivo: str
+    ttl_env: str
+    ttl_default_s: float
+
+    @property
+    def ttl_s(self) -> float:
+        return float(os.getenv(self.ttl_env, str(self.ttl_default_s)))
+
+    def descargar(self, session: requests.Session) -> Dict[str, Any]:
+        # Import tardío: 3d_trafico lee GOOGLE_MAPS_API_KEY al importarse, después de load_dotenv
+        return getattr(importlib.import_module(self.modulo), self.funcion)(session)
+
+
+FUENTES = [
+    Fuente('sismos', '3a_sismos', 'consultar_sismos_usgs', 'sismos.geojson', 'SISMOS_TTL_S', 900),
+    Fuente('inundaciones', '3b_inundaciones', 'consultar_alertas_dga', 'inundaciones.geojson', 'INUNDACIONES_TTL_S', 3600),
+    Fuente('incendios', '3c_incendios', 'consultar_incendios_nasa', 'incendios.geojson', 'INCENDIOS_TTL_S', 3600),
+    Fuente('trafico', '3d_trafico', 'extraer_trafico_google', 'trafico_vehicular.geojson', 'TRAFICO_TTL_S', 900),
+]
+
+
+def env_flag(nombre: str) -> bool:
+    return os.getenv(nombre, "").lower() in {"1", "true", "yes"}
+
+
+def crear_sesion(pool_size: int) -> requests.Session:
+    """
+    Sesión compartida por todas las fuentes: reutiliza conexiones y reintenta errores transitorios
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=("GET",)),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def leer_estado() -> Dict[str, Dict[str, float]]:
+    try:
+        return json.loads(ESTADO_PATH.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def guardar_estado(estado: Dict[str, Dict[str, float]]) -> None:
+    tmp_path = ESTADO_PATH.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps(estado, indent=2), encoding='utf-8')
+    os.replace(tmp_path, ESTADO_PATH)
+
+
+def fuentes_pendientes(estado: Dict[str, Dict[str, float]]) -> List[Fuente]:
+    """
+    Fuentes solicitadas (AMENAZAS_FUENTES) cuyo marcador de frescura venció
+    """
+    solicitadas = {item.strip() for item in os.getenv('AMENAZAS_FUENTES', '').split(',') if item.strip()}
+    forzar = env_flag('FORCE_REFRESH') or env_flag('FORCE_REFRESH_AMENAZAS')
+    ahora = time.time()
+
+    pendientes = []
+    for fuente in FUENTES:
+        if solicitadas and fuente.nombre not in solicitadas:
+            continue
+        ultima = estado.get(fuente.nombre, {}).get('last_success')
+        if not forzar and ultima is not None and ahora - ultima < fuente.ttl_s:
+            logger.info(f"Fuente {fuente.nombre} vigente (TTL {fuente.ttl_s:.0f} s); se omite")
+            continue
+        pendientes.append(fuente)
+    return pendientes
+
+
+def descargar_fuentes(fuentes: List[Fuente]) -> Dict[str, Dict[str, Any]]:
+    """
+    Descarga y transforma las fuentes en paralelo; las que fallan se registran y se omiten
+    """
+    resultados: Dict[str, Dict[str, Any]] = {}
+    if not fuentes:
+        return resultados
+
+    def tarea(fuente: Fuente, session: requests.Session):
+        inicio = time.monotonic()
+        datos = fuente.descargar(session)
+        return datos, time.monotonic() - inicio
+
+    with crear_sesion(len(fuentes)) as session, ThreadPoolExecutor(max_workers=len(fuentes)) as pool:
+        futuros = {fuente.nombre: pool.submit(tarea, fuente, session) for fuente in fuentes}
+        for nombre, futuro in futuros.items():
+            try:
+                datos, duracion = futuro.result()
+            except requests.exceptions.RequestException as e:
+                logger.error(f"✗ Error al descargar {nombre}: {e}")
+                continue
+            except Exception as e:
+                # Un formato inesperado en una fuente no debe impedir cargar las demás
+                logger.error(f"✗ Error al transformar {nombre}: {e!r}")
+                continue
+            if not isinstance(datos, dict):
+                logger.error(f"✗ {nombre} no devolvió un GeoJSON; se omite")
+                continue
+            resultados[nombre] = datos
+            logger.info(f"✓ {nombre}: {len(datos.get('features', []))} registros en {duracion:.2f} s")
+    return resultados
+
+
+def guardar_geojson(fuentes: List[Fuente], datos: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Escribe los GeoJSON de las fuentes descargadas (solo para depuración)
+    """
+    AMENAZAS_JSON_DIR.mkdir(parents=True, exist_ok=True)
+    for fuente in fuentes:
+        if fuente.nombre not in datos:
+            continue
+        filepath = AMENAZAS_JSON_DIR / fuente.archivo
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(datos[fuente.nombre], f, indent=2, ensure_ascii=False)
+        logger.info(f"Archivo guardado: {filepath}")
+
+
+def main() -> int:
+    logger.info("=" * 70)
+    logger.info("ACTUALIZACIÓN DE AMENAZAS (DESCARGA Y CARGA EN PARALELO)")
+    logger.info("=" * 70)
+
+    load_dotenv()
+    inicio = time.monotonic()
+
+    estado = leer_estado()
+    fuentes = fuentes_pendientes(estado)
+    if not fuentes:
+        logger.info("Todas las fuentes están vigentes; no hay nada que actualizar")
+        return 0
+
+    datos = descargar_fuentes(fuentes)
+    if env_flag('AMENAZAS_GUARDAR_GEOJSON'):
+        guardar_geojson(fuentes, datos)
+    if not datos:
+        logger.error("No se pudo descargar ninguna fuente")
+        return 1
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cambios = cargar_amenazas(cursor, {nombre: data.get('features', []) for nombre, data in datos.items()})
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"✗ Error durante la carga: {e}")
+        logger.error("Se realizó rollback de los cambios")
+        return 1
+    finally:
+        cursor.close()
+        conn.close()
+
+    # Los marcadores se actualizan solo tras confirmar la carga
+    ahora = time.time()
+    for nombre in datos:
+        estado[nombre] = {'last_success': ahora}
+    guardar_estado(estado)
+
+    logger.info("=" * 70)
+    logger.info(f"✓ {len(datos)}/{len(fuentes)} fuentes actualizadas, "
+                f"{sum(c.total for c in cambios.values())} filas modificadas "
+                f"en {time.monotonic() - inicio:.2f} s")
+    logger.info("=" * 70)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
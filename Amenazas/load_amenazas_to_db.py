@@ -4,16 +4,20 @@ Script para cargar datos de amenazas (sismos, inundaciones, incendios, tráfico)
 desde archivos GeoJSON a la base de datos PostgreSQL/PostGIS
 """
 
-import json
+import io
 import logging
 import os
 import sys
 from pathlib import Path
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import ijson
 
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2 import sql
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
 # Configurar logging
@@ -27,6 +31,16 @@ logger = logging.getLogger(__name__)
 BASE_DIR = Path(__file__).resolve().parent.parent
 AMENAZAS_JSON_DIR = BASE_DIR / "Amenazas_JSON"
 
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Días que se conservan las filas expiradas antes de borrarlas
+AMENAZAS_RETENCION_DIAS = int(os.getenv('AMENAZAS_RETENCION_DIAS', '7'))
+# Ventana en que vista_amenazas_activas y amenazas_activas muestran un sismo
+SISMOS_VENTANA_DIAS = 7
+# Versiones de la capa 'amenazas' que se conservan en amenazas_cambios; un consumidor más
+# atrasado que eso debe volver a leer la capa completa
+AMENAZAS_CAMBIOS_VERSIONES = int(os.getenv('AMENAZAS_CAMBIOS_VERSIONES', '500'))
+
 
 def get_db_connection():
     """
@@ -46,275 +60,504 @@ def get_db_connection():
         sys.exit(1)
 
 
-def limpiar_tabla(cursor, tabla: str) -> None:
+# Tablas de amenazas con clave natural (clave_origen) y expiración lógica (expirado_en)
+TABLAS_AMENAZAS = ('amenazas_sismos', 'amenazas_inundaciones', 'amenazas_incendios', 'amenazas_trafico')
+
+
+@dataclass
+class CambiosTabla:
     """
-    Limpia los datos antiguos de una tabla de amenazas
+    Ids de las filas que una carga insertó, modificó o expiró en una tabla de amenazas
     """
-    try:
-        cursor.execute(f"DELETE FROM {tabla}")
-        logger.info(f"Tabla {tabla} limpiada")
-    except psycopg2.Error as e:
-        logger.error(f"Error al limpiar tabla {tabla}: {e}")
-        raise
+    tabla: str
+    insertados: List[int] = field(default_factory=list)
+    actualizados: List[int] = field(default_factory=list)
+    expirados: List[int] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return len(self.insertados) + len(self.actualizados) + len(self.expirados)
 
 
-def cargar_sismos(cursor, filepath: Path) -> int:
+def migrar_esquema_amenazas(cursor) -> None:
     """
-    Carga datos de sismos desde archivo GeoJSON
+    Agrega clave natural y expiración lógica a bases creadas con el esquema anterior.
+    Las filas previas no tienen clave natural, así que se descartan y la carga las repone.
     """
-    logger.info(f"Cargando sismos desde {filepath}")
-    
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    features = data.get('features', [])
-    
-    if not features:
-        logger.warning("No se encontraron sismos para cargar")
-        return 0
-    
-    # Limpiar tabla antes de cargar
-    limpiar_tabla(cursor, 'amenazas_sismos')
-    
-    query = """
-        INSERT INTO amenazas_sismos (
-            tipo_amenaza, magnitud, profundidad_km, lugar, 
-            timestamp_utc, fecha_legible, nivel_alerta, 
-            url_detalle, fuente, geom
-        ) VALUES (
-            %(tipo_amenaza)s, %(magnitud)s, %(profundidad_km)s, %(lugar)s,
-            %(timestamp_utc)s, %(fecha_legible)s, %(nivel_alerta)s,
-            %(url_detalle)s, %(fuente)s, 
-            ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)
+    cursor.execute(
+        """
+        SELECT table_name FROM information_schema.columns
+        WHERE table_name = ANY(%s) AND column_name = 'clave_origen'
+        """,
+        (list(TABLAS_AMENAZAS),),
+    )
+    migradas = {row[0] for row in cursor.fetchall()}
+    for tabla in TABLAS_AMENAZAS:
+        if tabla in migradas:
+            continue
+        logger.info(f"Migrando {tabla} a claves naturales")
+        identificador = sql.Identifier(tabla)
+        cursor.execute(sql.SQL(
+            "ALTER TABLE {} ADD COLUMN IF NOT EXISTS clave_origen TEXT, "
+            "ADD COLUMN IF NOT EXISTS actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+            "ADD COLUMN IF NOT EXISTS expirado_en TIMESTAMP"
+        ).format(identificador))
+        cursor.execute(sql.SQL("DELETE FROM {} WHERE clave_origen IS NULL").format(identificador))
+        cursor.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN clave_origen SET NOT NULL").format(identificador))
+        cursor.execute(sql.SQL("CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} (clave_origen)").format(
+            sql.Identifier(f"{tabla}_clave_origen_key"), identificador
+        ))
+
+
+def valor_copy(valor: Any) -> str:
+    """
+    Serializa un valor para COPY en formato texto (NULL como \\N, escapes de control)
+    """
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, datetime):
+        valor = valor.isoformat()
+    return (
+        str(valor)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+class FilasCopy(io.TextIOBase):
+    """
+    Archivo de solo lectura que genera bajo demanda las líneas de COPY a partir de un
+    iterable de registros, para no materializar la carga completa en memoria
+    """
+
+    def __init__(self, registros: Iterable[Dict[str, Any]], columnas: List[str]):
+        self._lineas = (
+            '\t'.join(valor_copy(registro.get(columna)) for columna in columnas) + '\n'
+            for registro in registros
         )
+        self._buffer = ''
+        self.filas = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        partes = [self._buffer]
+        largo = len(self._buffer)
+        while size < 0 or largo < size:
+            linea = next(self._lineas, None)
+            if linea is None:
+                break
+            partes.append(linea)
+            largo += len(linea)
+            self.filas += 1
+        datos = ''.join(partes)
+        if size < 0:
+            self._buffer = ''
+            return datos
+        self._buffer = datos[size:]
+        return datos[:size]
+
+
+def upsert_amenazas(
+    cursor,
+    tabla: str,
+    columnas: List[str],
+    registros: Iterable[Dict[str, Any]],
+    expira_ausentes: bool,
+) -> CambiosTabla:
     """
-    
-    records = []
-    for feature in features:
-        props = feature['properties']
-        coords = feature['geometry']['coordinates']
-        
-        # Convertir timestamp a fecha legible si existe
-        fecha_legible = None
-        if props.get('timestamp_utc'):
-            try:
-                fecha_legible = datetime.fromtimestamp(
-                    props['timestamp_utc'] / 1000, 
-                    tz=timezone.utc
-                )
-            except (ValueError, TypeError):
-                fecha_legible = None
-        
-        record = {
-            'tipo_amenaza': props.get('tipo_amenaza', 'sismo'),
-            'magnitud': props.get('magnitud'),
-            'profundidad_km': props.get('profundidad_km'),
-            'lugar': props.get('lugar'),
-            'timestamp_utc': props.get('timestamp_utc'),
-            'fecha_legible': fecha_legible,
-            'nivel_alerta': props.get('nivel_alerta'),
-            'url_detalle': props.get('url_detalle'),
-            'fuente': props.get('fuente', 'USGS'),
-            'lon': coords[0],
-            'lat': coords[1]
-        }
-        records.append(record)
-    
-    execute_batch(cursor, query, records)
-    logger.info(f"✓ {len(records)} sismos cargados exitosamente")
-    return len(records)
+    Carga los registros con COPY a una tabla de staging y los fusiona con una sola sentencia
+    INSERT ... SELECT ... ON CONFLICT (clave_origen), que construye las geometrías y no toca
+    las filas que no cambiaron. Con `expira_ausentes`, las filas vigentes que la fuente ya
+    no reporta se marcan expiradas, también cuando la fuente no trae ningún registro.
+    """
+    cambios = CambiosTabla(tabla)
+    objetivo = sql.Identifier(tabla)
+    staging = sql.Identifier(f"stg_{tabla}")
+    todas = columnas + ['clave_origen']
+    lista_columnas = sql.SQL(', ').join(map(sql.Identifier, todas))
+
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(staging))
+    cursor.execute(sql.SQL(
+        "CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {columnas} FROM {tabla} WITH NO DATA"
+    ).format(staging=staging, columnas=lista_columnas, tabla=objetivo))
+    cursor.execute(sql.SQL(
+        "ALTER TABLE {} ADD COLUMN lon DOUBLE PRECISION, ADD COLUMN lat DOUBLE PRECISION, "
+        "ADD COLUMN orden BIGINT GENERATED ALWAYS AS IDENTITY"
+    ).format(staging))
+
+    archivo = FilasCopy(registros, todas + ['lon', 'lat'])
+    cursor.copy_expert(
+        sql.SQL("COPY {} ({}, lon, lat) FROM STDIN").format(staging, lista_columnas).as_string(cursor),
+        archivo,
+        size=COPY_BUFFER_SIZE,
+    )
+    if archivo.filas:
+        # Una misma clave no puede afectar dos veces la misma fila: gana la última aparición
+        cursor.execute(sql.SQL("""
+            INSERT INTO {tabla} ({columnas}, geom)
+            SELECT DISTINCT ON (clave_origen) {columnas}, ST_SetSRID(ST_MakePoint(lon, lat), 4326)
+            FROM {staging}
+            ORDER BY clave_origen, orden DESC
+            ON CONFLICT (clave_origen) DO UPDATE
+                SET {asignaciones}, geom = EXCLUDED.geom,
+                    actualizado_en = CURRENT_TIMESTAMP, expirado_en = NULL
+                WHERE ({actuales}, {tabla}.geom) IS DISTINCT FROM ({nuevos}, EXCLUDED.geom)
+                   OR {tabla}.expirado_en IS NOT NULL
+            RETURNING id, (xmax = 0) AS insertado
+        """).format(
+            tabla=objetivo,
+            staging=staging,
+            columnas=lista_columnas,
+            asignaciones=sql.SQL(', ').join(
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(columna)) for columna in columnas
+            ),
+            actuales=sql.SQL(', ').join(sql.SQL("{}.{}").format(objetivo, sql.Identifier(c)) for c in columnas),
+            nuevos=sql.SQL(', ').join(sql.SQL("EXCLUDED.{}").format(sql.Identifier(c)) for c in columnas),
+        ))
+        for fila_id, insertado in cursor.fetchall():
+            (cambios.insertados if insertado else cambios.actualizados).append(fila_id)
+    else:
+        # Sin registros no hay nada que fusionar, pero las filas vigentes igual deben expirar
+        logger.warning(f"No se encontraron registros para cargar en {tabla}")
 
+    if expira_ausentes:
+        cursor.execute(sql.SQL("""
+            UPDATE {tabla} t SET expirado_en = CURRENT_TIMESTAMP
+            WHERE t.expirado_en IS NULL
+              AND NOT EXISTS (SELECT 1 FROM {staging} s WHERE s.clave_origen = t.clave_origen)
+            RETURNING t.id
+        """).format(tabla=objetivo, staging=staging))
+        cambios.expirados = [row[0] for row in cursor.fetchall()]
 
-def cargar_inundaciones(cursor, filepath: Path) -> int:
+    cursor.execute(sql.SQL("DROP TABLE {}").format(staging))
+    logger.info(
+        f"{tabla}: {archivo.filas} registros vía COPY; {len(cambios.insertados)} nuevos, "
+        f"{len(cambios.actualizados)} actualizados, {len(cambios.expirados)} expirados"
+    )
+    return cambios
+
+
+def registrar_version_datos(cursor, capa: str) -> Optional[int]:
     """
-    Carga datos de inundaciones desde archivo GeoJSON
+    Incrementa la versión de la capa para que la aplicación web invalide sus cachés
     """
-    logger.info(f"Cargando inundaciones desde {filepath}")
-    
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    features = data.get('features', [])
-    
-    if not features:
-        logger.warning("No se encontraron alertas de inundación para cargar")
-        return 0
-    
-    # Limpiar tabla antes de cargar
-    limpiar_tabla(cursor, 'amenazas_inundaciones')
-    
-    query = """
-        INSERT INTO amenazas_inundaciones (
-            tipo_amenaza, estacion, rio, region, nivel_alerta,
-            estado, caudal_actual, timestamp, fuente, geom
-        ) VALUES (
-            %(tipo_amenaza)s, %(estacion)s, %(rio)s, %(region)s, %(nivel_alerta)s,
-            %(estado)s, %(caudal_actual)s, %(timestamp)s, %(fuente)s,
-            ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)
+    cursor.execute("SELECT to_regproc('incrementar_version_datos') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        logger.warning("La base no tiene la función incrementar_version_datos; se omite el versionado")
+        return None
+    cursor.execute("SELECT incrementar_version_datos(%s)", (capa,))
+    version = cursor.fetchone()[0]
+    logger.info(f"Versión de la capa '{capa}' actualizada a {version}")
+    return version
+
+
+def registrar_cambios(cursor, version: int, cambios: List[CambiosTabla]) -> None:
+    """
+    Publica en amenazas_cambios las filas modificadas bajo la versión de capa recién creada
+    """
+    cursor.execute("SELECT to_regclass('amenazas_cambios') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return
+    filas = [
+        (version, cambio.tabla, fila_id, operacion)
+        for cambio in cambios
+        for operacion, ids in (('I', cambio.insertados), ('U', cambio.actualizados), ('E', cambio.expirados))
+        for fila_id in ids
+    ]
+    execute_values(
+        cursor,
+        "INSERT INTO amenazas_cambios (version, tabla, origen_id, operacion) VALUES %s",
+        filas,
+    )
+
+
+def purgar_amenazas(cursor) -> None:
+    """
+    Borra las filas expiradas hace más de AMENAZAS_RETENCION_DIAS y recorta amenazas_cambios a
+    las últimas AMENAZAS_CAMBIOS_VERSIONES versiones. Las claves de inundaciones y tráfico
+    incluyen la fecha, así que sin esta purga cada carga agrega filas que nunca se van. Los
+    sismos nunca expiran (el feed cubre 24 horas), así que se borran por fecha, sin acortar la
+    ventana de SISMOS_VENTANA_DIAS en que se muestran.
+    """
+    for tabla in TABLAS_AMENAZAS:
+        cursor.execute(
+            sql.SQL("DELETE FROM {} WHERE expirado_en < NOW() - INTERVAL '1 day' * %s").format(sql.Identifier(tabla)),
+            (AMENAZAS_RETENCION_DIAS,),
         )
+        if cursor.rowcount:
+            logger.info(f"{tabla}: {cursor.rowcount} filas expiradas hace más de {AMENAZAS_RETENCION_DIAS} días borradas")
+
+    dias_sismos = max(AMENAZAS_RETENCION_DIAS, SISMOS_VENTANA_DIAS)
+    cursor.execute(
+        "DELETE FROM amenazas_sismos WHERE fecha_legible < NOW() - INTERVAL '1 day' * %s", (dias_sismos,)
+    )
+    if cursor.rowcount:
+        logger.info(f"amenazas_sismos: {cursor.rowcount} sismos de hace más de {dias_sismos} días borrados")
+
+    cursor.execute("SELECT to_regclass('amenazas_cambios') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return
+    cursor.execute(
+        "DELETE FROM amenazas_cambios WHERE version <= (SELECT MAX(version) FROM amenazas_cambios) - %s",
+        (AMENAZAS_CAMBIOS_VERSIONES,),
+    )
+    if cursor.rowcount:
+        logger.info(f"amenazas_cambios: {cursor.rowcount} filas de versiones antiguas borradas")
+
+
+def refrescar_amenazas_activas(cursor, tipos: List[str]) -> None:
+    """
+    Actualiza la capa materializada amenazas_activas para los tipos recargados
+    """
+    cursor.execute("SELECT to_regproc('refrescar_amenazas_activas') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        logger.warning("La base no tiene la función refrescar_amenazas_activas; se omite la capa materializada")
+        return
+    cursor.execute("SELECT refrescar_amenazas_activas(%s::text[])", (tipos,))
+    logger.info(f"Capa amenazas_activas refrescada (tipos: {', '.join(tipos) or 'solo vencimientos'})")
+
+
+def parsear_fecha_iso(valor: Any) -> Optional[datetime]:
+    if isinstance(valor, str):
+        try:
+            return datetime.fromisoformat(valor.replace('Z', '+00:00'))
+        except (ValueError, TypeError):
+            return None
+    return valor
+
+
+def cargar_sismos(cursor, features: Iterable[Dict[str, Any]]) -> CambiosTabla:
+    """
+    Carga datos de sismos desde un iterable de features GeoJSON.
+    Clave natural: id de evento USGS. El feed cubre solo las últimas 24 horas, así que los
+    sismos ausentes no se expiran (vencen por su ventana en amenazas_activas).
     """
+    logger.info("Cargando sismos")
     
-    records = []
-    for feature in features:
-        props = feature['properties']
-        coords = feature['geometry']['coordinates']
+    def registros():
+        for feature in features:
+            props = feature['properties']
+            coords = feature['geometry']['coordinates']
         
-        # Convertir timestamp si es string ISO
-        timestamp = props.get('timestamp')
-        if isinstance(timestamp, str):
-            try:
-                timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            except (ValueError, TypeError):
-                timestamp = None
+            # Convertir timestamp a fecha legible si existe
+            fecha_legible = None
+            if props.get('timestamp_utc'):
+                try:
+                    fecha_legible = datetime.fromtimestamp(
+                        props['timestamp_utc'] / 1000, 
+                        tz=timezone.utc
+                    )
+                except (ValueError, TypeError):
+                    fecha_legible = None
         
-        record = {
-            'tipo_amenaza': props.get('tipo_amenaza', 'inundacion'),
-            'estacion': props.get('estacion'),
-            'rio': props.get('rio'),
-            'region': props.get('region'),
-            'nivel_alerta': props.get('nivel_alerta'),
-            'estado': props.get('estado'),
-            'caudal_actual': props.get('caudal_actual'),
-            'timestamp': timestamp,
-            'fuente': props.get('fuente', 'DGA MOP'),
-            'lon': coords[0],
-            'lat': coords[1]
-        }
-        records.append(record)
-    
-    execute_batch(cursor, query, records)
-    logger.info(f"✓ {len(records)} alertas de inundación cargadas exitosamente")
-    return len(records)
+            record = {
+                'clave_origen': props.get('id_evento') or props.get('url_detalle')
+                    or f"{props.get('timestamp_utc')}@{coords[0]:.4f},{coords[1]:.4f}",
+                'tipo_amenaza': props.get('tipo_amenaza', 'sismo'),
+                'magnitud': props.get('magnitud'),
+                'profundidad_km': props.get('profundidad_km'),
+                'lugar': props.get('lugar'),
+                'timestamp_utc': props.get('timestamp_utc'),
+                'fecha_legible': fecha_legible,
+                'nivel_alerta': props.get('nivel_alerta'),
+                'url_detalle': props.get('url_detalle'),
+                'fuente': props.get('fuente', 'USGS'),
+                'lon': coords[0],
+                'lat': coords[1]
+            }
+            yield record
+    
+    return upsert_amenazas(
+        cursor,
+        'amenazas_sismos',
+        ['tipo_amenaza', 'magnitud', 'profundidad_km', 'lugar', 'timestamp_utc',
+         'fecha_legible', 'nivel_alerta', 'url_detalle', 'fuente'],
+        registros(),
+        expira_ausentes=False,
+    )
 
 
-def cargar_incendios(cursor, filepath: Path) -> int:
+def cargar_inundaciones(cursor, features: Iterable[Dict[str, Any]]) -> CambiosTabla:
     """
-    Carga datos de incendios forestales desde archivo GeoJSON
+    Carga datos de inundaciones desde un iterable de features GeoJSON.
+    Clave natural: estación + timestamp. El feed lista las alertas vigentes, así que las
+    ausentes se expiran.
     """
-    logger.info(f"Cargando incendios desde {filepath}")
+    logger.info("Cargando inundaciones")
     
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    features = data.get('features', [])
-    
-    if not features:
-        logger.warning("No se encontraron incendios para cargar")
-        return 0
-    
-    # Limpiar tabla antes de cargar
-    limpiar_tabla(cursor, 'amenazas_incendios')
-    
-    query = """
-        INSERT INTO amenazas_incendios (
-            tipo_amenaza, titulo, descripcion, fecha_inicio,
-            nivel_alerta, categoria, url_detalle, fuente, geom
-        ) VALUES (
-            %(tipo_amenaza)s, %(titulo)s, %(descripcion)s, %(fecha_inicio)s,
-            %(nivel_alerta)s, %(categoria)s, %(url_detalle)s, %(fuente)s,
-            ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)
-        )
-    """
-    
-    records = []
-    for feature in features:
-        props = feature['properties']
-        coords = feature['geometry']['coordinates']
+    def registros():
+        for feature in features:
+            props = feature['properties']
+            coords = feature['geometry']['coordinates']
         
-        # Convertir fecha_inicio si es string
-        fecha_inicio = props.get('fecha_inicio')
-        if isinstance(fecha_inicio, str):
-            try:
-                fecha_inicio = datetime.fromisoformat(fecha_inicio.replace('Z', '+00:00'))
-            except (ValueError, TypeError):
-                fecha_inicio = None
+            # Convertir timestamp si es string ISO
+            timestamp = parsear_fecha_iso(props.get('timestamp'))
+            estacion = props.get('estacion') or f"{coords[0]:.5f},{coords[1]:.5f}"
         
-        record = {
-            'tipo_amenaza': props.get('tipo_amenaza', 'incendio_forestal'),
-            'titulo': props.get('titulo'),
-            'descripcion': props.get('descripcion'),
-            'fecha_inicio': fecha_inicio,
-            'nivel_alerta': props.get('nivel_alerta', 'rojo'),
-            'categoria': props.get('categoria', 'wildfires'),
-            'url_detalle': props.get('url_detalle'),
-            'fuente': props.get('fuente', 'NASA EONET'),
-            'lon': coords[0],
-            'lat': coords[1]
-        }
-        records.append(record)
-    
-    execute_batch(cursor, query, records)
-    logger.info(f"✓ {len(records)} incendios forestales cargados exitosamente")
-    return len(records)
+            record = {
+                'clave_origen': f"{estacion}|{timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp}",
+                'tipo_amenaza': props.get('tipo_amenaza', 'inundacion'),
+                'estacion': props.get('estacion'),
+                'rio': props.get('rio'),
+                'region': props.get('region'),
+                'nivel_alerta': props.get('nivel_alerta'),
+                'estado': props.get('estado'),
+                'caudal_actual': props.get('caudal_actual'),
+                'timestamp': timestamp,
+                'fuente': props.get('fuente', 'DGA MOP'),
+                'lon': coords[0],
+                'lat': coords[1]
+            }
+            yield record
+    
+    return upsert_amenazas(
+        cursor,
+        'amenazas_inundaciones',
+        ['tipo_amenaza', 'estacion', 'rio', 'region', 'nivel_alerta',
+         'estado', 'caudal_actual', 'timestamp', 'fuente'],
+        registros(),
+        expira_ausentes=True,
+    )
 
 
-def cargar_trafico(cursor, filepath: Path) -> int:
+def cargar_incendios(cursor, features: Iterable[Dict[str, Any]]) -> CambiosTabla:
     """
-    Carga datos de tráfico vehicular desde archivo GeoJSON
+    Carga datos de incendios forestales desde un iterable de features GeoJSON.
+    Clave natural: id de evento EONET. El feed lista solo eventos abiertos, así que los
+    ausentes (cerrados) se expiran.
     """
-    logger.info(f"Cargando datos de tráfico desde {filepath}")
-    
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    features = data.get('features', [])
-    
-    if not features:
-        logger.warning("No se encontraron datos de tráfico para cargar")
-        return 0
-    
-    # Limpiar tabla antes de cargar
-    limpiar_tabla(cursor, 'amenazas_trafico')
+    logger.info("Cargando incendios")
     
-    query = """
-        INSERT INTO amenazas_trafico (
-            tipo_amenaza, nombre_segmento, distancia_km,
-            duracion_normal_min, duracion_con_trafico_min, retraso_min,
-            indice_congestion, nivel_alerta, factor_costo_adicional,
-            descripcion, timestamp, fuente, geom
-        ) VALUES (
-            %(tipo_amenaza)s, %(nombre_segmento)s, %(distancia_km)s,
-            %(duracion_normal_min)s, %(duracion_con_trafico_min)s, %(retraso_min)s,
-            %(indice_congestion)s, %(nivel_alerta)s, %(factor_costo_adicional)s,
-            %(descripcion)s, %(timestamp)s, %(fuente)s,
-            ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)
-        )
+    def registros():
+        for feature in features:
+            props = feature['properties']
+            coords = feature['geometry']['coordinates']
+        
+            # Convertir fecha_inicio si es string
+            fecha_inicio = parsear_fecha_iso(props.get('fecha_inicio'))
+        
+            record = {
+                'clave_origen': props.get('id_evento') or props.get('url_detalle')
+                    or f"{props.get('titulo')}|{props.get('fecha_inicio')}",
+                'tipo_amenaza': props.get('tipo_amenaza', 'incendio_forestal'),
+                'titulo': props.get('titulo'),
+                'descripcion': props.get('descripcion'),
+                'fecha_inicio': fecha_inicio,
+                'nivel_alerta': props.get('nivel_alerta', 'rojo'),
+                'categoria': props.get('categoria', 'wildfires'),
+                'url_detalle': props.get('url_detalle'),
+                'fuente': props.get('fuente', 'NASA EONET'),
+                'lon': coords[0],
+                'lat': coords[1]
+            }
+            yield record
+    
+    return upsert_amenazas(
+        cursor,
+        'amenazas_incendios',
+        ['tipo_amenaza', 'titulo', 'descripcion', 'fecha_inicio', 'nivel_alerta',
+         'categoria', 'url_detalle', 'fuente'],
+        registros(),
+        expira_ausentes=True,
+    )
+
+
+def cargar_trafico(cursor, features: Iterable[Dict[str, Any]]) -> CambiosTabla:
+    """
+    Carga datos de tráfico vehicular desde un iterable de features GeoJSON.
+    Clave natural: segmento + timestamp; cada medición reemplaza (expira) a la anterior.
     """
+    logger.info("Cargando datos de tráfico")
     
-    records = []
-    for feature in features:
-        props = feature['properties']
-        coords = feature['geometry']['coordinates']
+    def registros():
+        for feature in features:
+            props = feature['properties']
+            coords = feature['geometry']['coordinates']
         
-        # Convertir timestamp si es string
-        timestamp = props.get('timestamp')
-        if isinstance(timestamp, str):
-            try:
-                timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            except (ValueError, TypeError):
-                timestamp = None
+            # Convertir timestamp si es string
+            timestamp = parsear_fecha_iso(props.get('timestamp'))
         
-        record = {
-            'tipo_amenaza': props.get('tipo_amenaza', 'congestion_vehicular'),
-            'nombre_segmento': props.get('nombre_segmento'),
-            'distancia_km': props.get('distancia_km'),
-            'duracion_normal_min': props.get('duracion_normal_min'),
-            'duracion_con_trafico_min': props.get('duracion_con_trafico_min'),
-            'retraso_min': props.get('retraso_min'),
-            'indice_congestion': props.get('indice_congestion'),
-            'nivel_alerta': props.get('nivel_alerta'),
-            'factor_costo_adicional': props.get('factor_costo_adicional'),
-            'descripcion': props.get('descripcion'),
-            'timestamp': timestamp,
-            'fuente': props.get('fuente', 'Google Maps Directions API'),
-            'lon': coords[0],
-            'lat': coords[1]
-        }
-        records.append(record)
-    
-    execute_batch(cursor, query, records)
-    logger.info(f"✓ {len(records)} segmentos de tráfico cargados exitosamente")
-    return len(records)
+            record = {
+                'clave_origen': f"{props.get('nombre_segmento')}|{props.get('timestamp')}",
+                'tipo_amenaza': props.get('tipo_amenaza', 'congestion_vehicular'),
+                'nombre_segmento': props.get('nombre_segmento'),
+                'distancia_km': props.get('distancia_km'),
+                'duracion_normal_min': props.get('duracion_normal_min'),
+                'duracion_con_trafico_min': props.get('duracion_con_trafico_min'),
+                'retraso_min': props.get('retraso_min'),
+                'indice_congestion': props.get('indice_congestion'),
+                'nivel_alerta': props.get('nivel_alerta'),
+                'factor_costo_adicional': props.get('factor_costo_adicional'),
+                'descripcion': props.get('descripcion'),
+                'timestamp': timestamp,
+                'fuente': props.get('fuente', 'Google Maps Directions API'),
+                'lon': coords[0],
+                'lat': coords[1]
+            }
+            yield record
+    
+    return upsert_amenazas(
+        cursor,
+        'amenazas_trafico',
+        ['tipo_amenaza', 'nombre_segmento', 'distancia_km', 'duracion_normal_min',
+         'duracion_con_trafico_min', 'retraso_min', 'indice_congestion', 'nivel_alerta',
+         'factor_costo_adicional', 'descripcion', 'timestamp', 'fuente'],
+        registros(),
+        expira_ausentes=True,
+    )
+
+
+# (nombre de la fuente, tipo en amenazas_activas, función de carga)
+CARGADORES = [
+    ('sismos', 'sismo', cargar_sismos),
+    ('inundaciones', 'inundacion', cargar_inundaciones),
+    ('incendios', 'incendio', cargar_incendios),
+    ('trafico', 'trafico', cargar_trafico),
+]
+
+
+def cargar_amenazas(cursor, datos: Dict[str, Iterable[Dict[str, Any]]]) -> Dict[str, CambiosTabla]:
+    """
+    Carga las fuentes presentes en `datos` (nombre -> features GeoJSON) y devuelve las filas
+    que cambiaron por fuente. Solo si hubo cambios se refresca amenazas_activas (para esos
+    tipos), se incrementa la versión de la capa y se publica el delta en amenazas_cambios.
+    Al final purga las filas expiradas antiguas y el historial de cambios viejo.
+    No confirma la transacción.
+    """
+    migrar_esquema_amenazas(cursor)
+
+    cambios: Dict[str, CambiosTabla] = {}
+    tipos_modificados = []
+    for nombre, tipo, cargar in CARGADORES:
+        if nombre not in datos:
+            continue
+        cambios[nombre] = cargar(cursor, datos[nombre])
+        if cambios[nombre].total:
+            tipos_modificados.append(tipo)
+
+    # Siempre se refresca para descartar vencimientos; con lista vacía solo se aplican esos
+    refrescar_amenazas_activas(cursor, tipos_modificados)
+    if tipos_modificados:
+        version = registrar_version_datos(cursor, 'amenazas')
+        if version is not None:
+            registrar_cambios(cursor, version, list(cambios.values()))
+    else:
+        logger.info("Ninguna fuente cambió; se conserva la versión de la capa 'amenazas'")
+    purgar_amenazas(cursor)
+    return cambios
+
+
+def leer_features(filepath: Path) -> Iterator[Dict[str, Any]]:
+    """
+    Recorre los features de un archivo GeoJSON con un parser incremental, sin cargarlo entero
+    """
+    logger.info(f"Leyendo {filepath}")
+    with open(filepath, 'rb') as f:
+        yield from ijson.items(f, 'features.item', use_float=True)
 
 
 def verificar_archivos() -> Dict[str, Path]:
@@ -375,28 +618,17 @@ def main():
     
     # Cargar datos
     logger.info("\n[3/3] Cargando datos de amenazas...")
-    total_registros = 0
     
     try:
-        # Cargar cada tipo de amenaza si el archivo existe
-        if 'sismos' in archivos:
-            total_registros += cargar_sismos(cursor, archivos['sismos'])
-        
-        if 'inundaciones' in archivos:
-            total_registros += cargar_inundaciones(cursor, archivos['inundaciones'])
-        
-        if 'incendios' in archivos:
-            total_registros += cargar_incendios(cursor, archivos['incendios'])
-        
-        if 'trafico' in archivos:
-            total_registros += cargar_trafico(cursor, archivos['trafico'])
-        
+        datos = {nombre: leer_features(path) for nombre, path in archivos.items()}
+        cambios = cargar_amenazas(cursor, datos)
+
         # Confirmar cambios
         conn.commit()
         
         logger.info("\n" + "=" * 70)
         logger.info(f"✓ CARGA COMPLETADA EXITOSAMENTE")
-        logger.info(f"✓ Total de registros cargados: {total_registros}")
+        logger.info(f"✓ Filas modificadas: {sum(c.total for c in cambios.values())}")
         logger.info("=" * 70)
         
     except Exception as e:
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import functools
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from flask import jsonify
+
+
+class Overloaded(Exception):
+    """La clase de trabajo no pudo admitir la petición dentro de su plazo."""
+
+    def __init__(self, work_class: str, reason: str, retry_after_s: int) -> None:
+        super().__init__(f"{work_class}: {reason}")
+        self.work_class = work_class
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class WorkClass:
+    """Cola acotada con límite de concurrencia y plazo máximo de espera para una clase de endpoints."""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, queue_deadline_s: float) -> None:
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_deadline_s = queue_deadline_s
+
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+        # Promedio móvil del tiempo de servicio, para estimar Retry-After
+        self._service_time_s = 1.0
+
+    def _retry_after(self) -> int:
+        backlog = (self.queued + self.in_flight) / self.concurrency
+        return max(1, math.ceil(backlog * self._service_time_s))
+
+    def acquire(self) -> None:
+        # Camino rápido: hay un cupo libre
+        if self._slots.acquire(blocking=False):
+            with self._lock:
+                self.in_flight += 1
+                self.admitted += 1
+            return
+
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise Overloaded(self.name, "cola llena", self._retry_after())
+            self.queued += 1
+
+        acquired = self._slots.acquire(timeout=self.queue_deadline_s)
+        with self._lock:
+            self.queued -= 1
+            if not acquired:
+                self.rejected_deadline += 1
+                raise Overloaded(self.name, "plazo de espera agotado", self._retry_after())
+            self.in_flight += 1
+            self.admitted += 1
+
+    def release(self, elapsed_s: float) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._service_time_s = 0.8 * self._service_time_s + 0.2 * elapsed_s
+        self._slots.release()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "max_queue": self.max_queue,
+                "queue_deadline_s": self.queue_deadline_s,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_deadline": self.rejected_deadline,
+                "avg_service_time_s": round(self._service_time_s, 4),
+            }
+
+
+def _work_class_from_env(name: str, concurrency: int, max_queue: int, queue_deadline_s: float) -> WorkClass:
+    prefix = f"ADMISSION_{name.upper()}_"
+    return WorkClass(
+        name,
+        concurrency=int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+        max_queue=int(os.getenv(prefix + "QUEUE", str(max_queue))),
+        queue_deadline_s=float(os.getenv(prefix + "DEADLINE_S", str(queue_deadline_s))),
+    )
+
+
+# Ruteo es caro y acotado; las capas del mapa (teselas/bbox) y metadata son baratas y
+# tienen cupos propios para no quedar bloqueadas detrás de rutas largas.
+WORK_CLASSES: Dict[str, WorkClass] = {
+    "routing": _work_class_from_env("routing", concurrency=4, max_queue=8, queue_deadline_s=2.0),
+    "tiles": _work_class_from_env("tiles", concurrency=8, max_queue=32, queue_deadline_s=1.0),
+    "metadata": _work_class_from_env("metadata", concurrency=8, max_queue=64, queue_deadline_s=1.0),
+}
+
+
+def admission(work_class: str) -> Callable:
+    """Decorador de vista Flask: admite la petición en `work_class` o responde 503 con Retry-After."""
+
+    target = WORK_CLASSES[work_class]
+
+    def decorator(view: Callable) -> Callable:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                target.acquire()
+            except Overloaded as exc:
+                response = jsonify(
+                    {
+                        "error": "El servidor está sobrecargado; reintente más tarde.",
+                        "clase": exc.work_class,
+                        "motivo": exc.reason,
+                    }
+                )
+                response.status_code = 503
+                response.headers["Retry-After"] = str(exc.retry_after_s)
+                return response
+
+            started = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                target.release(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def admission_stats(work_class: Optional[str] = None) -> Dict[str, Dict[str, object]]:
+    classes = [work_class] if work_class else list(WORK_CLASSES)
+    return {name: WORK_CLASSES[name].stats() for name in classes}
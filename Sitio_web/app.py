@@ -1,19 +1,52 @@
 from __future__ import annotations
 
 import json
+import math
 import os
+import threading
+import time
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Sequence, Tuple
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 import psycopg
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, abort, g, has_request_context, jsonify, render_template, request
 from psycopg.rows import dict_row
 
+from admission import WORK_CLASSES, admission, admission_stats
+from export_format import (
+    COLUMNAR_MIMETYPE,
+    ExportCursor,
+    InvalidCursorError,
+    encode_columnar,
+    iter_ndjson,
+)
+import metrics
+from response_cache import CachedBody, CompressedResponseCache, choose_encoding
+from shared_state import register_preload
+from slow_queries import SlowQueryLog
+from snapshots import SnapshotCache
+
 load_dotenv()
 
 app = Flask(__name__)
 
+# Segundos durante los que se reutiliza la versión de datos leída desde `versiones_datos`
+DATA_VERSION_TTL_S = float(os.getenv("DATA_VERSION_TTL_S", "5"))
+# Las amenazas vencen con NOW(), así que su caché expira aunque no cambie la versión
+AMENAZAS_CACHE_MAX_AGE_S = float(os.getenv("AMENAZAS_CACHE_MAX_AGE_S", "300"))
+
+# Filas por página en la exportación masiva de la red vial
+EXPORT_DEFAULT_PAGE_SIZE = int(os.getenv("EXPORT_DEFAULT_PAGE_SIZE", "10000"))
+EXPORT_MAX_PAGE_SIZE = int(os.getenv("EXPORT_MAX_PAGE_SIZE", "50000"))
+
+RESPONSE_CACHE = CompressedResponseCache(
+    max_bytes=int(float(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    gzip_level=int(os.getenv("RESPONSE_CACHE_GZIP_LEVEL", "6")),
+    brotli_quality=int(os.getenv("RESPONSE_CACHE_BROTLI_QUALITY", "5")),
+)
+
 
 @dataclass(frozen=True)
 class RouteNode:
@@ -23,6 +56,8 @@ class RouteNode:
     lon: float
     lat: float
     label: str
+    # Componente conexa del nodo (1 = red principal); None si la carga no la calculó
+    component: Optional[int] = None
 
 
 def _load_db_config() -> dict:
@@ -52,10 +87,80 @@ def _load_db_config() -> dict:
 DB_CONFIG = _load_db_config()
 
 
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").lower() in {"1", "true", "yes"}
+
+
+# Registro opcional (SLOW_QUERY_LOG=1) de consultas lentas con muestreo de EXPLAIN ANALYZE
+SLOW_QUERIES = SlowQueryLog(
+    enabled=_env_flag("SLOW_QUERY_LOG"),
+    connect=lambda: psycopg.connect(**DB_CONFIG),
+    top_n=int(os.getenv("SLOW_QUERY_TOP_N", "50")),
+    threshold_ms=float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "500")),
+    sample_rate=float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "0.1")),
+    plans_path=Path(os.getenv("SLOW_QUERY_PLANS_PATH", Path(__file__).resolve().parent / "slow_query_plans.jsonl")),
+)
+
+
+class _TimedCursor(psycopg.Cursor):
+    """Cursor que informa la duración de cada sentencia al registro de consultas lentas."""
+
+    def execute(self, query, params=None, **kwargs):
+        if not SLOW_QUERIES.enabled:
+            return super().execute(query, params, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            context = ""
+            if has_request_context():
+                context = request.url_rule.rule if request.url_rule else request.path
+            SLOW_QUERIES.record(query, params, time.perf_counter() - started, context=context)
+
+
+class _TrackedConnection(psycopg.Connection):
+    """Conexión que mantiene al día la métrica de conexiones abiertas."""
+
+    _tracked = False
+
+    def close(self) -> None:
+        if self._tracked:
+            self._tracked = False
+            metrics.DB_CONNECTIONS_IN_USE.dec()
+        super().close()
+
+
 def get_db_connection() -> psycopg.Connection:
     """Abre una conexión usando row_factory dict para acceder por nombre de columna."""
 
-    return psycopg.connect(**DB_CONFIG, row_factory=dict_row)
+    with metrics.DB_CONNECT_LATENCY.time():
+        conn = _TrackedConnection.connect(**DB_CONFIG, row_factory=dict_row, cursor_factory=_TimedCursor)
+    conn._tracked = True
+    metrics.DB_CONNECTIONS_IN_USE.inc()
+    return conn
+
+
+@app.before_request
+def _start_request_timer() -> None:
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_metrics(response: Response) -> Response:
+    started = g.pop("request_started", None)
+    route = request.url_rule.rule if request.url_rule else "sin_ruta"
+    if started is not None:
+        metrics.REQUEST_LATENCY.observe(
+            time.perf_counter() - started,
+            route=route,
+            method=request.method,
+            status=str(response.status_code),
+        )
+    if response.content_length is not None:
+        metrics.RESPONSE_SIZE.observe(response.content_length, route=route)
+    metrics.REGISTRY.maybe_flush()
+    return response
 
 
 def _parse_bbox(raw_bbox: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
@@ -79,15 +184,104 @@ def _parse_bbox(raw_bbox: Optional[str]) -> Optional[Tuple[float, float, float,
     return min_lon, min_lat, max_lon, max_lat
 
 
-def _geojson_from_query(query: str, params: Optional[Sequence] = None) -> dict:
+_data_versions: Dict[str, Tuple[float, Optional[int]]] = {}
+_data_versions_lock = threading.Lock()
+
+
+def _data_version(capa: str) -> Optional[int]:
+    """Obtiene la versión vigente de una capa de datos, reutilizándola durante DATA_VERSION_TTL_S.
+
+    Devuelve None si la base aún no tiene la tabla `versiones_datos` (esquema anterior), en cuyo
+    caso las respuestas no se cachean.
+    """
+
+    now = time.monotonic()
+    with _data_versions_lock:
+        cached = _data_versions.get(capa)
+    if cached and now - cached[0] < DATA_VERSION_TTL_S:
+        return cached[1]
+
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM versiones_datos WHERE capa = %s;", (capa,))
+                row = cur.fetchone()
+        version = int(row["version"]) if row else 0
+    except psycopg.errors.UndefinedTable:
+        version = None
+
+    with _data_versions_lock:
+        _data_versions[capa] = (now, version)
+    return version
+
+
+def _cached_json_response(
+    capa: str,
+    build_payload: Callable[[], dict],
+    max_age_s: Optional[float] = None,
+) -> Response:
+    """Sirve un payload JSON desde la caché precomprimida, regenerándolo si cambió la versión de `capa`."""
+
+    version = _data_version(capa)
+    if version is None:
+        return jsonify(build_payload())
+
+    key = (request.path, tuple(sorted(request.args.items(multi=True))))
+    entry = RESPONSE_CACHE.get_or_build(
+        key,
+        version,
+        lambda: _serialize_payload(build_payload()),
+        max_age_s=max_age_s,
+    )
+
+    return _send_cached_body(entry)
+
+
+def _serialize_payload(payload: dict) -> bytes:
+    """Serializa un payload con el proveedor JSON de Flask (maneja Decimal, fechas, etc.)."""
+
+    return app.json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def _send_cached_body(entry: CachedBody) -> Response:
+    """Construye la respuesta para un cuerpo precomprimido según `Accept-Encoding` e `If-None-Match`."""
+
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"), entry.bodies)
+    # Cualquier variante del mismo cuerpo sirve para revalidar; If-None-Match usa comparación débil
+    if any(request.if_none_match.contains_weak(entry.etag_for(variant)) for variant in entry.bodies):
+        response = Response(status=304)
+    else:
+        response = Response(entry.bodies[encoding], mimetype="application/json")
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+
+    response.set_etag(entry.etag_for(encoding))
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["X-Data-Version"] = str(entry.version)
+    return response
+
+
+def _geojson_from_query(
+    query: str,
+    params: Optional[Sequence] = None,
+    conn: Optional[psycopg.Connection] = None,
+) -> dict:
     """Ejecuta un SELECT que expone columnas `geometry` y `properties` como JSON y las empaqueta en GeoJSON."""
 
     params = params or ()
 
-    with get_db_connection() as conn:
+    close_conn = False
+    if conn is None:
+        conn = get_db_connection()
+        close_conn = True
+
+    try:
         with conn.cursor() as cur:
             cur.execute(query, params)
             rows = cur.fetchall()
+    finally:
+        if close_conn:
+            conn.close()
 
     features: List[Dict] = []
     for row in rows:
@@ -124,7 +318,8 @@ def _fetch_route_node(node_id: int, conn: Optional[psycopg.Connection] = None) -
                 SELECT
                     id,
                     ST_X(geom)::float AS lon,
-                    ST_Y(geom)::float AS lat
+                    ST_Y(geom)::float AS lat,
+                    componente
                 FROM nodos_carreteras
                 WHERE id = %s;
                 """,
@@ -138,11 +333,16 @@ def _fetch_route_node(node_id: int, conn: Optional[psycopg.Connection] = None) -
     if not row:
         raise ValueError(f"El nodo {node_id} no existe en nodos_carreteras.")
 
-    return RouteNode(node_id=row["id"], lon=row["lon"], lat=row["lat"], label=f"Nodo {row['id']}")
+    return RouteNode(
+        node_id=row["id"], lon=row["lon"], lat=row["lat"], label=f"Nodo {row['id']}", component=row["componente"]
+    )
 
 
 def _get_default_route_nodes(conn: Optional[psycopg.Connection] = None) -> Tuple[RouteNode, RouteNode]:
-    """Selecciona dos nodos de referencia (mínimo y máximo id) para la ruta de demostración."""
+    """
+    Selecciona dos nodos de referencia (mínimo y máximo id de la componente principal, si se
+    calculó) para la ruta de demostración.
+    """
 
     close_conn = False
     if conn is None:
@@ -156,8 +356,10 @@ def _get_default_route_nodes(conn: Optional[psycopg.Connection] = None) -> Tuple
                 SELECT
                     id,
                     ST_X(geom)::float AS lon,
-                    ST_Y(geom)::float AS lat
+                    ST_Y(geom)::float AS lat,
+                    componente
                 FROM nodos_carreteras
+                WHERE componente = 1 OR NOT EXISTS (SELECT 1 FROM nodos_carreteras WHERE componente = 1)
                 ORDER BY id ASC
                 LIMIT 1;
                 """
@@ -169,8 +371,10 @@ def _get_default_route_nodes(conn: Optional[psycopg.Connection] = None) -> Tuple
                 SELECT
                     id,
                     ST_X(geom)::float AS lon,
-                    ST_Y(geom)::float AS lat
+                    ST_Y(geom)::float AS lat,
+                    componente
                 FROM nodos_carreteras
+                WHERE componente = 1 OR NOT EXISTS (SELECT 1 FROM nodos_carreteras WHERE componente = 1)
                 ORDER BY id DESC
                 LIMIT 1;
                 """
@@ -191,12 +395,14 @@ def _get_default_route_nodes(conn: Optional[psycopg.Connection] = None) -> Tuple
             lon=start_row["lon"],
             lat=start_row["lat"],
             label=f"Nodo {start_row['id']}",
+            component=start_row["componente"],
         ),
         RouteNode(
             node_id=end_row["id"],
             lon=end_row["lon"],
             lat=end_row["lat"],
             label=f"Nodo {end_row['id']}",
+            component=end_row["componente"],
         ),
     )
 
@@ -221,6 +427,7 @@ def index():
 
 
 @app.route("/api/infrastructure")
+@admission("tiles")
 def api_infrastructure():
     """Expone la red vial (aristas) en GeoJSON, con filtrado opcional por bbox."""
 
@@ -249,60 +456,220 @@ def api_infrastructure():
         LIMIT 5000;
     """
 
-    data = _geojson_from_query(query, params)
-    return jsonify(data)
+    return _cached_json_response("infraestructura", lambda: _geojson_from_query(query, params))
 
 
-@app.route("/api/metadata")
-def api_metadata():
-    """Expone estaciones de servicio y pórticos de peaje con información básica."""
+@app.route("/api/export/aristas")
+@admission("tiles")
+def api_export_aristas():
+    """Exporta `aristas_carreteras` completa paginando por keyset sobre `id` (sin OFFSET).
 
-    metadata_query = """
-        SELECT
-            CONCAT('estacion_', id) AS id,
-            json_build_object(
-                'tipo', 'estacion_servicio',
-                'nombre', nombre,
-                'marca', marca,
-                'direccion', direccion,
-                'comuna', comuna,
-                'region', region,
-                'horario', horario
-            ) AS properties,
-            ST_AsGeoJSON(ubicacion::geometry)::json AS geometry
-        FROM estaciones_servicio
-        WHERE ubicacion IS NOT NULL
+    La primera página acepta `desde_id` (exclusivo), `hasta_id` (inclusivo) y `bbox`; las
+    siguientes solo `cursor`, que se entrega en la cabecera `X-Next-Cursor` mientras queden filas.
+    `formato` puede ser `ndjson` (por defecto) o `columnar`.
+    """
 
-        UNION ALL
+    formato = request.args.get("formato", "ndjson")
+    if formato not in {"ndjson", "columnar"}:
+        return jsonify({"error": "El parámetro formato debe ser 'ndjson' o 'columnar'."}), 400
 
-        SELECT
-            CONCAT('portico_', p.id) AS id,
-            json_build_object(
-                'tipo', 'portico_peaje',
-                'autopista', a.nombre,
-                'tramo', a.tramo_descripcion,
-                'sentido', p.sentido,
-                'referencia', p.referencia_tramo,
-                'longitud_km', p.longitud_km
-            ) AS properties,
-            ST_AsGeoJSON(p.ubicacion::geometry)::json AS geometry
-        FROM porticos p
-        INNER JOIN autopistas a ON a.id = p.autopista_id
-        WHERE p.ubicacion IS NOT NULL;
-    """
+    limite = request.args.get("limite", EXPORT_DEFAULT_PAGE_SIZE, type=int)
+    limite = max(1, min(limite, EXPORT_MAX_PAGE_SIZE))
+    version = _data_version("infraestructura") or 0
 
-    summary_query = """
-        SELECT
-            (SELECT COUNT(*) FROM estaciones_servicio WHERE ubicacion IS NOT NULL) AS estaciones_servicio,
-            (SELECT COUNT(*) FROM porticos WHERE ubicacion IS NOT NULL) AS porticos,
-            (SELECT COUNT(*) FROM vehiculos) AS modelos_vehiculares;
+    raw_cursor = request.args.get("cursor")
+    try:
+        if raw_cursor:
+            cursor = ExportCursor.decode(raw_cursor)
+        else:
+            cursor = ExportCursor(
+                after_id=request.args.get("desde_id", 0, type=int),
+                until_id=request.args.get("hasta_id", type=int),
+                version=version,
+                bbox=_parse_bbox(request.args.get("bbox")),
+            )
+    except (InvalidCursorError, ValueError) as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    if cursor.version != version:
+        return (
+            jsonify(
+                {
+                    "error": "La red vial fue recargada durante la exportación; reinicie desde el comienzo.",
+                    "version_cursor": cursor.version,
+                    "version_actual": version,
+                }
+            ),
+            409,
+        )
+
+    filters = ["id > %s"]
+    params: List = [cursor.after_id]
+    if cursor.until_id is not None:
+        filters.append("id <= %s")
+        params.append(cursor.until_id)
+    if cursor.bbox:
+        filters.append("geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)")
+        params.extend(cursor.bbox)
+    params.append(limite)
+
+    geometry_column = "ST_AsBinary(geom) AS wkb" if formato == "columnar" else "ST_AsGeoJSON(geom)::json AS geometry"
+    query = f"""
+        SELECT id, source, target, costo_longitud_m, {geometry_column}
+        FROM aristas_carreteras
+        WHERE {' AND '.join(filters)}
+        ORDER BY id
+        LIMIT %s;
     """
 
-    geojson = _geojson_from_query(metadata_query)
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+
+    if formato == "columnar":
+        response = Response(encode_columnar(rows, version), mimetype=COLUMNAR_MIMETYPE)
+    else:
+        response = Response(iter_ndjson(rows), mimetype="application/x-ndjson")
+
+    response.headers["X-Data-Version"] = str(version)
+    response.headers["X-Row-Count"] = str(len(rows))
+    if len(rows) == limite:
+        next_cursor = ExportCursor(
+            after_id=rows[-1]["id"],
+            until_id=cursor.until_id,
+            version=version,
+            bbox=cursor.bbox,
+        )
+        response.headers["X-Next-Cursor"] = next_cursor.encode()
+    return response
+
+
+@app.route("/api/export/aristas/shards")
+@admission("tiles")
+def api_export_aristas_shards():
+    """Divide el rango de ids de `aristas_carreteras` en `n` fragmentos para descargarlos en paralelo."""
+
+    shards = max(1, min(request.args.get("n", 4, type=int), 256))
+    try:
+        bbox = _parse_bbox(request.args.get("bbox"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    version = _data_version("infraestructura") or 0
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM aristas_carreteras;")
+            row = cur.fetchone() or {}
+
+    min_id, max_id = row.get("min_id"), row.get("max_id")
+    if min_id is None:
+        return jsonify({"version": version, "shards": []})
+
+    # Los ids son SERIAL, por lo que un reparto uniforme del rango da fragmentos parejos
+    step = max(1, -(-(max_id - min_id + 1) // shards))
+    result = []
+    lower = min_id - 1
+    while lower < max_id:
+        upper = min(lower + step, max_id)
+        result.append(
+            {
+                "desde_id": lower,
+                "hasta_id": upper,
+                "cursor": ExportCursor(after_id=lower, until_id=upper, version=version, bbox=bbox).encode(),
+            }
+        )
+        lower = upper
+
+    return jsonify({"version": version, "shards": result})
+
+
+METADATA_QUERY_TEMPLATE = """
+    SELECT
+        CONCAT('estacion_', id) AS id,
+        json_build_object(
+            'tipo', 'estacion_servicio',
+            'nombre', nombre,
+            'marca', marca,
+            'direccion', direccion,
+            'comuna', comuna,
+            'region', region,
+            'horario', horario
+        ) AS properties,
+        ST_AsGeoJSON(ubicacion::geometry)::json AS geometry
+    FROM estaciones_servicio
+    WHERE ubicacion IS NOT NULL{filtro_estaciones}
+
+    UNION ALL
+
+    SELECT
+        CONCAT('portico_', p.id) AS id,
+        json_build_object(
+            'tipo', 'portico_peaje',
+            'autopista', a.nombre,
+            'tramo', a.tramo_descripcion,
+            'sentido', p.sentido,
+            'referencia', p.referencia_tramo,
+            'longitud_km', p.longitud_km
+        ) AS properties,
+        ST_AsGeoJSON(p.ubicacion::geometry)::json AS geometry
+    FROM porticos p
+    INNER JOIN autopistas a ON a.id = p.autopista_id
+    WHERE p.ubicacion IS NOT NULL{filtro_porticos};
+"""
+
+METADATA_SUMMARY_QUERY = """
+    SELECT
+        (SELECT COUNT(*) FROM estaciones_servicio WHERE ubicacion IS NOT NULL) AS estaciones_servicio,
+        (SELECT COUNT(*) FROM porticos WHERE ubicacion IS NOT NULL) AS porticos,
+        (SELECT COUNT(*) FROM vehiculos) AS modelos_vehiculares;
+"""
+
+METADATA_CLUSTER_QUERY = """
+    SELECT
+        CONCAT('cluster_', tipo, '_', zoom, '_', celda_x, '_', celda_y) AS id,
+        json_build_object(
+            'tipo', 'cluster',
+            'tipo_punto', tipo,
+            'conteo', conteo,
+            'precios', precios,
+            'marca_dominante', marca_dominante
+        ) AS properties,
+        ST_AsGeoJSON(geom)::json AS geometry
+    FROM metadata_grilla
+    WHERE zoom = %s{filtro_bbox};
+"""
+
+# Bajo este zoom /api/metadata responde agregados por celda en vez de puntos individuales
+METADATA_CLUSTER_MAX_ZOOM = int(os.getenv("METADATA_CLUSTER_MAX_ZOOM", "12"))
+# Debe coincidir con el p_zoom_max por defecto de refrescar_metadata_grilla()
+METADATA_GRILLA_ZOOM_MAX = 11
+
+
+def _metadata_grid_available(conn: psycopg.Connection) -> bool:
+    """False si la base se creó antes de la grilla de agrupación (schema.sql no se volvió a aplicar)."""
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT to_regclass('metadata_grilla') IS NOT NULL "
+            "AND to_regproc('asegurar_metadata_grilla') IS NOT NULL AS disponible;"
+        )
+        row = cur.fetchone()
+    return bool(row and row["disponible"])
+
 
+def _build_metadata_payload() -> dict:
+    """Consulta estaciones, pórticos y conteos para armar el payload completo de `/api/metadata`."""
+
+    query = METADATA_QUERY_TEMPLATE.format(filtro_estaciones="", filtro_porticos="")
     with get_db_connection() as conn:
+        if _metadata_grid_available(conn):
+            # Aprovecha el refresco del snapshot para mantener al día la grilla de agrupación
+            with conn.cursor() as cur:
+                cur.execute("SELECT asegurar_metadata_grilla();")
+        geojson = _geojson_from_query(query, conn=conn)
         with conn.cursor() as cur:
-            cur.execute(summary_query)
+            cur.execute(METADATA_SUMMARY_QUERY)
             summary_row = cur.fetchone() or {}
 
     summary = {
@@ -310,15 +677,226 @@ def api_metadata():
         "porticos": summary_row.get("porticos", 0),
         "modelos_vehiculares": summary_row.get("modelos_vehiculares", 0),
     }
+    return {"geojson": geojson, "summary": summary}
+
+
+def _build_metadata_view_payload(zoom: Optional[int], bbox: Optional[Tuple[float, float, float, float]]) -> dict:
+    """
+    Arma `/api/metadata` para una vista concreta: agregados de la grilla o detalle dentro del bbox.
+    La grilla la reconstruye el refresco del snapshot; sin ella se responde el detalle.
+    """
+
+    with get_db_connection() as conn:
+        clustered = zoom is not None and zoom < METADATA_CLUSTER_MAX_ZOOM and _metadata_grid_available(conn)
+        if clustered:
+            filtro = " AND geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)" if bbox else ""
+            params: List = [max(0, min(zoom, METADATA_GRILLA_ZOOM_MAX)), *(bbox or ())]
+            geojson = _geojson_from_query(METADATA_CLUSTER_QUERY.format(filtro_bbox=filtro), params, conn)
+        else:
+            filtro = " AND {col} && ST_MakeEnvelope(%s, %s, %s, %s, 4326)::geography" if bbox else ""
+            query = METADATA_QUERY_TEMPLATE.format(
+                filtro_estaciones=filtro.format(col="ubicacion"),
+                filtro_porticos=filtro.format(col="p.ubicacion"),
+            )
+            geojson = _geojson_from_query(query, (*bbox, *bbox) if bbox else (), conn)
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) AS modelos_vehiculares FROM vehiculos;")
+            vehiculos_row = cur.fetchone() or {}
+
+    summary = {"estaciones_servicio": 0, "porticos": 0, "modelos_vehiculares": vehiculos_row.get("modelos_vehiculares", 0)}
+    summary_keys = {"estacion_servicio": "estaciones_servicio", "portico_peaje": "porticos"}
+    for feature in geojson["features"]:
+        properties = feature["properties"]
+        if clustered:
+            summary[summary_keys[properties["tipo_punto"]]] += properties["conteo"]
+        else:
+            summary[summary_keys[properties["tipo"]]] += 1
+
+    return {"geojson": geojson, "summary": summary, "agrupado": clustered}
+
+
+# Snapshot serializado y precomprimido de /api/metadata, refrescado en segundo plano
+METADATA_SNAPSHOT: SnapshotCache[CachedBody] = SnapshotCache(
+    "metadata",
+    build=lambda version: RESPONSE_CACHE.encode(version or 0, _serialize_payload(_build_metadata_payload())),
+    version_fn=lambda: _data_version("metadata"),
+    refresh_interval_s=float(os.getenv("METADATA_SNAPSHOT_REFRESH_S", "30")),
+)
+
+
+metrics.REGISTRY.counter(
+    "ruteo_response_cache_requests_total",
+    "Consultas a la caché de respuestas precomprimidas por resultado.",
+    ("result",),
+).set_function(lambda: {(result,): RESPONSE_CACHE.stats()[result] for result in ("hits", "misses", "evictions")})
+metrics.REGISTRY.gauge(
+    "ruteo_response_cache_bytes",
+    "Bytes ocupados por la caché de respuestas precomprimidas.",
+).set_function(lambda: {(): RESPONSE_CACHE.stats()["bytes"]})
+metrics.REGISTRY.gauge(
+    "ruteo_snapshot_age_seconds",
+    "Antigüedad del snapshot en memoria (máximo entre procesos).",
+    ("snapshot",),
+    multiprocess_mode="max",
+).set_function(lambda: {("metadata",): METADATA_SNAPSHOT.stats()["age_s"] or 0.0})
+metrics.REGISTRY.gauge(
+    "ruteo_admission_queue_depth",
+    "Peticiones esperando cupo por clase de trabajo.",
+    ("work_class",),
+).set_function(lambda: {(name,): wc.queued for name, wc in WORK_CLASSES.items()})
+metrics.REGISTRY.gauge(
+    "ruteo_admission_in_flight",
+    "Peticiones en ejecución por clase de trabajo.",
+    ("work_class",),
+).set_function(lambda: {(name,): wc.in_flight for name, wc in WORK_CLASSES.items()})
+metrics.REGISTRY.counter(
+    "ruteo_admission_rejected_total",
+    "Peticiones rechazadas con 503 por clase de trabajo y motivo.",
+    ("work_class", "reason"),
+).set_function(
+    lambda: {
+        key: value
+        for name, wc in WORK_CLASSES.items()
+        for key, value in (((name, "queue_full"), wc.rejected_queue_full), ((name, "deadline"), wc.rejected_deadline))
+    }
+)
+
+
+def _preload_cached_path(path: str) -> None:
+    """Construye en la caché de respuestas la respuesta de `path` sin pasar por los hooks de métricas."""
 
-    return jsonify({"geojson": geojson, "summary": summary})
+    with app.test_request_context(path):
+        app.view_functions[request.endpoint](**(request.view_args or {}))
+
+
+# En el servidor pre-fork (serve.py) esto corre en el maestro y los workers heredan el snapshot
+# y las respuestas precomprimidas sin volver a consultarlas.
+register_preload("metadata_snapshot", lambda: METADATA_SNAPSHOT.refresh(force=True))
+for _preload_path in filter(None, os.getenv("PRELOAD_PATHS", "/api/infrastructure").split(",")):
+    register_preload(_preload_path.strip(), lambda path=_preload_path.strip(): _preload_cached_path(path))
+
+
+@app.route("/api/metadata")
+@admission("metadata")
+def api_metadata():
+    """Expone estaciones de servicio y pórticos de peaje con información básica.
+
+    Con `zoom` menor a METADATA_CLUSTER_MAX_ZOOM responde agregados por celda (conteo, precios
+    mínimo/promedio por combustible y marca dominante); `bbox` acota la vista en ambos modos.
+    """
+
+    zoom = request.args.get("zoom", type=int)
+    try:
+        bbox = _parse_bbox(request.args.get("bbox"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    if bbox is None and (zoom is None or zoom >= METADATA_CLUSTER_MAX_ZOOM):
+        snapshot = METADATA_SNAPSHOT.get()
+        response = _send_cached_body(snapshot.value)
+        response.headers["Age"] = str(int(snapshot.age_s))
+        return response
+
+    return _cached_json_response("metadata", lambda: _build_metadata_view_payload(zoom, bbox))
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Métricas del servicio en formato de texto Prometheus (agregadas entre workers)."""
+
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/admin/slow-queries")
+def admin_slow_queries():
+    """Consultas más lentas del proceso y planes EXPLAIN ANALYZE muestreados.
+
+    Requiere la cabecera `X-Admin-Token` igual a ADMIN_TOKEN; sin ADMIN_TOKEN solo se atiende
+    desde localhost.
+    """
+
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if admin_token:
+        if request.headers.get("X-Admin-Token") != admin_token:
+            abort(403)
+    elif request.remote_addr not in {"127.0.0.1", "::1"}:
+        abort(403)
+
+    return jsonify(
+        {
+            "pid": os.getpid(),
+            "estado": SLOW_QUERIES.stats(),
+            "top": SLOW_QUERIES.top(),
+            "planes": SLOW_QUERIES.plans(),
+        }
+    )
+
+
+@app.route("/api/estado")
+def api_estado():
+    """Estado de las cachés en memoria del proceso (edad de snapshots, aciertos, bytes)."""
+
+    return jsonify(
+        {
+            "pid": os.getpid(),
+            "version_grafo": _data_version("infraestructura"),
+            "snapshots": {"metadata": METADATA_SNAPSHOT.stats()},
+            "response_cache": RESPONSE_CACHE.stats(),
+            "admission": admission_stats(),
+        }
+    )
+
+
+AMENAZA_TIPOS = ("sismo", "inundacion", "incendio", "trafico")
+AMENAZA_RESUMEN_KEYS = {"sismo": "sismos", "inundacion": "inundaciones", "incendio": "incendios", "trafico": "trafico"}
 
 
 @app.route("/api/amenazas")
+@admission("metadata")
 def api_amenazas():
-    """Consolida amenazas recientes desde la vista `vista_amenazas_activas`."""
+    """Expone las amenazas vigentes desde la capa materializada `amenazas_activas`.
+
+    Acepta `bbox` y `tipo` (lista separada por coma) como filtros opcionales. En bases creadas
+    antes de esa capa se consulta la vista `vista_amenazas_activas`.
+    """
+
+    try:
+        bbox = _parse_bbox(request.args.get("bbox"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    tipos = [item.strip() for item in request.args.get("tipo", "").split(",") if item.strip()]
+    invalidos = sorted(set(tipos) - set(AMENAZA_TIPOS))
+    if invalidos:
+        return jsonify({"error": f"Tipos de amenaza no válidos: {', '.join(invalidos)}."}), 400
+
+    filters: List[str] = []
+    params: List = []
+    if tipos:
+        filters.append("tipo = ANY(%s)")
+        params.append(tipos)
+    if bbox:
+        filters.append("geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)")
+        params.extend(bbox)
+
+    query = f"""
+        SELECT
+            CONCAT(tipo, '_', origen_id) AS id,
+            json_build_object(
+                'tipo', tipo,
+                'nivel_alerta', nivel_alerta,
+                'descripcion', descripcion,
+                'fecha', to_char(fecha, 'YYYY-MM-DD HH24:MI TZ'),
+                'fecha_carga', to_char(fecha_carga, 'YYYY-MM-DD HH24:MI TZ')
+            ) AS properties,
+            ST_AsGeoJSON(geom)::json AS geometry
+        FROM amenazas_activas
+        WHERE {' AND '.join(["vigente_hasta > NOW()", *filters])}
+        ORDER BY fecha DESC;
+    """
 
-    query = """
+    vista_query = f"""
         SELECT
             CONCAT(tipo, '_', row_number() OVER (ORDER BY fecha DESC, descripcion)) AS id,
             json_build_object(
@@ -330,33 +908,130 @@ def api_amenazas():
             ) AS properties,
             ST_AsGeoJSON(geom)::json AS geometry
         FROM vista_amenazas_activas
+        WHERE {' AND '.join(filters or ["TRUE"])}
         ORDER BY fecha DESC;
     """
 
-    geojson = _geojson_from_query(query)
-
     resumen_query = """
-        SELECT
-            COALESCE(SUM((tipo = 'sismo')::INT), 0) AS sismos,
-            COALESCE(SUM((tipo = 'inundacion')::INT), 0) AS inundaciones,
-            COALESCE(SUM((tipo = 'incendio')::INT), 0) AS incendios,
-            COALESCE(SUM((tipo = 'trafico')::INT), 0) AS trafico
-        FROM vista_amenazas_activas;
+        SELECT sismos, inundaciones, incendios, trafico
+        FROM amenazas_activas_resumen
+        WHERE proxima_expiracion IS NULL OR proxima_expiracion > NOW();
     """
 
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(resumen_query)
-            resumen_row = cur.fetchone() or {}
+    def build_payload() -> dict:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT to_regclass('amenazas_activas') IS NOT NULL "
+                    "AND to_regclass('amenazas_activas_resumen') IS NOT NULL AS materializada;"
+                )
+                materializada = cur.fetchone()["materializada"]
+            geojson = _geojson_from_query(query if materializada else vista_query, params, conn)
+
+            resumen_row = None
+            if materializada and not tipos and not bbox:
+                with conn.cursor() as cur:
+                    cur.execute(resumen_query)
+                    resumen_row = cur.fetchone()
+
+        if resumen_row is None:
+            # Con filtros, sin la capa materializada o si alguna amenaza venció desde la última
+            # carga, se cuenta lo devuelto
+            resumen_row = dict.fromkeys(AMENAZA_RESUMEN_KEYS.values(), 0)
+            for feature in geojson["features"]:
+                resumen_row[AMENAZA_RESUMEN_KEYS[feature["properties"]["tipo"]]] += 1
+
+        summary = {
+            "sismos": resumen_row.get("sismos", 0),
+            "inundaciones": resumen_row.get("inundaciones", 0),
+            "incendios": resumen_row.get("incendios", 0),
+            "trafico": resumen_row.get("trafico", 0),
+        }
+        return {"geojson": geojson, "summary": summary}
+
+    return _cached_json_response("amenazas", build_payload, max_age_s=AMENAZAS_CACHE_MAX_AGE_S)
+
+
+# Modos de búsqueda: el jerárquico solo relaja vías troncales (clases_via.troncal) a más de
+# ROUTE_HIERARCHY_RADIUS_M del origen y el destino
+ROUTE_MODES = ("completo", "jerarquico")
+ROUTE_HIERARCHY_RADIUS_M = float(os.getenv("ROUTE_HIERARCHY_RADIUS_M", "5000"))
+METERS_PER_DEGREE = 111_320.0
+
+# Aristas dirigidas para pgr_dijkstra: un costo negativo deshabilita ese sentido
+ROUTE_EDGES_SQL = """
+    SELECT
+        id,
+        source,
+        target,
+        CASE WHEN sentido = -1 THEN -1 ELSE costo_longitud_m END AS cost,
+        CASE WHEN sentido = 1 THEN -1 ELSE costo_longitud_m END AS reverse_cost
+    FROM aristas_carreteras
+    WHERE costo_longitud_m > 0
+"""
+
+
+# Snapping: entre los ROUTE_SNAP_CANDIDATES nodos más cercanos se prefiere la componente
+# principal; un nodo de otra componente solo gana si está ROUTE_SNAP_COMPONENT_PENALTY_M más cerca
+ROUTE_SNAP_CANDIDATES = int(os.getenv("ROUTE_SNAP_CANDIDATES", "32"))
+ROUTE_SNAP_COMPONENT_PENALTY_M = float(os.getenv("ROUTE_SNAP_COMPONENT_PENALTY_M", "250"))
+
+# Parámetros: lon, lat, lon, lat, candidatos, penalización en grados (ver _snap_params)
+SNAP_NODE_SQL = """
+    SELECT id, componente, geom
+    FROM (
+        SELECT id, componente, geom, geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326) AS distancia
+        FROM nodos_carreteras
+        ORDER BY geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
+        LIMIT %s
+    ) candidatos
+    ORDER BY distancia + CASE WHEN componente = 1 THEN 0 ELSE %s END
+    LIMIT 1
+"""
+
+
+def _snap_params(lon: float, lat: float) -> Tuple[float, float, float, float, int, float]:
+    return (lon, lat, lon, lat, ROUTE_SNAP_CANDIDATES, ROUTE_SNAP_COMPONENT_PENALTY_M / METERS_PER_DEGREE)
+
+
+def _components_disconnected(start_component: Optional[int], end_component: Optional[int]) -> bool:
+    """Extremos en componentes distintas: no hay camino y se evita la búsqueda completa."""
+
+    return start_component is not None and end_component is not None and start_component != end_component
+
+
+def _route_mode() -> str:
+    mode = request.args.get("modo", ROUTE_MODES[0])
+    if mode not in ROUTE_MODES:
+        raise ValueError(f"Modo de ruteo desconocido '{mode}'. Opciones: {', '.join(ROUTE_MODES)}.")
+    return mode
+
+
+def _near_point_sql(lon: float, lat: float) -> str:
+    """Condición sobre `geom` para las aristas dentro del radio jerárquico de un punto."""
+
+    if not (math.isfinite(lon) and math.isfinite(lat)):
+        raise ValueError("Coordenadas inválidas para el ruteo.")
+    dy = ROUTE_HIERARCHY_RADIUS_M / METERS_PER_DEGREE
+    dx = dy / max(math.cos(math.radians(lat)), 0.01)
+    return f"geom && ST_Expand(ST_SetSRID(ST_MakePoint({lon!r}, {lat!r}), 4326), {dx!r}, {dy!r})"
+
+
+def _route_edges_sql(mode: str, endpoints: Sequence[Tuple[float, float]]) -> str:
+    """SQL de aristas que recibe pgr_dijkstra para el modo pedido."""
+
+    if mode != "jerarquico":
+        return ROUTE_EDGES_SQL
+    near = " OR ".join(_near_point_sql(lon, lat) for lon, lat in endpoints)
+    return (
+        ROUTE_EDGES_SQL
+        + f"      AND (clase_via IN (SELECT id FROM clases_via WHERE troncal) OR {near})\n"
+    )
 
-    summary = {
-        "sismos": resumen_row.get("sismos", 0),
-        "inundaciones": resumen_row.get("inundaciones", 0),
-        "incendios": resumen_row.get("incendios", 0),
-        "trafico": resumen_row.get("trafico", 0),
-    }
 
-    return jsonify({"geojson": geojson, "summary": summary})
+def _route_attempts(mode: str) -> Tuple[str, ...]:
+    # Si la red troncal no une ambos extremos, se repite la búsqueda completa
+    return (mode,) if mode == "completo" else (mode, "completo")
 
 
 def _resolve_route_nodes(conn: psycopg.Connection) -> Tuple[RouteNode, RouteNode]:
@@ -377,24 +1052,14 @@ def _resolve_route_nodes(conn: psycopg.Connection) -> Tuple[RouteNode, RouteNode
     if None not in (start_lat, start_lon, end_lat, end_lon):
         with conn.cursor() as cur:
             cur.execute(
-                """
-                WITH origen AS (
-                    SELECT id
-                    FROM nodos_carreteras
-                    ORDER BY geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-                    LIMIT 1
-                ),
-                destino AS (
-                    SELECT id
-                    FROM nodos_carreteras
-                    ORDER BY geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-                    LIMIT 1
-                )
+                f"""
+                WITH origen AS ({SNAP_NODE_SQL}),
+                destino AS ({SNAP_NODE_SQL})
                 SELECT
                     (SELECT id FROM origen) AS origen_id,
                     (SELECT id FROM destino) AS destino_id;
                 """,
-                (start_lon, start_lat, end_lon, end_lat),
+                _snap_params(start_lon, start_lat) + _snap_params(end_lon, end_lat),
             )
             row = cur.fetchone()
         if not row or row["origen_id"] is None or row["destino_id"] is None:
@@ -405,15 +1070,34 @@ def _resolve_route_nodes(conn: psycopg.Connection) -> Tuple[RouteNode, RouteNode
 
 
 @app.route("/api/ruta-demo")
+@admission("routing")
 def api_ruta_demo():
     """Calcula una ruta entre dos nodos de la red vial utilizando pgr_dijkstra."""
 
+    stage = metrics.ROUTE_STAGE_LATENCY.time
+
     with get_db_connection() as conn:
         try:
-            start_node, end_node = _resolve_route_nodes(conn)
+            mode = _route_mode()
+            with stage(endpoint="ruta_demo", stage="snapping"):
+                start_node, end_node = _resolve_route_nodes(conn)
         except ValueError as exc:
             return jsonify({"error": str(exc)}), 400
 
+        if _components_disconnected(start_node.component, end_node.component):
+            return (
+                jsonify(
+                    {
+                        "error": "No existe un camino entre los nodos seleccionados.",
+                        "start_node": start_node.node_id,
+                        "end_node": end_node.node_id,
+                        "start_component": start_node.component,
+                        "end_component": end_node.component,
+                    }
+                ),
+                404,
+            )
+
         route_query = """
             WITH
             ruta AS (
@@ -423,19 +1107,10 @@ def api_ruta_demo():
                     d.cost,
                     a.geom
                 FROM pgr_dijkstra(
-                    $pgr$
-                    SELECT
-                        id,
-                        source,
-                        target,
-                        costo_longitud_m AS cost,
-                        costo_longitud_m AS reverse_cost
-                    FROM aristas_carreteras
-                    WHERE costo_longitud_m > 0
-                    $pgr$,
                     %s,
                     %s,
-                    directed := false
+                    %s,
+                    directed := true
                 ) AS d
                 INNER JOIN aristas_carreteras a ON a.id = d.edge
                 WHERE d.edge <> -1
@@ -474,17 +1149,22 @@ def api_ruta_demo():
             FROM ruta;
         """
 
-        with conn.cursor() as cur:
-            cur.execute(
-                route_query,
-                (
-                    start_node.node_id,
-                    end_node.node_id,
-                    start_node.node_id,
-                    end_node.node_id,
-                ),
-            )
-            row = cur.fetchone()
+        endpoints = ((start_node.lon, start_node.lat), (end_node.lon, end_node.lat))
+        with stage(endpoint="ruta_demo", stage="dijkstra_geometry"), conn.cursor() as cur:
+            for mode in _route_attempts(mode):
+                cur.execute(
+                    route_query,
+                    (
+                        _route_edges_sql(mode, endpoints),
+                        start_node.node_id,
+                        end_node.node_id,
+                        start_node.node_id,
+                        end_node.node_id,
+                    ),
+                )
+                row = cur.fetchone()
+                if row and row.get("segments"):
+                    break
 
     if not row:
         return jsonify({"error": "No fue posible calcular la ruta en la red vial."}), 500
@@ -524,6 +1204,7 @@ def api_ruta_demo():
     summary = {
         "total_cost_m": total_cost_m,
         "total_length_km": total_length_km,
+        "modo": mode,
         "start": {
             "label": start_node.label,
             "lat": start_node.lat,
@@ -553,9 +1234,11 @@ def api_ruta_demo():
             },
         }
 
-    return jsonify({"segments": feature_collection, "route": route_feature, "summary": summary})
+    with stage(endpoint="ruta_demo", stage="serialization"):
+        return jsonify({"segments": feature_collection, "route": route_feature, "summary": summary})
 
 @app.route("/api/route/calculate", methods=['GET'])
+@admission("routing")
 def calculate_route():
     """Calculate route between two nodes using pgr_dijkstra"""
     try:
@@ -564,79 +1247,81 @@ def calculate_route():
         start_lng = float(request.args.get('start_lng'))
         end_lat = float(request.args.get('end_lat'))
         end_lng = float(request.args.get('end_lng'))
+        mode = _route_mode()
+        endpoints = ((start_lng, start_lat), (end_lng, end_lat))
+
+        stage = metrics.ROUTE_STAGE_LATENCY.time
 
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 # Find nearest nodes to start/end points
-                cur.execute("""
-                    WITH start_point AS (
-                        SELECT id, geom, 
+                with stage(endpoint="route_calculate", stage="snapping"):
+                    cur.execute(f"""
+                        WITH start_point AS ({SNAP_NODE_SQL}),
+                        end_point AS ({SNAP_NODE_SQL})
+                        SELECT
+                            start_point.id as start_id,
+                            start_point.componente as start_component,
                             ST_Distance(
-                                geom::geography, 
+                                start_point.geom::geography,
                                 ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography
-                            ) as distance
-                        FROM nodos_carreteras
-                        ORDER BY geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-                        LIMIT 1
-                    ),
-                    end_point AS (
-                        SELECT id, geom,
+                            ) as start_distance,
+                            end_point.id as end_id,
+                            end_point.componente as end_component,
                             ST_Distance(
-                                geom::geography,
+                                end_point.geom::geography,
                                 ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography
-                            ) as distance
-                        FROM nodos_carreteras
-                        ORDER BY geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-                        LIMIT 1
-                    )
-                    SELECT 
-                        start_point.id as start_id,
-                        start_point.distance as start_distance,
-                        end_point.id as end_id,
-                        end_point.distance as end_distance
-                    FROM start_point, end_point;
-                """, (start_lng, start_lat, start_lng, start_lat, 
-                      end_lng, end_lat, end_lng, end_lat))
-                
-                nearest = cur.fetchone()
+                            ) as end_distance
+                        FROM start_point, end_point;
+                    """, _snap_params(start_lng, start_lat) + _snap_params(end_lng, end_lat)
+                         + (start_lng, start_lat, end_lng, end_lat))
+                    nearest = cur.fetchone()
                 
                 if not nearest:
                     return jsonify({"error": "No se encontraron nodos cercanos"}), 404
 
-                # Calculate route using pgr_dijkstra
-                cur.execute("""
-                    WITH dijkstra AS (
-                        SELECT * FROM pgr_dijkstra(
-                            'SELECT id as id,
-                                    source,
-                                    target,
-                                    costo_longitud_m as cost
-                             FROM aristas_carreteras',
-                            %s, %s, false)
-                    )
-                    SELECT 
-                        json_build_object(
-                            'type', 'Feature',
-                            'geometry', ST_AsGeoJSON(ST_LineMerge(ST_Union(ac.geom)))::json,
-                            'properties', json_build_object(
-                                'length_km', SUM(d.cost)/1000.0,
-                                'start_node', %s,
-                                'end_node', %s
-                            )
-                        ) as route
-                    FROM dijkstra d
-                    JOIN aristas_carreteras ac ON d.edge = ac.id
-                    WHERE d.edge > 0
-                    GROUP BY d.start_vid, d.end_vid;
-                """, (nearest['start_id'], nearest['end_id'], 
-                      nearest['start_id'], nearest['end_id']))
-
-                result = cur.fetchone()
+                if _components_disconnected(nearest['start_component'], nearest['end_component']):
+                    return jsonify({"error": "No se encontró ruta entre los puntos"}), 404
 
-                if not result or not result['route']:
+                # Calculate route using pgr_dijkstra; the geometry is merged in a
+                # separate statement so each stage can be timed on its own
+                with stage(endpoint="route_calculate", stage="dijkstra"):
+                    for mode in _route_attempts(mode):
+                        cur.execute("""
+                            SELECT
+                                COALESCE(array_agg(edge ORDER BY seq), '{}') AS edges,
+                                SUM(cost) AS total_cost
+                            FROM pgr_dijkstra(%s, %s, %s, directed := true)
+                            WHERE edge > 0;
+                        """, (_route_edges_sql(mode, endpoints), nearest['start_id'], nearest['end_id']))
+                        path = cur.fetchone()
+                        if path and path['edges']:
+                            break
+
+                if not path or not path['edges']:
                     return jsonify({"error": "No se encontró ruta entre los puntos"}), 404
 
-                return jsonify(result['route'])
+                with stage(endpoint="route_calculate", stage="geometry_merge"):
+                    cur.execute("""
+                        SELECT ST_AsGeoJSON(ST_LineMerge(ST_Union(geom)))::json AS geometry
+                        FROM aristas_carreteras
+                        WHERE id = ANY(%s);
+                    """, (path['edges'],))
+                    merged = cur.fetchone()
+
+                route = {
+                    'type': 'Feature',
+                    'geometry': merged['geometry'] if merged else None,
+                    'properties': {
+                        'length_km': float(path['total_cost']) / 1000.0,
+                        'start_node': nearest['start_id'],
+                        'end_node': nearest['end_id'],
+                        'modo': mode,
+                    },
+                }
+
+                with stage(endpoint="route_calculate", stage="serialization"):
+                    return jsonify(route)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
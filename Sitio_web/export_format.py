@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import base64
+import json
+import struct
+import sys
+from array import array
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Formato columnar binario de aristas (todos los enteros/floats en little-endian):
+#
+#   cabecera  : magic "RAC1" | u32 version_datos | u32 n_filas
+#   columnas  : i64 id[n] | i64 source[n] | i64 target[n] | f64 costo_longitud_m[n]
+#   geometrías: u32 offsets[n + 1] | bytes WKB concatenados
+COLUMNAR_MAGIC = b"RAC1"
+COLUMNAR_HEADER = struct.Struct("<4sII")
+COLUMNAR_MIMETYPE = "application/vnd.ruteo.aristas-columnar"
+
+
+class InvalidCursorError(ValueError):
+    """El token de paginación no se pudo interpretar."""
+
+
+@dataclass(frozen=True)
+class ExportCursor:
+    """Posición de una exportación paginada por keyset sobre `aristas_carreteras.id`."""
+
+    after_id: int
+    until_id: Optional[int]
+    version: int
+    bbox: Optional[Tuple[float, float, float, float]] = None
+
+    def encode(self) -> str:
+        payload = json.dumps(asdict(self), separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(payload).rstrip(b"=").decode("ascii")
+
+    @classmethod
+    def decode(cls, token: str) -> "ExportCursor":
+        try:
+            padded = token + "=" * (-len(token) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+            bbox = tuple(map(float, data["bbox"])) if data.get("bbox") else None
+            return cls(
+                after_id=int(data["after_id"]),
+                until_id=int(data["until_id"]) if data.get("until_id") is not None else None,
+                version=int(data["version"]),
+                bbox=bbox,
+            )
+        except (ValueError, KeyError, TypeError) as exc:
+            raise InvalidCursorError("El cursor de exportación no es válido.") from exc
+
+
+def _le_bytes(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_columnar(rows: Sequence[Dict], version: int) -> bytes:
+    """Empaqueta filas (id, source, target, costo_longitud_m, wkb) en el formato columnar."""
+
+    ids, sources, targets = array("q"), array("q"), array("q")
+    costs = array("d")
+    offsets = array("I", [0])
+    blobs: List[bytes] = []
+
+    for row in rows:
+        ids.append(row["id"])
+        sources.append(row["source"])
+        targets.append(row["target"])
+        costs.append(float(row["costo_longitud_m"] or 0.0))
+        wkb = bytes(row["wkb"] or b"")
+        blobs.append(wkb)
+        offsets.append(offsets[-1] + len(wkb))
+
+    parts = [
+        COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, version, len(ids)),
+        _le_bytes(ids),
+        _le_bytes(sources),
+        _le_bytes(targets),
+        _le_bytes(costs),
+        _le_bytes(offsets),
+    ]
+    parts.extend(blobs)
+    return b"".join(parts)
+
+
+def decode_columnar(payload: bytes) -> Dict[str, object]:
+    """Decodifica un bloque columnar; pensado para los clientes de la exportación."""
+
+    magic, version, count = COLUMNAR_HEADER.unpack_from(payload, 0)
+    if magic != COLUMNAR_MAGIC:
+        raise ValueError("El bloque no corresponde al formato columnar de aristas.")
+
+    position = COLUMNAR_HEADER.size
+    columns: Dict[str, object] = {"version": version}
+    for name, typecode, length in (
+        ("id", "q", count),
+        ("source", "q", count),
+        ("target", "q", count),
+        ("costo_longitud_m", "d", count),
+        ("offsets", "I", count + 1),
+    ):
+        values = array(typecode)
+        size = values.itemsize * length
+        values.frombytes(payload[position : position + size])
+        if sys.byteorder != "little":
+            values.byteswap()
+        columns[name] = values
+        position += size
+
+    offsets = columns.pop("offsets")
+    blob = payload[position:]
+    columns["wkb"] = [blob[offsets[i] : offsets[i + 1]] for i in range(count)]
+    return columns
+
+
+def iter_ndjson(rows: Iterable[Dict]) -> Iterable[bytes]:
+    """Serializa filas (id, source, target, costo_longitud_m, geometry) como NDJSON."""
+
+    for row in rows:
+        geometry = row["geometry"]
+        if isinstance(geometry, str):
+            geometry = json.loads(geometry)
+        record = {
+            "id": row["id"],
+            "source": row["source"],
+            "target": row["target"],
+            "costo_longitud_m": row["costo_longitud_m"],
+            "geometry": geometry,
+        }
+        yield json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
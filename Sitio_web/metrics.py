@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Buckets de latencia (segundos) y de tamaño de payload (bytes)
+LATENCY_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS: Tuple[float, ...] = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Dict[LabelValues, float]]] = None
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]) -> None:
+        """Lee el valor acumulado desde otro componente (p. ej. los contadores de una caché)."""
+        self._function = function
+
+    def state(self) -> List:
+        if self._function is not None:
+            return [[list(k), v] for k, v in self._function().items()]
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, multiprocess_mode: str = "sum", **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.multiprocess_mode = multiprocess_mode
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Dict[LabelValues, float]]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]) -> None:
+        self._function = function
+
+    def state(self) -> List:
+        if self._function is not None:
+            return [[list(k), v] for k, v in self._function().items()]
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Por etiqueta: [conteos por bucket (sin acumular) + bucket +Inf, suma]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def state(self) -> List:
+        with self._lock:
+            return [[list(k), list(counts), total[0]] for k, (counts, total) in self._values.items()]
+
+
+class MetricsRegistry:
+    """Registro de métricas en memoria de proceso con exportación en formato de texto Prometheus.
+
+    Con `multiprocess_dir` cada proceso vuelca periódicamente su estado a `<dir>/<pid>.json`
+    y `/metrics` agrega los archivos de todos los workers: contadores e histogramas se suman
+    (incluidos los de procesos ya terminados) y los gauges se combinan según su
+    `multiprocess_mode` considerando solo procesos vivos.
+    """
+
+    def __init__(self, multiprocess_dir: Optional[str] = None, flush_interval_s: float = 2.0) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self.multiprocess_dir = Path(multiprocess_dir) if multiprocess_dir else None
+        self.flush_interval_s = flush_interval_s
+        self._last_flush = 0.0
+        self._flush_lock = threading.Lock()
+        if self.multiprocess_dir:
+            self.multiprocess_dir.mkdir(parents=True, exist_ok=True)
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), multiprocess_mode: str = "sum"
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, multiprocess_mode=multiprocess_mode))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def state(self) -> Dict[str, List]:
+        return {name: metric.state() for name, metric in self._metrics.items()}
+
+    def maybe_flush(self) -> None:
+        """Vuelca el estado del proceso si pasó `flush_interval_s` desde el último volcado."""
+
+        if not self.multiprocess_dir:
+            return
+        now = time.monotonic()
+        if now - self._last_flush < self.flush_interval_s or not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_flush = now
+            payload = json.dumps({"pid": os.getpid(), "metrics": self.state()})
+            fd, tmp_path = tempfile.mkstemp(dir=self.multiprocess_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                handle.write(payload)
+            os.replace(tmp_path, self.multiprocess_dir / f"{os.getpid()}.json")
+        finally:
+            self._flush_lock.release()
+
+    def _process_states(self) -> List[Tuple[bool, Dict[str, List]]]:
+        states = [(True, self.state())]
+        if not self.multiprocess_dir:
+            return states
+
+        own_pid = os.getpid()
+        for path in self.multiprocess_dir.glob("*.json"):
+            try:
+                pid = int(path.stem)
+                if pid == own_pid:
+                    continue
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (ValueError, OSError):
+                continue
+            try:
+                os.kill(pid, 0)
+                alive = True
+            except ProcessLookupError:
+                alive = False
+            except PermissionError:
+                alive = True
+            states.append((alive, data.get("metrics", {})))
+        return states
+
+    def render(self) -> str:
+        """Agrega el estado de todos los procesos y lo expone en formato de texto Prometheus."""
+
+        self.maybe_flush()
+        states = self._process_states()
+        lines: List[str] = []
+
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+
+            if isinstance(metric, Histogram):
+                merged: Dict[LabelValues, Tuple[List[int], float]] = {}
+                for _, state in states:
+                    for labels, counts, total in state.get(name, []):
+                        key = tuple(labels)
+                        current = merged.setdefault(key, ([0] * len(counts), 0.0))
+                        merged[key] = ([a + b for a, b in zip(current[0], counts)], current[1] + total)
+                for key, (counts, total) in sorted(merged.items()):
+                    cumulative = 0
+                    for bound, count in zip(list(metric.buckets) + [float("inf")], counts):
+                        cumulative += count
+                        le = f'le="{_format_number(bound)}"'
+                        lines.append(f"{name}_bucket{_format_labels(metric.labelnames, key, le)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(metric.labelnames, key)} {_format_number(total)}")
+                    lines.append(f"{name}_count{_format_labels(metric.labelnames, key)} {cumulative}")
+                continue
+
+            values: Dict[LabelValues, List[float]] = {}
+            for alive, state in states:
+                if isinstance(metric, Gauge) and not alive:
+                    continue
+                for labels, value in state.get(name, []):
+                    values.setdefault(tuple(labels), []).append(value)
+
+            mode = metric.multiprocess_mode if isinstance(metric, Gauge) else "sum"
+            combine = {"sum": sum, "max": max, "min": min}[mode]
+            for key, samples in sorted(values.items()):
+                lines.append(f"{name}{_format_labels(metric.labelnames, key)} {_format_number(combine(samples))}")
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry(
+    multiprocess_dir=os.getenv("METRICS_MULTIPROC_DIR") or None,
+    flush_interval_s=float(os.getenv("METRICS_FLUSH_INTERVAL_S", "2")),
+)
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "ruteo_http_request_duration_seconds",
+    "Latencia de las peticiones HTTP por ruta de Flask.",
+    ("route", "method", "status"),
+)
+RESPONSE_SIZE = REGISTRY.histogram(
+    "ruteo_http_response_size_bytes",
+    "Tamaño del cuerpo de respuesta (ya codificado) por ruta.",
+    ("route",),
+    buckets=SIZE_BUCKETS,
+)
+ROUTE_STAGE_LATENCY = REGISTRY.histogram(
+    "ruteo_route_stage_duration_seconds",
+    "Duración de cada etapa del cálculo de rutas (snapping, dijkstra, geometría, serialización).",
+    ("endpoint", "stage"),
+)
+DB_CONNECTIONS_IN_USE = REGISTRY.gauge(
+    "ruteo_db_connections_in_use",
+    "Conexiones a Postgres abiertas actualmente por la aplicación.",
+)
+DB_CONNECT_LATENCY = REGISTRY.histogram(
+    "ruteo_db_connect_duration_seconds",
+    "Tiempo de apertura de conexiones a Postgres.",
+)
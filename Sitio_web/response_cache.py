@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él se sirve gzip o identity
+    brotli = None
+
+# Orden de preferencia cuando el cliente acepta varias codificaciones con igual peso
+ENCODING_PREFERENCE: Tuple[str, ...] = ("br", "gzip", "identity")
+
+
+@dataclass(frozen=True)
+class CachedBody:
+    """Cuerpo serializado de una respuesta junto a sus variantes comprimidas."""
+
+    version: int
+    # Etiqueta base sin comillas ("<versión>-<digest>"); cada codificación tiene la suya
+    etag: str
+    bodies: Dict[str, bytes]
+    created: float
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+    def etag_for(self, encoding: str) -> str:
+        """ETag fuerte (sin comillas) de una variante: RFC 9110 exige uno distinto por codificación."""
+
+        return self.etag if encoding == "identity" else f"{self.etag}-{encoding}"
+
+
+def _parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Interpreta `Accept-Encoding` como un diccionario codificación -> q."""
+
+    weights: Dict[str, float] = {}
+    if not header:
+        return weights
+
+    for item in header.split(","):
+        parts = [part.strip() for part in item.split(";")]
+        coding = parts[0].lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+    return weights
+
+
+def choose_encoding(accept_encoding: Optional[str], available: Iterable[str]) -> str:
+    """Selecciona la mejor codificación disponible según `Accept-Encoding` (RFC 9110)."""
+
+    available = set(available)
+    weights = _parse_accept_encoding(accept_encoding)
+    wildcard = weights.get("*")
+
+    best, best_q = "identity", -1.0
+    for coding in ENCODING_PREFERENCE:
+        if coding not in available:
+            continue
+        q = weights.get(coding)
+        if q is None:
+            # identity es aceptable salvo que se excluya explícitamente
+            q = wildcard if wildcard is not None else (1.0 if coding == "identity" else 0.0)
+        if q > best_q and q > 0:
+            best, best_q = coding, q
+    return best
+
+
+class CompressedResponseCache:
+    """Caché LRU acotada en memoria de cuerpos JSON precomprimidos.
+
+    Cada entrada se indexa por (endpoint, parámetros) y guarda la versión de datos con la que
+    se generó; cuando un cargador incrementa la versión, la entrada se regenera en la siguiente
+    petición. El tamaño contabilizado es la suma de todas las variantes codificadas.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        min_compress_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 5,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.min_compress_size = min_compress_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+        self._entries: "OrderedDict[Hashable, CachedBody]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def encode(self, version: int, body: bytes) -> CachedBody:
+        """Construye las variantes codificadas de `body` sin guardarlas en la caché."""
+
+        bodies = {"identity": body}
+        if len(body) >= self.min_compress_size:
+            bodies["gzip"] = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+            if brotli is not None:
+                bodies["br"] = brotli.compress(body, quality=self.brotli_quality)
+
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        return CachedBody(
+            version=version,
+            etag=f"{version}-{digest}",
+            bodies=bodies,
+            created=time.monotonic(),
+        )
+
+    def get_or_build(
+        self,
+        key: Hashable,
+        version: int,
+        build: Callable[[], bytes],
+        max_age_s: Optional[float] = None,
+    ) -> CachedBody:
+        """Devuelve la entrada vigente para `key` o la construye con `build` si falta o está obsoleta.
+
+        `max_age_s` acota además la antigüedad de la entrada, para payloads que dependen del reloj.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is not None
+                and entry.version == version
+                and (max_age_s is None or time.monotonic() - entry.created < max_age_s)
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # La serialización y compresión se hacen fuera del lock para no bloquear otros endpoints
+        entry = self.encode(version, build())
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._current_bytes -= previous.size
+
+            if entry.size > self.max_bytes:
+                # No cabe ni sola: se entrega sin guardar
+                return entry
+
+            self._entries[key] = entry
+            self._current_bytes += entry.size
+            while self._current_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._current_bytes -= evicted.size
+                self.evictions += 1
+        return entry
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Servidor de producción pre-fork (gunicorn) para la aplicación web.
+
+El maestro importa la aplicación y precarga el estado compartido de solo lectura antes de
+bifurcar los workers; estos lo heredan copy-on-write y arrancan sin volver a cargarlo.
+"""
+
+from __future__ import annotations
+
+import gc
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger("serve")
+
+
+def _prepare_metrics_dir() -> None:
+    """Define un directorio de métricas multiproceso limpio para esta ejecución."""
+
+    metrics_dir = Path(os.getenv("METRICS_MULTIPROC_DIR") or Path(tempfile.gettempdir()) / "ruteo_metrics")
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    os.environ["METRICS_MULTIPROC_DIR"] = str(metrics_dir)
+
+
+class PreforkApplication(BaseApplication):
+    def __init__(self, options: dict) -> None:
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Con preload_app=True esto se ejecuta una sola vez, en el maestro
+        from app import app
+        from shared_state import preload_all
+
+        preload_all()
+        # Saca los objetos precargados del GC para que no se toquen sus páginas tras el fork
+        gc.freeze()
+        return app
+
+
+def main() -> None:
+    logging.basicConfig(
+        level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO),
+        format="%(asctime)s [%(levelname)s] %(message)s",
+    )
+    _prepare_metrics_dir()
+
+    workers = int(os.getenv("WEB_WORKERS", str((os.cpu_count() or 1) * 2 + 1)))
+    options = {
+        "bind": f"{os.getenv('WEB_HOST', '0.0.0.0')}:{os.getenv('WEB_PORT', '5000')}",
+        "workers": workers,
+        "threads": int(os.getenv("WEB_THREADS", "4")),
+        "worker_class": "gthread",
+        "preload_app": True,
+        "timeout": int(os.getenv("WEB_TIMEOUT_S", "120")),
+        "graceful_timeout": 30,
+        "accesslog": "-",
+    }
+    logger.info("Iniciando servidor pre-fork con %s workers en %s", workers, options["bind"])
+    PreforkApplication(options).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cargas de estado de solo lectura que conviene hacer una vez en el proceso maestro, antes de
+# bifurcar los workers, para que estos lo compartan copy-on-write.
+_PRELOADERS: List[Tuple[str, Callable[[], None]]] = []
+
+
+def register_preload(name: str, loader: Callable[[], None]) -> None:
+    """Registra una carga de estado compartido que se ejecuta en `preload_all`."""
+
+    _PRELOADERS.append((name, loader))
+
+
+def preload_all() -> Dict[str, float]:
+    """Ejecuta todas las cargas registradas y devuelve su duración en segundos.
+
+    Un fallo no impide el arranque: el worker volverá a cargar ese estado de forma perezosa.
+    """
+
+    timings: Dict[str, float] = {}
+    for name, loader in _PRELOADERS:
+        started = time.perf_counter()
+        try:
+            loader()
+        except Exception:
+            logger.exception("No fue posible precargar %s; se cargará en cada worker", name)
+            continue
+        timings[name] = time.perf_counter() - started
+        logger.info("Precargado %s en %.3f s", name, timings[name])
+    return timings
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_PREFIX = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+MAX_PARAMS_REPR = 500
+
+
+@dataclass(order=True)
+class SlowQuery:
+    """Una ejecución registrada; el orden natural es por duración."""
+
+    duration_ms: float
+    seq: int
+    query: str = field(compare=False)
+    params: str = field(compare=False)
+    context: str = field(compare=False)
+    recorded_at: float = field(compare=False)
+
+
+def _query_text(query: Any) -> Optional[str]:
+    if isinstance(query, bytes):
+        return query.decode("utf-8", errors="replace")
+    if isinstance(query, str):
+        return query
+    return None  # sql.Composed u otros objetos: no se pueden reejecutar tal cual
+
+
+def _is_read_only(query: str) -> bool:
+    head = query.lstrip().split(None, 1)[0].upper() if query.strip() else ""
+    return head in {"SELECT", "WITH"}
+
+
+class SlowQueryLog:
+    """Registro opcional de las consultas más lentas con muestreo de planes EXPLAIN ANALYZE.
+
+    Cada ejecución se compara contra un heap de las `top_n` más lentas del proceso. Las que
+    superan `threshold_ms` se muestrean con probabilidad `sample_rate` y un hilo en segundo
+    plano las reejecuta con `EXPLAIN (ANALYZE, BUFFERS)` en una conexión aparte, dentro de una
+    transacción que siempre se revierte. Los planes se agregan como JSON Lines a `plans_path`.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        connect: Callable[[], Any],
+        top_n: int = 50,
+        threshold_ms: float = 500.0,
+        sample_rate: float = 0.1,
+        plans_path: Optional[Path] = None,
+        explain_timeout_ms: int = 30000,
+        max_pending: int = 16,
+    ) -> None:
+        self.enabled = enabled
+        self._connect = connect
+        self.top_n = top_n
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.plans_path = plans_path
+        self.explain_timeout_ms = explain_timeout_ms
+
+        self._heap: List[SlowQuery] = []
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._pending: "queue.Queue[Tuple[SlowQuery, Any]]" = queue.Queue(maxsize=max_pending)
+        self._plans: Deque[Dict[str, Any]] = deque(maxlen=top_n)
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid: Optional[int] = None
+        self.recorded = 0
+        self.sampled = 0
+        self.dropped = 0
+
+    def record(self, query: Any, params: Any, duration_s: float, context: str = "") -> None:
+        text = _query_text(query)
+        if not self.enabled or text is None:
+            return
+
+        duration_ms = duration_s * 1000.0
+        params_repr = repr(params)
+        if len(params_repr) > MAX_PARAMS_REPR:
+            params_repr = params_repr[:MAX_PARAMS_REPR] + "..."
+        item = SlowQuery(duration_ms, next(self._seq), text, params_repr, context, time.time())
+
+        with self._lock:
+            self.recorded += 1
+            if len(self._heap) < self.top_n:
+                heapq.heappush(self._heap, item)
+            elif item > self._heap[0]:
+                heapq.heapreplace(self._heap, item)
+
+        if duration_ms >= self.threshold_ms and _is_read_only(text) and random.random() < self.sample_rate:
+            self._enqueue_explain(item, params)
+
+    def _enqueue_explain(self, item: SlowQuery, params: Any) -> None:
+        self._ensure_worker()
+        try:
+            self._pending.put_nowait((item, params))
+            self.sampled += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_worker(self) -> None:
+        pid = os.getpid()
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._explain_loop, name="slow-query-explain", daemon=True)
+            self._worker_pid = pid
+            self._worker.start()
+
+    def _explain_loop(self) -> None:
+        while True:
+            item, params = self._pending.get()
+            try:
+                self._explain(item, params)
+            except Exception:
+                logger.exception("No fue posible capturar EXPLAIN ANALYZE de una consulta lenta")
+
+    def _explain(self, item: SlowQuery, params: Any) -> None:
+        conn = self._connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"SET LOCAL statement_timeout = {int(self.explain_timeout_ms)}")
+                cur.execute(EXPLAIN_PREFIX + item.query, params)
+                row = cur.fetchone()
+            plan = row[0] if isinstance(row, (list, tuple)) else next(iter(row.values()))
+        finally:
+            # EXPLAIN ANALYZE ejecuta la sentencia: nunca se confirman sus efectos
+            conn.rollback()
+            conn.close()
+
+        record = {**asdict(item), "pid": os.getpid(), "plan": plan}
+        record.pop("seq", None)
+        self._plans.append(record)
+        if self.plans_path:
+            with open(self.plans_path, "a", encoding="utf-8") as handle:
+                handle.write(json.dumps(record, default=str, ensure_ascii=False) + "\n")
+
+    def top(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = sorted(self._heap, reverse=True)
+        result = []
+        for item in items:
+            data = asdict(item)
+            data.pop("seq", None)
+            data["duration_ms"] = round(item.duration_ms, 3)
+            result.append(data)
+        return result
+
+    def plans(self) -> List[Dict[str, Any]]:
+        return list(reversed(self._plans))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold_ms,
+            "sample_rate": self.sample_rate,
+            "recorded": self.recorded,
+            "sampled": self.sampled,
+            "dropped": self.dropped,
+            "pending": self._pending.qsize(),
+            "plans_path": str(self.plans_path) if self.plans_path else None,
+        }
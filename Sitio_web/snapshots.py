@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Snapshot(Generic[T]):
+    """Valor inmutable construido para una versión de datos concreta."""
+
+    version: Optional[int]
+    value: T
+    built_at: float
+
+    @property
+    def age_s(self) -> float:
+        return max(0.0, time.time() - self.built_at)
+
+
+class SnapshotCache(Generic[T]):
+    """Snapshot en memoria de proceso con refresco en segundo plano (stale-while-revalidate).
+
+    La primera petición construye el snapshot de forma síncrona; desde ahí las peticiones leen
+    siempre el snapshot vigente sin tocar la base, y un hilo daemon lo reconstruye cuando
+    `version_fn` informa una versión distinta. Si la reconstrucción falla se sigue sirviendo
+    el snapshot anterior. El hilo se arranca de forma perezosa y se vuelve a lanzar si el
+    proceso fue bifurcado (los hilos no sobreviven a `fork`).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        build: Callable[[Optional[int]], T],
+        version_fn: Callable[[], Optional[int]],
+        refresh_interval_s: float = 30.0,
+    ) -> None:
+        self.name = name
+        self._build = build
+        self._version_fn = version_fn
+        self.refresh_interval_s = refresh_interval_s
+
+        self._snapshot: Optional[Snapshot[T]] = None
+        self._build_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def _rebuild(self, version: Optional[int]) -> Snapshot[T]:
+        snapshot = Snapshot(version=version, value=self._build(version), built_at=time.time())
+        self._snapshot = snapshot
+        self.refreshes += 1
+        return snapshot
+
+    def _ensure_refresher(self) -> None:
+        pid = os.getpid()
+        if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+            return
+        with self._build_lock:
+            if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name=f"snapshot-{self.name}", daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _refresh_loop(self) -> None:
+        while True:
+            time.sleep(self.refresh_interval_s)
+            try:
+                self.refresh()
+            except Exception:  # el snapshot anterior sigue vigente
+                self.failures += 1
+                logger.exception("No fue posible refrescar el snapshot %s", self.name)
+
+    def refresh(self, force: bool = False) -> Snapshot[T]:
+        """Reconstruye el snapshot si cambió la versión de datos (o siempre, con `force`)."""
+
+        version = self._version_fn()
+        current = self._snapshot
+        # Sin versionado disponible (None) se reconstruye en cada intervalo
+        if not force and current is not None and version is not None and current.version == version:
+            return current
+        with self._build_lock:
+            current = self._snapshot
+            if not force and current is not None and version is not None and current.version == version:
+                return current
+            return self._rebuild(version)
+
+    def get(self) -> Snapshot[T]:
+        """Devuelve el snapshot vigente, construyéndolo si todavía no existe."""
+
+        self._ensure_refresher()
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.refresh()
+        return snapshot
+
+    def stats(self) -> Dict[str, object]:
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else None,
+            "age_s": round(snapshot.age_s, 3) if snapshot else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
@@ -84,16 +84,69 @@ CREATE TABLE precios_combustibles (
     fecha_actualizacion TIMESTAMP WITH TIME ZONE
 );
 
+CREATE INDEX idx_estaciones_ubicacion ON estaciones_servicio USING GIST (ubicacion);
+CREATE INDEX idx_porticos_ubicacion ON porticos USING GIST (ubicacion);
+CREATE INDEX idx_precios_estacion ON precios_combustibles (estacion_id, tipo_combustible);
+
+
+-- --- Grilla multirresolución de metadata ---
+-- Agregados de estaciones y pórticos por celda para vistas alejadas del mapa.
+-- Las celdas siguen la grilla de teselas Web Mercator (2 x 2 celdas por tesela).
+DROP TABLE IF EXISTS metadata_grilla CASCADE;
+CREATE TABLE metadata_grilla (
+    zoom SMALLINT NOT NULL,
+    tipo VARCHAR(20) NOT NULL,
+    celda_x INTEGER NOT NULL,
+    celda_y INTEGER NOT NULL,
+    conteo INTEGER NOT NULL,
+    precios JSONB,
+    marca_dominante VARCHAR(100),
+    geom GEOMETRY(Point, 4326) NOT NULL,
+    PRIMARY KEY (zoom, tipo, celda_x, celda_y)
+);
+
+CREATE INDEX idx_metadata_grilla_geom ON metadata_grilla USING GIST (geom);
+
 
 ----------------------------------------------------
 --             TABLAS DE INFRAESTRUCTURA            --
 ----------------------------------------------------
 DROP TABLE IF EXISTS aristas_carreteras CASCADE;
 DROP TABLE IF EXISTS nodos_carreteras CASCADE;
+DROP TABLE IF EXISTS clases_via CASCADE;
+
+-- Clases de vía OSM (códigos de infraestructura/road_attributes.py). `troncal` marca las
+-- clases que el ruteo jerárquico relaja lejos del origen y el destino.
+CREATE TABLE clases_via (
+    id SMALLINT PRIMARY KEY,
+    nombre TEXT NOT NULL UNIQUE,
+    troncal BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+INSERT INTO clases_via (id, nombre, troncal) VALUES
+    (1, 'motorway', TRUE),
+    (2, 'trunk', TRUE),
+    (3, 'primary', TRUE),
+    (4, 'secondary', FALSE),
+    (5, 'tertiary', FALSE),
+    (6, 'unclassified', FALSE),
+    (7, 'residential', FALSE),
+    (8, 'motorway_link', TRUE),
+    (9, 'trunk_link', TRUE),
+    (10, 'primary_link', TRUE),
+    (11, 'secondary_link', FALSE),
+    (12, 'tertiary_link', FALSE),
+    (13, 'living_street', FALSE),
+    (14, 'service', FALSE),
+    (15, 'road', FALSE);
 
 CREATE TABLE nodos_carreteras (
+    -- Id denso 1..n en orden de la curva de Hilbert (ver infraestructura/spatial_order.py)
     id BIGINT PRIMARY KEY,
-    geom GEOMETRY(Point, 4326)
+    osm_id BIGINT,
+    geom GEOMETRY(Point, 4326),
+    -- Componente conexa (1 = la red principal; ver infraestructura/components.py)
+    componente INTEGER
 );
 
 CREATE TABLE aristas_carreteras (
@@ -101,14 +154,44 @@ CREATE TABLE aristas_carreteras (
     source BIGINT REFERENCES nodos_carreteras(id),
     target BIGINT REFERENCES nodos_carreteras(id),
     costo_longitud_m FLOAT,
-    geom GEOMETRY(LineString, 4326)
+    geom GEOMETRY(LineString, 4326),
+    osm_way_id BIGINT,
+    -- Atributos de la vía: clase (clases_via), sentido (0 doble, 1 source->target,
+    -- -1 target->source), velocidad máxima en km/h (0 = sin dato) y peaje
+    clase_via SMALLINT,
+    sentido SMALLINT NOT NULL DEFAULT 0,
+    velocidad_max SMALLINT NOT NULL DEFAULT 0,
+    peaje BOOLEAN NOT NULL DEFAULT FALSE
 );
 
 -- Índices para acelerar las consultas de ruteo y visualización
 CREATE INDEX idx_aristas_source ON aristas_carreteras(source);
 CREATE INDEX idx_aristas_target ON aristas_carreteras(target);
+-- Permite aplicar cambios incrementales de OSM por vía
+CREATE INDEX idx_aristas_way ON aristas_carreteras(osm_way_id);
+CREATE INDEX idx_aristas_clase ON aristas_carreteras(clase_via);
 CREATE INDEX idx_aristas_geom ON aristas_carreteras USING GIST (geom);
 CREATE INDEX idx_nodos_geom ON nodos_carreteras USING GIST (geom);
+-- Traduce los ids de OSM de los archivos de cambios
+CREATE UNIQUE INDEX idx_nodos_osm ON nodos_carreteras(osm_id);
+
+-- La carga ordena físicamente ambas tablas por la curva; `CLUSTER nodos_carreteras;` y
+-- `CLUSTER aristas_carreteras;` restauran ese orden tras muchos cambios incrementales
+ALTER TABLE nodos_carreteras CLUSTER ON nodos_carreteras_pkey;
+ALTER TABLE aristas_carreteras CLUSTER ON idx_aristas_source;
+
+-- Las recargas de la red vial se construyen en infra_staging y se intercambian con
+-- las tablas anteriores, que quedan en infra_anterior para revertir el cambio
+-- (ver infraestructura/load_infra_to_db.py).
+CREATE SCHEMA IF NOT EXISTS infra_staging;
+CREATE SCHEMA IF NOT EXISTS infra_anterior;
+
+-- Archivos de cambios de OSM (.osc) ya aplicados por infraestructura/apply_infra_changes.py
+DROP TABLE IF EXISTS cambios_osm_aplicados CASCADE;
+CREATE TABLE cambios_osm_aplicados (
+    archivo TEXT PRIMARY KEY,
+    aplicado_en TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
 
 
 ----------------------------------------------------
@@ -129,7 +212,12 @@ CREATE TABLE amenazas_sismos (
     url_detalle TEXT,
     fuente VARCHAR(100) DEFAULT 'USGS',
     geom GEOMETRY(Point, 4326) NOT NULL,
-    fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Clave natural de la fuente; las cargas hacen upsert sobre ella
+    clave_origen TEXT NOT NULL UNIQUE,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Expiración lógica: la fuente dejó de reportar el registro
+    expirado_en TIMESTAMP
 );
 
 CREATE INDEX idx_sismos_geom ON amenazas_sismos USING GIST(geom);
@@ -152,7 +240,12 @@ CREATE TABLE amenazas_inundaciones (
     timestamp TIMESTAMP,
     fuente VARCHAR(100) DEFAULT 'DGA MOP',
     geom GEOMETRY(Point, 4326) NOT NULL,
-    fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Clave natural de la fuente; las cargas hacen upsert sobre ella
+    clave_origen TEXT NOT NULL UNIQUE,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Expiración lógica: la fuente dejó de reportar el registro
+    expirado_en TIMESTAMP
 );
 
 CREATE INDEX idx_inundaciones_geom ON amenazas_inundaciones USING GIST(geom);
@@ -174,7 +267,12 @@ CREATE TABLE amenazas_incendios (
     url_detalle TEXT,
     fuente VARCHAR(100) DEFAULT 'NASA EONET',
     geom GEOMETRY(Point, 4326) NOT NULL,
-    fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Clave natural de la fuente; las cargas hacen upsert sobre ella
+    clave_origen TEXT NOT NULL UNIQUE,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Expiración lógica: la fuente dejó de reportar el registro
+    expirado_en TIMESTAMP
 );
 
 CREATE INDEX idx_incendios_geom ON amenazas_incendios USING GIST(geom);
@@ -199,7 +297,12 @@ CREATE TABLE amenazas_trafico (
     timestamp TIMESTAMP,
     fuente VARCHAR(100) DEFAULT 'Google Maps Directions API',
     geom GEOMETRY(Point, 4326) NOT NULL,
-    fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    fecha_carga TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Clave natural de la fuente; las cargas hacen upsert sobre ella
+    clave_origen TEXT NOT NULL UNIQUE,
+    actualizado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Expiración lógica: la fuente dejó de reportar el registro
+    expirado_en TIMESTAMP
 );
 
 CREATE INDEX idx_trafico_geom ON amenazas_trafico USING GIST(geom);
@@ -255,7 +358,8 @@ BEGIN
         ('Sismo magnitud ' || s.magnitud || ' - ' || s.lugar)::TEXT as descripcion,
         s.geom as ubicacion
     FROM amenazas_sismos s
-    WHERE ST_DWithin(s.geom::geography, ruta_geom::geography, radio_metros)
+    WHERE s.expirado_en IS NULL
+      AND ST_DWithin(s.geom::geography, ruta_geom::geography, radio_metros)
     
     UNION ALL
     
@@ -267,7 +371,8 @@ BEGIN
         ('Alerta de inundación - ' || COALESCE(i.rio, 'Río no especificado'))::TEXT as descripcion,
         i.geom as ubicacion
     FROM amenazas_inundaciones i
-    WHERE ST_DWithin(i.geom::geography, ruta_geom::geography, radio_metros)
+    WHERE i.expirado_en IS NULL
+      AND ST_DWithin(i.geom::geography, ruta_geom::geography, radio_metros)
     
     UNION ALL
     
@@ -279,7 +384,8 @@ BEGIN
         ('Incendio forestal - ' || COALESCE(inc.titulo, 'Sin título'))::TEXT as descripcion,
         inc.geom as ubicacion
     FROM amenazas_incendios inc
-    WHERE ST_DWithin(inc.geom::geography, ruta_geom::geography, radio_metros)
+    WHERE inc.expirado_en IS NULL
+      AND ST_DWithin(inc.geom::geography, ruta_geom::geography, radio_metros)
     
     UNION ALL
     
@@ -291,12 +397,73 @@ BEGIN
         t.descripcion::TEXT,
         t.geom as ubicacion
     FROM amenazas_trafico t
-    WHERE ST_DWithin(t.geom::geography, ruta_geom::geography, radio_metros)
+    WHERE t.expirado_en IS NULL
+      AND ST_DWithin(t.geom::geography, ruta_geom::geography, radio_metros)
     ORDER BY distancia_metros;
 END;
 $$ LANGUAGE plpgsql;
 
 
+----------------------------------------------------
+--             VERSIONES DE DATOS                   --
+----------------------------------------------------
+
+-- Versión monótona por capa de datos. La aplicación web la usa para invalidar
+-- sus cachés de respuestas cuando un cargador modifica la capa.
+DROP TABLE IF EXISTS versiones_datos CASCADE;
+CREATE TABLE versiones_datos (
+    capa VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    actualizado_en TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO versiones_datos (capa) VALUES ('metadata'), ('amenazas'), ('infraestructura');
+
+CREATE OR REPLACE FUNCTION incrementar_version_datos(p_capa VARCHAR)
+RETURNS BIGINT AS $$
+DECLARE
+    nueva_version BIGINT;
+BEGIN
+    INSERT INTO versiones_datos (capa) VALUES (p_capa)
+    ON CONFLICT (capa) DO UPDATE
+        SET version = versiones_datos.version + 1,
+            actualizado_en = NOW()
+    RETURNING version INTO nueva_version;
+    RETURN nueva_version;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Las tablas de metadata se cargan fuera de este repositorio, por lo que su
+-- versión se incrementa con triggers a nivel de sentencia.
+CREATE OR REPLACE FUNCTION trg_incrementar_version_datos()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM incrementar_version_datos(TG_ARGV[0]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_version_estaciones
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON estaciones_servicio
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_incrementar_version_datos('metadata');
+
+CREATE TRIGGER trg_version_precios
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON precios_combustibles
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_incrementar_version_datos('metadata');
+
+CREATE TRIGGER trg_version_autopistas
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON autopistas
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_incrementar_version_datos('metadata');
+
+CREATE TRIGGER trg_version_porticos
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON porticos
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_incrementar_version_datos('metadata');
+
+CREATE TRIGGER trg_version_vehiculos
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON vehiculos
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_incrementar_version_datos('metadata');
+
+
 ----------------------------------------------------
 --                    VISTAS                        --
 ----------------------------------------------------
@@ -311,7 +478,7 @@ SELECT
     geom,
     fecha_carga
 FROM amenazas_sismos
-WHERE fecha_legible > NOW() - INTERVAL '7 days'
+WHERE fecha_legible > NOW() - INTERVAL '7 days' AND expirado_en IS NULL
 
 UNION ALL
 
@@ -323,7 +490,7 @@ SELECT
     geom,
     fecha_carga
 FROM amenazas_inundaciones
-WHERE timestamp > NOW() - INTERVAL '7 days'
+WHERE timestamp > NOW() - INTERVAL '7 days' AND expirado_en IS NULL
 
 UNION ALL
 
@@ -335,7 +502,7 @@ SELECT
     geom,
     fecha_carga
 FROM amenazas_incendios
-WHERE fecha_inicio > NOW() - INTERVAL '7 days'
+WHERE fecha_inicio > NOW() - INTERVAL '7 days' AND expirado_en IS NULL
 
 UNION ALL
 
@@ -347,7 +514,279 @@ SELECT
     geom,
     fecha_carga
 FROM amenazas_trafico
-WHERE timestamp > NOW() - INTERVAL '1 day';
+WHERE timestamp > NOW() - INTERVAL '1 day' AND expirado_en IS NULL;
+
+
+----------------------------------------------------
+--       GRILLA DE AGRUPACIÓN DE METADATA           --
+----------------------------------------------------
+
+-- Reconstruye metadata_grilla para los niveles de zoom 0..p_zoom_max.
+-- `precios` guarda, por tipo de combustible, el mínimo y el promedio del
+-- último precio informado por cada estación de la celda.
+CREATE OR REPLACE FUNCTION refrescar_metadata_grilla(p_zoom_max INTEGER DEFAULT 11)
+RETURNS void AS $$
+BEGIN
+    DELETE FROM metadata_grilla;
+
+    WITH puntos AS (
+        SELECT 'estacion_servicio'::VARCHAR AS tipo, e.id, e.marca, e.ubicacion::geometry AS geom
+        FROM estaciones_servicio e
+        WHERE e.ubicacion IS NOT NULL
+
+        UNION ALL
+
+        SELECT 'portico_peaje'::VARCHAR, p.id, NULL, p.ubicacion::geometry
+        FROM porticos p
+        WHERE p.ubicacion IS NOT NULL
+    ),
+    celdas AS (
+        SELECT
+            z.zoom,
+            pt.tipo,
+            pt.id,
+            pt.marca,
+            pt.geom,
+            floor((ST_X(pt.geom) + 180.0) / 360.0 * (2 ^ z.zoom) * 2)::INTEGER AS celda_x,
+            floor(
+                (1 - ln(tan(radians(ST_Y(pt.geom))) + 1 / cos(radians(ST_Y(pt.geom)))) / pi()) / 2
+                * (2 ^ z.zoom) * 2
+            )::INTEGER AS celda_y
+        FROM puntos pt
+        CROSS JOIN generate_series(0, p_zoom_max) AS z(zoom)
+    ),
+    ultimos_precios AS (
+        SELECT DISTINCT ON (estacion_id, tipo_combustible)
+            estacion_id, tipo_combustible, precio
+        FROM precios_combustibles
+        ORDER BY estacion_id, tipo_combustible, fecha_actualizacion DESC NULLS LAST
+    ),
+    precios_celda AS (
+        SELECT
+            zoom, celda_x, celda_y,
+            jsonb_object_agg(
+                tipo_combustible,
+                jsonb_build_object('min', precio_min, 'promedio', precio_promedio)
+            ) AS precios
+        FROM (
+            SELECT
+                c.zoom, c.celda_x, c.celda_y, up.tipo_combustible,
+                MIN(up.precio) AS precio_min,
+                ROUND(AVG(up.precio), 1) AS precio_promedio
+            FROM celdas c
+            INNER JOIN ultimos_precios up ON up.estacion_id = c.id
+            WHERE c.tipo = 'estacion_servicio'
+            GROUP BY c.zoom, c.celda_x, c.celda_y, up.tipo_combustible
+        ) por_combustible
+        GROUP BY zoom, celda_x, celda_y
+    )
+    INSERT INTO metadata_grilla (zoom, tipo, celda_x, celda_y, conteo, precios, marca_dominante, geom)
+    SELECT
+        c.zoom,
+        c.tipo,
+        c.celda_x,
+        c.celda_y,
+        COUNT(*),
+        pc.precios,
+        mode() WITHIN GROUP (ORDER BY c.marca),
+        ST_Centroid(ST_Collect(c.geom))
+    FROM celdas c
+    LEFT JOIN precios_celda pc
+        ON c.tipo = 'estacion_servicio'
+        AND pc.zoom = c.zoom AND pc.celda_x = c.celda_x AND pc.celda_y = c.celda_y
+    GROUP BY c.zoom, c.tipo, c.celda_x, c.celda_y, pc.precios;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Refresca la grilla solo si la versión de metadata cambió desde la última
+-- reconstrucción. Un advisory lock evita que varios procesos la rehagan a la vez.
+CREATE OR REPLACE FUNCTION asegurar_metadata_grilla()
+RETURNS BOOLEAN AS $$
+DECLARE
+    v_metadata BIGINT;
+    v_grilla BIGINT;
+BEGIN
+    SELECT version INTO v_metadata FROM versiones_datos WHERE capa = 'metadata';
+    SELECT version INTO v_grilla FROM versiones_datos WHERE capa = 'metadata_grilla';
+
+    IF v_grilla IS NOT DISTINCT FROM v_metadata THEN
+        RETURN FALSE;
+    END IF;
+    IF NOT pg_try_advisory_xact_lock(hashtext('metadata_grilla')) THEN
+        RETURN FALSE;
+    END IF;
+
+    PERFORM refrescar_metadata_grilla();
+
+    INSERT INTO versiones_datos (capa, version) VALUES ('metadata_grilla', v_metadata)
+    ON CONFLICT (capa) DO UPDATE
+        SET version = EXCLUDED.version,
+            actualizado_en = NOW();
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+
+----------------------------------------------------
+--       CAPA MATERIALIZADA DE AMENAZAS ACTIVAS     --
+----------------------------------------------------
+
+-- Copia indexada de vista_amenazas_activas. La mantiene load_amenazas_to_db.py
+-- al final de cada carga, refrescando solo los tipos que cambiaron.
+DROP TABLE IF EXISTS amenazas_activas_resumen CASCADE;
+DROP TABLE IF EXISTS amenazas_activas CASCADE;
+CREATE TABLE amenazas_activas (
+    id SERIAL PRIMARY KEY,
+    tipo VARCHAR(20) NOT NULL,
+    origen_id INTEGER NOT NULL,
+    nivel_alerta VARCHAR(20),
+    descripcion TEXT,
+    fecha TIMESTAMP NOT NULL,
+    vigente_hasta TIMESTAMP NOT NULL,
+    fecha_carga TIMESTAMP,
+    geom GEOMETRY(Point, 4326) NOT NULL,
+    UNIQUE (tipo, origen_id)
+);
+
+CREATE INDEX idx_amenazas_activas_geom ON amenazas_activas USING GIST(geom);
+CREATE INDEX idx_amenazas_activas_tipo_fecha ON amenazas_activas(tipo, fecha DESC);
+CREATE INDEX idx_amenazas_activas_vigencia ON amenazas_activas(vigente_hasta);
+
+-- Conteos por tipo precalculados (una sola fila)
+CREATE TABLE amenazas_activas_resumen (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    sismos INTEGER NOT NULL DEFAULT 0,
+    inundaciones INTEGER NOT NULL DEFAULT 0,
+    incendios INTEGER NOT NULL DEFAULT 0,
+    trafico INTEGER NOT NULL DEFAULT 0,
+    proxima_expiracion TIMESTAMP,
+    actualizado_en TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO amenazas_activas_resumen (id) VALUES (TRUE);
+
+-- Filas modificadas por cada carga de amenazas (I = insertada, U = actualizada,
+-- E = expirada), identificadas por la versión de la capa 'amenazas' que las publicó.
+-- Los consumidores aplican solo el delta desde la última versión que conocen.
+DROP TABLE IF EXISTS amenazas_cambios CASCADE;
+CREATE TABLE amenazas_cambios (
+    id BIGSERIAL PRIMARY KEY,
+    version BIGINT NOT NULL,
+    tabla VARCHAR(50) NOT NULL,
+    origen_id INTEGER NOT NULL,
+    operacion CHAR(1) NOT NULL CHECK (operacion IN ('I', 'U', 'E')),
+    registrado_en TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX idx_amenazas_cambios_version ON amenazas_cambios(version);
+
+-- Sincroniza los tipos indicados (NULL = todos) con upserts que solo tocan las filas
+-- que cambiaron, quita las expiradas o vencidas y recalcula el resumen. Las ventanas
+-- de vigencia replican vista_amenazas_activas.
+CREATE OR REPLACE FUNCTION refrescar_amenazas_activas(p_tipos TEXT[] DEFAULT NULL)
+RETURNS void AS $$
+BEGIN
+    IF p_tipos IS NULL OR 'sismo' = ANY(p_tipos) THEN
+        INSERT INTO amenazas_activas (tipo, origen_id, nivel_alerta, descripcion, fecha, vigente_hasta, fecha_carga, geom)
+        SELECT 'sismo', id, nivel_alerta, lugar, fecha_legible,
+               fecha_legible + INTERVAL '7 days', fecha_carga, geom
+        FROM amenazas_sismos
+        WHERE fecha_legible > NOW() - INTERVAL '7 days' AND expirado_en IS NULL
+        ON CONFLICT (tipo, origen_id) DO UPDATE
+            SET nivel_alerta = EXCLUDED.nivel_alerta,
+                descripcion = EXCLUDED.descripcion,
+                fecha = EXCLUDED.fecha,
+                vigente_hasta = EXCLUDED.vigente_hasta,
+                fecha_carga = EXCLUDED.fecha_carga,
+                geom = EXCLUDED.geom
+            WHERE (amenazas_activas.nivel_alerta, amenazas_activas.descripcion, amenazas_activas.fecha, amenazas_activas.geom)
+                IS DISTINCT FROM (EXCLUDED.nivel_alerta, EXCLUDED.descripcion, EXCLUDED.fecha, EXCLUDED.geom);
+        DELETE FROM amenazas_activas a
+        WHERE a.tipo = 'sismo'
+          AND NOT EXISTS (SELECT 1 FROM amenazas_sismos o WHERE o.id = a.origen_id AND o.expirado_en IS NULL);
+    END IF;
+
+    IF p_tipos IS NULL OR 'inundacion' = ANY(p_tipos) THEN
+        INSERT INTO amenazas_activas (tipo, origen_id, nivel_alerta, descripcion, fecha, vigente_hasta, fecha_carga, geom)
+        SELECT 'inundacion', id, nivel_alerta, COALESCE(rio, estacion), timestamp,
+               timestamp + INTERVAL '7 days', fecha_carga, geom
+        FROM amenazas_inundaciones
+        WHERE timestamp > NOW() - INTERVAL '7 days' AND expirado_en IS NULL
+        ON CONFLICT (tipo, origen_id) DO UPDATE
+            SET nivel_alerta = EXCLUDED.nivel_alerta,
+                descripcion = EXCLUDED.descripcion,
+                fecha = EXCLUDED.fecha,
+                vigente_hasta = EXCLUDED.vigente_hasta,
+                fecha_carga = EXCLUDED.fecha_carga,
+                geom = EXCLUDED.geom
+            WHERE (amenazas_activas.nivel_alerta, amenazas_activas.descripcion, amenazas_activas.fecha, amenazas_activas.geom)
+                IS DISTINCT FROM (EXCLUDED.nivel_alerta, EXCLUDED.descripcion, EXCLUDED.fecha, EXCLUDED.geom);
+        DELETE FROM amenazas_activas a
+        WHERE a.tipo = 'inundacion'
+          AND NOT EXISTS (SELECT 1 FROM amenazas_inundaciones o WHERE o.id = a.origen_id AND o.expirado_en IS NULL);
+    END IF;
+
+    IF p_tipos IS NULL OR 'incendio' = ANY(p_tipos) THEN
+        INSERT INTO amenazas_activas (tipo, origen_id, nivel_alerta, descripcion, fecha, vigente_hasta, fecha_carga, geom)
+        SELECT 'incendio', id, nivel_alerta, titulo, fecha_inicio,
+               fecha_inicio + INTERVAL '7 days', fecha_carga, geom
+        FROM amenazas_incendios
+        WHERE fecha_inicio > NOW() - INTERVAL '7 days' AND expirado_en IS NULL
+        ON CONFLICT (tipo, origen_id) DO UPDATE
+            SET nivel_alerta = EXCLUDED.nivel_alerta,
+                descripcion = EXCLUDED.descripcion,
+                fecha = EXCLUDED.fecha,
+                vigente_hasta = EXCLUDED.vigente_hasta,
+                fecha_carga = EXCLUDED.fecha_carga,
+                geom = EXCLUDED.geom
+            WHERE (amenazas_activas.nivel_alerta, amenazas_activas.descripcion, amenazas_activas.fecha, amenazas_activas.geom)
+                IS DISTINCT FROM (EXCLUDED.nivel_alerta, EXCLUDED.descripcion, EXCLUDED.fecha, EXCLUDED.geom);
+        DELETE FROM amenazas_activas a
+        WHERE a.tipo = 'incendio'
+          AND NOT EXISTS (SELECT 1 FROM amenazas_incendios o WHERE o.id = a.origen_id AND o.expirado_en IS NULL);
+    END IF;
+
+    IF p_tipos IS NULL OR 'trafico' = ANY(p_tipos) THEN
+        INSERT INTO amenazas_activas (tipo, origen_id, nivel_alerta, descripcion, fecha, vigente_hasta, fecha_carga, geom)
+        SELECT 'trafico', id, nivel_alerta, nombre_segmento, timestamp,
+               timestamp + INTERVAL '1 day', fecha_carga, geom
+        FROM amenazas_trafico
+        WHERE timestamp > NOW() - INTERVAL '1 day' AND expirado_en IS NULL
+        ON CONFLICT (tipo, origen_id) DO UPDATE
+            SET nivel_alerta = EXCLUDED.nivel_alerta,
+                descripcion = EXCLUDED.descripcion,
+                fecha = EXCLUDED.fecha,
+                vigente_hasta = EXCLUDED.vigente_hasta,
+                fecha_carga = EXCLUDED.fecha_carga,
+                geom = EXCLUDED.geom
+            WHERE (amenazas_activas.nivel_alerta, amenazas_activas.descripcion, amenazas_activas.fecha, amenazas_activas.geom)
+                IS DISTINCT FROM (EXCLUDED.nivel_alerta, EXCLUDED.descripcion, EXCLUDED.fecha, EXCLUDED.geom);
+        DELETE FROM amenazas_activas a
+        WHERE a.tipo = 'trafico'
+          AND NOT EXISTS (SELECT 1 FROM amenazas_trafico o WHERE o.id = a.origen_id AND o.expirado_en IS NULL);
+    END IF;
+
+    DELETE FROM amenazas_activas WHERE vigente_hasta <= NOW();
+
+    UPDATE amenazas_activas_resumen r
+    SET sismos = c.sismos,
+        inundaciones = c.inundaciones,
+        incendios = c.incendios,
+        trafico = c.trafico,
+        proxima_expiracion = c.proxima_expiracion,
+        actualizado_en = NOW()
+    FROM (
+        SELECT
+            COUNT(*) FILTER (WHERE tipo = 'sismo') AS sismos,
+            COUNT(*) FILTER (WHERE tipo = 'inundacion') AS inundaciones,
+            COUNT(*) FILTER (WHERE tipo = 'incendio') AS incendios,
+            COUNT(*) FILTER (WHERE tipo = 'trafico') AS trafico,
+            MIN(vigente_hasta) AS proxima_expiracion
+        FROM amenazas_activas
+    ) c
+    WHERE r.id;
+END;
+$$ LANGUAGE plpgsql;
 
 
 ----------------------------------------------------
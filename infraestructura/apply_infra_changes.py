@@ -0,0 +1,458 @@
+"""
+Actualización incremental de la red vial a partir de archivos de cambios de OSM.
+
+Lee los `.osc`/`.osc.gz` pendientes de INFRA_CAMBIOS_DIR (en orden de ruta, como los
+directorios de replicación de Geofabrik), calcula las vías de HIGHWAY_TYPES creadas,
+modificadas o eliminadas y los nodos movidos, y aplica solo esos deltas sobre
+nodos_carreteras/aristas_carreteras en una transacción corta. Los archivos de cambios hablan en
+ids de OSM; se traducen a los ids densos de la base mediante nodos_carreteras.osm_id, y los nodos
+nuevos reciben ids a continuación del mayor (fuera del orden de Hilbert hasta la próxima carga
+completa). Después regenera los artefactos
+derivados (infraestructura.col y grafo.bin) desde la base y recalcula las componentes conexas
+de los nodos.
+"""
+
+import os
+import sys
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import osmium as o
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+from columnar_format import DEFAULT_BLOCK_ROWS, EDGE_COLUMNS, NODE_COLUMNS, ColumnarReader, ColumnarWriter
+from extract_transform_infra import HIGHWAY_TYPES, LOCATION_INDEX_PATH, LOCATION_INDEX_TYPE
+from graph_artifact import write_graph_artifact
+from region import Region, resolve_region
+from road_attributes import RoadAttributes, road_attributes
+from load_infra_to_db import (
+    GRAPH_ARTIFACT_FILENAME,
+    INFRA_DATA_FILENAME,
+    bump_data_version,
+    connect_db,
+    lock_timeout,
+    refresh_component_labels,
+)
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+CHANGE_SUFFIXES = (".osc", ".osc.gz", ".osc.bz2")
+
+# Segmento: (source, target, costo_m, lon_s, lat_s, lon_t, lat_t, way_id, clase_via, sentido, velocidad_max, peaje)
+Segment = Tuple[int, int, float, float, float, float, float, int, int, int, int, bool]
+
+
+class ChangeHandler(o.SimpleHandler):
+    """
+    Estado final de los objetos tocados por los archivos de cambios: None si el nodo se eliminó
+    o si la vía se eliminó o dejó de ser una vía de HIGHWAY_TYPES.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.nodes: Dict[int, Optional[Tuple[float, float]]] = {}
+        self.ways: Dict[int, Optional[List[int]]] = {}
+        self.attributes: Dict[int, RoadAttributes] = {}
+
+    def node(self, node_obj):
+        if node_obj.deleted or not node_obj.location.valid():
+            self.nodes[node_obj.id] = None
+        else:
+            self.nodes[node_obj.id] = (node_obj.location.lon, node_obj.location.lat)
+
+    def way(self, way_obj):
+        if way_obj.deleted or way_obj.tags.get("highway") not in HIGHWAY_TYPES:
+            self.ways[way_obj.id] = None
+        else:
+            self.ways[way_obj.id] = [node_ref.ref for node_ref in way_obj.nodes]
+            self.attributes[way_obj.id] = road_attributes(way_obj.tags)
+
+
+def changes_dir() -> Path:
+    return Path(os.getenv("INFRA_CAMBIOS_DIR", str(SCRIPT_DIR / "cambios")))
+
+
+def ensure_changes_table(cursor) -> None:
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cambios_osm_aplicados (
+            archivo TEXT PRIMARY KEY,
+            aplicado_en TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+
+
+def pending_change_files(cursor, directory: Path) -> List[Tuple[str, Path]]:
+    """Archivos de cambios aún no aplicados, como (ruta relativa, ruta) en orden de aplicación."""
+    if not directory.is_dir():
+        return []
+    files = sorted(
+        (path.relative_to(directory).as_posix(), path)
+        for path in directory.rglob("*")
+        if path.is_file() and path.name.endswith(CHANGE_SUFFIXES)
+    )
+    cursor.execute("SELECT archivo FROM cambios_osm_aplicados")
+    applied = {row[0] for row in cursor.fetchall()}
+    return [(name, path) for name, path in files if name not in applied]
+
+
+def edges_have_way_ids(cursor) -> bool:
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = 'public' AND table_name = 'aristas_carreteras' AND column_name = 'osm_way_id')"
+    )
+    if not cursor.fetchone()[0]:
+        return False
+    cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM aristas_carreteras WHERE osm_way_id IS NULL)")
+    return bool(cursor.fetchone()[0])
+
+
+def nodes_have_osm_ids(cursor) -> bool:
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = 'public' AND table_name = 'nodos_carreteras' AND column_name = 'osm_id')"
+    )
+    if not cursor.fetchone()[0]:
+        return False
+    cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM nodos_carreteras WHERE osm_id IS NULL)")
+    return bool(cursor.fetchone()[0])
+
+
+def segment_length(lon_s: float, lat_s: float, lon_t: float, lat_t: float) -> float:
+    # Misma fórmula que la extracción completa
+    return round(o.geom.haversine_distance(o.osm.Location(lon_s, lat_s), o.osm.Location(lon_t, lat_t)), 2)
+
+
+class TruncatedWaysError(RuntimeError):
+    """Hay vías cuyos nodos no se pudieron ubicar; aplicar los cambios perdería aristas."""
+
+
+def open_location_index():
+    """Índice de ubicaciones que dejó la última extracción completa, o None si no existe."""
+    if not LOCATION_INDEX_PATH.exists():
+        return None
+    return o.index.create_map(f"{LOCATION_INDEX_TYPE},{LOCATION_INDEX_PATH}")
+
+
+def resolve_locations(cursor, handler: ChangeHandler, node_ids, index=None) -> Dict[int, Tuple[float, float]]:
+    """
+    Ubicación de cada nodo (por id de OSM): la del archivo de cambios o, si no cambió, la de
+    nodos_carreteras. Los nodos que aún no son parte de la red (una vía reclasificada como
+    carretera o una vía nueva sobre nodos existentes) se buscan en `index`, el índice de la
+    última extracción completa.
+    """
+    locations = {node_id: handler.nodes[node_id] for node_id in node_ids if handler.nodes.get(node_id)}
+    missing = [node_id for node_id in node_ids if node_id not in locations]
+    if missing:
+        cursor.execute(
+            "SELECT osm_id, ST_X(geom), ST_Y(geom) FROM nodos_carreteras WHERE osm_id = ANY(%s)", (missing,)
+        )
+        locations.update((node_id, (lon, lat)) for node_id, lon, lat in cursor.fetchall())
+    if index is not None:
+        for node_id in node_ids:
+            if node_id in locations:
+                continue
+            try:
+                location = index.get(node_id)
+            except KeyError:
+                continue
+            if location.valid():
+                locations[node_id] = (location.lon, location.lat)
+    return locations
+
+
+def build_segments(
+    handler: ChangeHandler, locations: Dict[int, Tuple[float, float]], region: Optional[Region] = None
+) -> Tuple[List[Segment], int]:
+    """
+    Segmentos de las vías vigentes. Como en la extracción completa, una vía se corta en el primer
+    nodo sin ubicación conocida (p. ej. ausente del índice de ubicaciones) y, con
+    `region`, solo se conservan las vías con algún nodo dentro de ella.
+    """
+    segments: List[Segment] = []
+    truncated = 0
+    for way_id, refs in handler.ways.items():
+        if refs is None:
+            continue
+        if region is not None and not any(ref in locations and region.contains(*locations[ref]) for ref in refs):
+            continue
+        attributes = handler.attributes[way_id]
+        for source, target in zip(refs, refs[1:]):
+            if source not in locations or target not in locations:
+                truncated += 1
+                break
+            (lon_s, lat_s), (lon_t, lat_t) = locations[source], locations[target]
+            length = segment_length(lon_s, lat_s, lon_t, lat_t)
+            segments.append((source, target, length, lon_s, lat_s, lon_t, lat_t, way_id, *attributes))
+    return segments, truncated
+
+
+def dense_node_ids(cursor, endpoints: Dict[int, Tuple[float, float]]) -> Dict[int, int]:
+    """
+    Inserta los extremos (por id de OSM) que aún no están en nodos_carreteras con ids a
+    continuación del mayor y devuelve el id denso de cada uno.
+    """
+    if not endpoints:
+        return {}
+    execute_values(
+        cursor,
+        """
+        INSERT INTO nodos_carreteras (id, osm_id, geom)
+        SELECT base.max_id + ROW_NUMBER() OVER (ORDER BY v.osm_id), v.osm_id,
+               ST_SetSRID(ST_MakePoint(v.lon, v.lat), 4326)
+        FROM (VALUES %s) AS v(osm_id, lon, lat)
+        CROSS JOIN (SELECT COALESCE(MAX(id), 0) AS max_id FROM nodos_carreteras) base
+        WHERE NOT EXISTS (SELECT 1 FROM nodos_carreteras n WHERE n.osm_id = v.osm_id)
+        """,
+        [(node_id, lon, lat) for node_id, (lon, lat) in endpoints.items()],
+        template="(%s::bigint, %s::float8, %s::float8)",
+    )
+    cursor.execute("SELECT osm_id, id FROM nodos_carreteras WHERE osm_id = ANY(%s)", (list(endpoints),))
+    return dict(cursor.fetchall())
+
+
+def apply_changes(cursor, handler: ChangeHandler, region: Optional[Region] = None, index=None) -> Dict[str, int]:
+    """
+    Aplica los deltas sobre las tablas vigentes; devuelve el conteo de cada operación. Sin
+    índice de ubicaciones, una vía truncada aborta la actualización (TruncatedWaysError).
+    """
+    lock_timeout(cursor)
+
+    cursor.execute(
+        "DELETE FROM aristas_carreteras WHERE osm_way_id = ANY(%s) RETURNING source, target",
+        (list(handler.ways),),
+    )
+    orphan_candidates = {node_id for row in cursor.fetchall() for node_id in row}
+    removed_edges = cursor.rowcount
+
+    # Nodos de la red que cambiaron de posición
+    moved = [(node_id, *location) for node_id, location in handler.nodes.items() if location]
+    moved_ids: List[int] = []
+    if moved:
+        moved_ids = [
+            row[0]
+            for row in execute_values(
+                cursor,
+                """
+                UPDATE nodos_carreteras n
+                SET geom = ST_SetSRID(ST_MakePoint(v.lon, v.lat), 4326)
+                FROM (VALUES %s) AS v(osm_id, lon, lat)
+                WHERE n.osm_id = v.osm_id AND NOT ST_Equals(n.geom, ST_SetSRID(ST_MakePoint(v.lon, v.lat), 4326))
+                RETURNING n.id
+                """,
+                moved,
+                fetch=True,
+            )
+        ]
+
+    # Aristas que no cambiaron de vía pero tocan un nodo movido
+    reshaped = []
+    if moved_ids:
+        cursor.execute(
+            """
+            SELECT a.id, ST_X(s.geom), ST_Y(s.geom), ST_X(t.geom), ST_Y(t.geom)
+            FROM aristas_carreteras a
+            JOIN nodos_carreteras s ON s.id = a.source
+            JOIN nodos_carreteras t ON t.id = a.target
+            WHERE a.source = ANY(%s) OR a.target = ANY(%s)
+            """,
+            (moved_ids, moved_ids),
+        )
+        reshaped = [
+            (edge_id, segment_length(lon_s, lat_s, lon_t, lat_t), lon_s, lat_s, lon_t, lat_t)
+            for edge_id, lon_s, lat_s, lon_t, lat_t in cursor.fetchall()
+        ]
+        execute_values(
+            cursor,
+            """
+            UPDATE aristas_carreteras a
+            SET costo_longitud_m = v.costo,
+                geom = ST_SetSRID(ST_MakeLine(ST_MakePoint(v.lon_s, v.lat_s), ST_MakePoint(v.lon_t, v.lat_t)), 4326)
+            FROM (VALUES %s) AS v(id, costo, lon_s, lat_s, lon_t, lat_t)
+            WHERE a.id = v.id
+            """,
+            reshaped,
+        )
+
+    node_ids = {node_id for refs in handler.ways.values() if refs for node_id in refs}
+    segments, truncated = build_segments(handler, resolve_locations(cursor, handler, node_ids, index), region)
+    if truncated and index is None:
+        raise TruncatedWaysError(
+            f"{truncated} vias tienen nodos sin ubicacion conocida y no existe el indice '{LOCATION_INDEX_PATH}'; "
+            "se requiere una carga completa (FORCE_REFRESH_INFRA=1)."
+        )
+
+    endpoints = {}
+    for source, target, _, lon_s, lat_s, lon_t, lat_t, *_ in segments:
+        endpoints.setdefault(source, (lon_s, lat_s))
+        endpoints.setdefault(target, (lon_t, lat_t))
+    dense_ids = dense_node_ids(cursor, endpoints)
+    if segments:
+        execute_values(
+            cursor,
+            """
+            INSERT INTO aristas_carreteras
+                (source, target, costo_longitud_m, geom, osm_way_id, clase_via, sentido, velocidad_max, peaje)
+            VALUES %s
+            """,
+            [(dense_ids[source], dense_ids[target], *rest) for source, target, *rest in segments],
+            template=(
+                "(%s, %s, %s, ST_SetSRID(ST_MakeLine(ST_MakePoint(%s, %s), ST_MakePoint(%s, %s)), 4326), "
+                "%s, %s, %s, %s, %s)"
+            ),
+        )
+
+    # Nodos que ya no usa ninguna arista (vías eliminadas o nodos borrados en OSM)
+    deleted_osm_ids = [node_id for node_id, location in handler.nodes.items() if location is None]
+    orphan_candidates.difference_update(dense_ids.values())
+    removed_nodes = 0
+    if orphan_candidates or deleted_osm_ids:
+        cursor.execute(
+            """
+            DELETE FROM nodos_carreteras n
+            WHERE (n.id = ANY(%s) OR n.osm_id = ANY(%s))
+              AND NOT EXISTS (SELECT 1 FROM aristas_carreteras a WHERE a.source = n.id OR a.target = n.id)
+            """,
+            (list(orphan_candidates), deleted_osm_ids),
+        )
+        removed_nodes = cursor.rowcount
+
+    return {
+        "aristas_eliminadas": removed_edges,
+        "aristas_insertadas": len(segments),
+        "aristas_reformadas": len(reshaped),
+        "nodos_movidos": len(moved_ids),
+        "nodos_eliminados": removed_nodes,
+        "vias_truncadas": truncated,
+    }
+
+
+def export_derived_artifacts(conn, data_path: Path, block_rows: int) -> None:
+    """
+    Reescribe infraestructura.col desde la base (en orden de id) y el artefacto del grafo con
+    los ids de arista reales, que tras una actualización incremental ya no son consecutivos.
+    Los nodos se exportan tal como están en la base, con su id denso y su id de OSM.
+    """
+    edge_ids = array("I")
+    names = [name for name, _ in EDGE_COLUMNS]
+    node_names = [name for name, _ in NODE_COLUMNS]
+    with conn:
+        with conn.cursor(name="exportar_aristas") as cur:
+            cur.itersize = block_rows
+            cur.execute(
+                """
+                SELECT id, source, target, costo_longitud_m,
+                       ST_X(ST_StartPoint(geom)), ST_Y(ST_StartPoint(geom)),
+                       ST_X(ST_EndPoint(geom)), ST_Y(ST_EndPoint(geom)),
+                       osm_way_id, COALESCE(clase_via, 0), sentido, velocidad_max, peaje
+                FROM aristas_carreteras
+                ORDER BY id
+                """
+            )
+            with ColumnarWriter(data_path, block_rows=block_rows, with_nodes=False) as writer:
+                while True:
+                    rows = cur.fetchmany(block_rows)
+                    if not rows:
+                        break
+                    columns = list(zip(*rows))
+                    edge_ids.extend(columns[0])
+                    writer.write_edges(dict(zip(names, columns[1:])))
+
+                with conn.cursor(name="exportar_nodos") as node_cur:
+                    node_cur.itersize = block_rows
+                    node_cur.execute("SELECT id, osm_id, ST_X(geom), ST_Y(geom) FROM nodos_carreteras ORDER BY id")
+                    while True:
+                        rows = node_cur.fetchmany(block_rows)
+                        if not rows:
+                            break
+                        writer.write_nodes(dict(zip(node_names, zip(*rows))))
+
+    graph_path = data_path.parent / GRAPH_ARTIFACT_FILENAME
+    with ColumnarReader(data_path) as reader:
+        resumen = write_graph_artifact(
+            reader, graph_path, edge_ids=edge_ids, directions=reader.edge_column("sentido")
+        )
+    print(f"Artefactos regenerados: {writer.num_nodes} nodos, {writer.num_edges} aristas, {resumen['bytes']} bytes de grafo.")
+
+
+def apply_pending_changes() -> bool:
+    """
+    Aplica los archivos de cambios pendientes. Returns True si no había nada que aplicar o
+    si se aplicaron correctamente, False si hubo un error.
+    """
+    load_dotenv()
+    start = time.perf_counter()
+    directory = changes_dir()
+    try:
+        region = resolve_region()
+    except (OSError, ValueError) as exc:
+        print(f"Region invalida: {exc}")
+        return False
+
+    try:
+        conn = connect_db()
+    except psycopg2.Error as exc:
+        print(f"Error al conectar con la base de datos: {exc}")
+        return False
+
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                ensure_changes_table(cur)
+                pending = pending_change_files(cur, directory)
+                if pending and not edges_have_way_ids(cur):
+                    print(
+                        "aristas_carreteras no tiene osm_way_id para todas las aristas; se requiere una carga "
+                        "completa (FORCE_REFRESH_INFRA=1) antes de aplicar cambios incrementales."
+                    )
+                    return False
+                if pending and not nodes_have_osm_ids(cur):
+                    print(
+                        "nodos_carreteras no tiene osm_id para todos los nodos; se requiere una carga "
+                        "completa (FORCE_REFRESH_INFRA=1) antes de aplicar cambios incrementales."
+                    )
+                    return False
+
+        if not pending:
+            print(f"No hay archivos de cambios pendientes en '{directory}'.")
+            return True
+
+        handler = ChangeHandler()
+        for name, path in pending:
+            print(f"Leyendo cambios de {name}...")
+            handler.apply_file(str(path))
+        print(f"{len(pending)} archivos: {len(handler.ways)} vias y {len(handler.nodes)} nodos modificados.")
+
+        with conn:
+            with conn.cursor() as cur:
+                resumen = apply_changes(cur, handler, region, open_location_index())
+                execute_values(cur, "INSERT INTO cambios_osm_aplicados (archivo) VALUES %s", [(name,) for name, _ in pending])
+                version = bump_data_version(cur, "infraestructura")
+        print(", ".join(f"{key}: {value}" for key, value in resumen.items()))
+        print(f"Cambios aplicados como version {version} del grafo en {time.perf_counter() - start:.2f} s.")
+
+        block_rows = int(os.getenv("INFRA_BLOCK_ROWS", str(DEFAULT_BLOCK_ROWS)))
+        data_path = SCRIPT_DIR / INFRA_DATA_FILENAME
+        try:
+            export_derived_artifacts(conn, data_path, block_rows)
+            print(f"Componentes conexas: {refresh_component_labels(conn, data_path)} nodos actualizados.")
+        except (OSError, psycopg2.Error) as exc:
+            print(f"Advertencia: no se pudieron regenerar los artefactos derivados ni las componentes: {exc}")
+            # Con componentes desactualizadas el ruteo podría descartar pares que ahora sí se conectan
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE nodos_carreteras SET componente = NULL WHERE componente IS NOT NULL")
+        return True
+    except (Exception, psycopg2.Error) as exc:
+        print(f"Error al aplicar los cambios de infraestructura: {exc}")
+        return False
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if apply_pending_changes() else 1)
@@ -0,0 +1,297 @@
+"""
+Formato intermedio columnar por bloques para la red vial (reemplaza a infraestructura.json).
+
+Disposición del archivo (little-endian, cada bloque alineado a 8 bytes):
+
+    MAGIC
+    bloque*      BLOCK_STRUCT (tipo, filas) seguido de cada columna contigua y relleno
+    directorio   DIRECTORY_STRUCT (tipo, offset, filas) por bloque
+    pie          FOOTER_STRUCT (versión, offset del directorio, bloques, aristas, nodos, MAGIC)
+
+Las aristas se escriben en bloques a medida que el extractor las produce, de modo que la
+memoria queda acotada por el tamaño de bloque. Al cerrar, los nodos se deduplican con NumPy a
+partir de los extremos de las aristas y se escriben ordenados por id, con `osm_id` igual al id.
+`spatial_order.spatially_reorder` reescribe luego el archivo con ids densos en orden de la curva
+de Hilbert (`osm_id` conserva el id original). `ColumnarReader` mapea el archivo y entrega cada
+bloque como arreglos NumPy sin copiar.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"RUTCOL\x00\x00"
+FORMAT_VERSION = 4
+
+BLOCK_EDGES = 1
+BLOCK_NODES = 2
+
+EDGE_COLUMNS = (
+    ("source", "<i8"),
+    ("target", "<i8"),
+    ("costo_m", "<f8"),
+    ("lon_s", "<f8"),
+    ("lat_s", "<f8"),
+    ("lon_t", "<f8"),
+    ("lat_t", "<f8"),
+    ("way_id", "<i8"),
+    # Atributos de la vía (road_attributes); los anchos pequeños van al final del bloque
+    ("clase_via", "<i2"),
+    ("sentido", "<i2"),
+    ("velocidad_max", "<i2"),
+    ("peaje", "u1"),
+)
+NODE_COLUMNS = (("id", "<i8"), ("osm_id", "<i8"), ("lon", "<f8"), ("lat", "<f8"))
+COLUMNS = {BLOCK_EDGES: EDGE_COLUMNS, BLOCK_NODES: NODE_COLUMNS}
+
+# tipo, reservado, filas
+BLOCK_STRUCT = struct.Struct("<IIQ")
+# tipo, reservado, offset, filas
+DIRECTORY_STRUCT = struct.Struct("<IIQQ")
+# versión, reservado, offset del directorio, bloques, aristas, nodos, magic
+FOOTER_STRUCT = struct.Struct("<IIQQQQ8s")
+
+DEFAULT_BLOCK_ROWS = 1 << 18
+
+Block = Dict[str, np.ndarray]
+
+
+class ColumnarFormatError(ValueError):
+    """El archivo no tiene el formato columnar esperado o está truncado."""
+
+
+def _as_column(values, dtype: str, rows: Optional[int]) -> np.ndarray:
+    column = np.ascontiguousarray(values, dtype=dtype)
+    if column.ndim != 1 or (rows is not None and len(column) != rows):
+        raise ValueError("Todas las columnas de un bloque deben ser vectores del mismo largo")
+    return column
+
+
+class ColumnarWriter:
+    """Escribe bloques de aristas en un archivo temporal y lo publica de forma atómica al cerrar."""
+
+    def __init__(self, path: Path, block_rows: int = DEFAULT_BLOCK_ROWS, with_nodes: bool = True) -> None:
+        self.path = Path(path)
+        self.block_rows = block_rows
+        # Los archivos parciales de la extracción paralela omiten los nodos; se deduplican al fusionar
+        self.with_nodes = with_nodes
+        self._tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        self._handle = open(self._tmp_path, "wb")
+        self._handle.write(MAGIC)
+        self._directory: List[Tuple[int, int, int]] = []
+        self.num_edges = 0
+        self.num_nodes = 0
+
+    def _write_block(self, kind: int, columns: Block) -> None:
+        rows = len(next(iter(columns.values())))
+        if rows == 0:
+            return
+        offset = self._handle.tell()
+        self._handle.write(BLOCK_STRUCT.pack(kind, 0, rows))
+        for name, _ in COLUMNS[kind]:
+            self._handle.write(columns[name].tobytes())
+        self._handle.write(bytes(-self._handle.tell() % 8))
+        self._directory.append((kind, offset, rows))
+
+    def write_edges(self, columns: Block) -> None:
+        """Agrega un bloque de aristas; `columns` trae un vector por cada nombre de EDGE_COLUMNS."""
+
+        rows = None
+        block: Block = {}
+        for name, dtype in EDGE_COLUMNS:
+            block[name] = _as_column(columns[name], dtype, rows)
+            rows = len(block[name])
+        self._write_block(BLOCK_EDGES, block)
+        self.num_edges += rows or 0
+
+    def write_nodes(self, columns: Block) -> None:
+        """Agrega un bloque de nodos ya deduplicados (para escritores con `with_nodes=False`)."""
+
+        rows = None
+        block: Block = {}
+        for name, dtype in NODE_COLUMNS:
+            block[name] = _as_column(columns[name], dtype, rows)
+            rows = len(block[name])
+        self._write_block(BLOCK_NODES, block)
+        self.num_nodes += rows or 0
+
+    def _write_nodes(self) -> None:
+        """Deduplica los extremos de todas las aristas escritas y agrega los bloques de nodos."""
+
+        self._handle.flush()
+        edge_blocks = [entry for entry in self._directory if entry[0] == BLOCK_EDGES]
+        if not edge_blocks:
+            return
+        with open(self._tmp_path, "rb") as handle:
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                node_ids, lon, lat = _unique_endpoints(view, edge_blocks)
+
+        self._handle.seek(0, os.SEEK_END)
+        for start in range(0, len(node_ids), self.block_rows):
+            stop = start + self.block_rows
+            ids = node_ids[start:stop]
+            self._write_block(
+                BLOCK_NODES, {"id": ids, "osm_id": ids, "lon": lon[start:stop], "lat": lat[start:stop]}
+            )
+        self.num_nodes = len(node_ids)
+
+    def close(self) -> Dict[str, int]:
+        if self.with_nodes:
+            self._write_nodes()
+        directory_offset = self._handle.tell()
+        for entry in self._directory:
+            self._handle.write(DIRECTORY_STRUCT.pack(entry[0], 0, entry[1], entry[2]))
+        self._handle.write(
+            FOOTER_STRUCT.pack(
+                FORMAT_VERSION, 0, directory_offset, len(self._directory), self.num_edges, self.num_nodes, MAGIC
+            )
+        )
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.close()
+        os.replace(self._tmp_path, self.path)
+        return {"aristas": self.num_edges, "nodos": self.num_nodes, "bytes": self.path.stat().st_size}
+
+    def abort(self) -> None:
+        self._handle.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "ColumnarWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def merge_edge_files(inputs: Iterable[Path], output_path: Path, block_rows: int = DEFAULT_BLOCK_ROWS) -> Dict[str, int]:
+    """
+    Concatena los bloques de aristas de varios archivos (en el orden dado) en uno nuevo y
+    deduplica los nodos de todos ellos al cerrarlo.
+    """
+
+    with ColumnarWriter(output_path, block_rows=block_rows) as writer:
+        for path in inputs:
+            with ColumnarReader(path) as reader:
+                for block in reader.edge_blocks():
+                    writer.write_edges(block)
+                # Las vistas del último bloque deben soltarse antes de cerrar el mmap
+                block = None
+    return {"aristas": writer.num_edges, "nodos": writer.num_nodes, "bytes": writer.path.stat().st_size}
+
+
+def _unique_endpoints(buffer, edge_blocks) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Nodos únicos (id ascendente) con las coordenadas de su primera aparición. Solo se
+    materializan los ids de los extremos; las coordenadas se recogen parte por parte.
+    """
+
+    # Cada parte son los extremos source o target de un bloque, en orden de escritura
+    parts = []
+    for kind, offset, rows in edge_blocks:
+        block = _block_view(buffer, kind, offset, rows)
+        parts.append((block["source"], block["lon_s"], block["lat_s"]))
+        parts.append((block["target"], block["lon_t"], block["lat_t"]))
+
+    ids = np.concatenate([part[0] for part in parts])
+    node_ids, first = np.unique(ids, return_index=True)
+    del ids
+
+    lon = np.empty(len(node_ids), dtype="<f8")
+    lat = np.empty(len(node_ids), dtype="<f8")
+    order = np.argsort(first, kind="stable")
+    first_sorted = first[order]
+    start = 0
+    for _, part_lon, part_lat in parts:
+        end = start + len(part_lon)
+        lo, hi = np.searchsorted(first_sorted, (start, end))
+        local = first_sorted[lo:hi] - start
+        lon[order[lo:hi]] = part_lon[local]
+        lat[order[lo:hi]] = part_lat[local]
+        start = end
+    return node_ids, lon, lat
+
+
+def is_current_format(path: Path) -> bool:
+    """True si `path` es un archivo columnar completo de la versión que entiende este módulo."""
+    try:
+        with ColumnarReader(path):
+            return True
+    except (OSError, ValueError):
+        return False
+
+
+def _block_view(buffer, kind: int, offset: int, rows: int) -> Block:
+    stored_kind, _, stored_rows = BLOCK_STRUCT.unpack_from(buffer, offset)
+    if stored_kind != kind or stored_rows != rows:
+        raise ColumnarFormatError("El directorio no coincide con la cabecera del bloque")
+    position = offset + BLOCK_STRUCT.size
+    block: Block = {}
+    for name, dtype in COLUMNS[kind]:
+        block[name] = np.frombuffer(buffer, dtype=dtype, count=rows, offset=position)
+        position += block[name].nbytes
+    return block
+
+
+class ColumnarReader:
+    """Lectura por bloques de un archivo columnar mapeado en memoria."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            size = len(self._mmap)
+            if size < len(MAGIC) + FOOTER_STRUCT.size or self._mmap[: len(MAGIC)] != MAGIC:
+                raise ColumnarFormatError(f"{self.path}: no es un archivo columnar de infraestructura")
+            version, _, directory_offset, num_blocks, self.num_edges, self.num_nodes, magic = (
+                FOOTER_STRUCT.unpack_from(self._mmap, size - FOOTER_STRUCT.size)
+            )
+            if magic != MAGIC:
+                raise ColumnarFormatError(f"{self.path}: archivo truncado")
+            if version != FORMAT_VERSION:
+                raise ColumnarFormatError(f"{self.path}: versión de formato {version} no soportada")
+            self._directory = [
+                DIRECTORY_STRUCT.unpack_from(self._mmap, directory_offset + index * DIRECTORY_STRUCT.size)
+                for index in range(num_blocks)
+            ]
+        except Exception:
+            self.close()
+            raise
+
+    def _blocks(self, kind: int) -> Iterator[Block]:
+        for stored_kind, _, offset, rows in self._directory:
+            if stored_kind == kind:
+                yield _block_view(self._mmap, kind, offset, rows)
+
+    def edge_blocks(self) -> Iterator[Block]:
+        return self._blocks(BLOCK_EDGES)
+
+    def node_blocks(self) -> Iterator[Block]:
+        return self._blocks(BLOCK_NODES)
+
+    def edge_column(self, name: str) -> np.ndarray:
+        """Copia contigua de una columna de aristas en orden de escritura."""
+
+        parts = [block[name] for block in self.edge_blocks()]
+        dtype = dict(EDGE_COLUMNS)[name]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    def close(self) -> None:
+        if not self._mmap.closed:
+            self._mmap.close()
+
+    def __enter__(self) -> "ColumnarReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,67 @@
+"""
+Componentes conexas de la red vial (ignorando el sentido de las vías).
+
+Se calculan con NumPy al cargar: cada ronda engancha la raíz mayor de cada arista a la menor y
+luego comprime los caminos hasta que todo nodo apunta a su raíz, así que el número de rondas
+crece con log(n) y no con el diámetro de la red. Las componentes se numeran por tamaño
+descendente: la componente 1 es la red principal y las demás son islas (p. ej. Chiloé sin
+transbordadores) o tramos desconectados.
+"""
+
+from typing import Dict
+
+import numpy as np
+
+from columnar_format import ColumnarReader
+
+MAIN_COMPONENT = 1
+
+
+def root_labels(num_nodes: int, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Raíz (el menor índice) de la componente de cada nodo, dados los extremos densos de las aristas."""
+
+    parent = np.arange(num_nodes, dtype=np.int64)
+    while True:
+        root_s, root_t = parent[sources], parent[targets]
+        crossing = root_s != root_t
+        if not crossing.any():
+            return parent
+        # Las aristas internas a un árbol ya no aportan en las rondas siguientes
+        sources, targets = sources[crossing], targets[crossing]
+        root_s, root_t = root_s[crossing], root_t[crossing]
+        np.minimum.at(parent, np.maximum(root_s, root_t), np.minimum(root_s, root_t))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+
+def number_components(roots: np.ndarray) -> np.ndarray:
+    """Renumera las raíces como 1..k por tamaño descendente (a igual tamaño, por raíz)."""
+
+    unique_roots, inverse, counts = np.unique(roots, return_inverse=True, return_counts=True)
+    order = np.lexsort((unique_roots, -counts))
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(1, len(order) + 1, dtype=np.int32)
+    return rank[inverse]
+
+
+def component_labels(reader: ColumnarReader) -> np.ndarray:
+    """Componente de cada nodo del archivo columnar, en el orden de sus bloques de nodos."""
+
+    node_ids = np.concatenate([block["id"] for block in reader.node_blocks()] or [np.empty(0, dtype="<i8")])
+    sources = np.searchsorted(node_ids, reader.edge_column("source"))
+    targets = np.searchsorted(node_ids, reader.edge_column("target"))
+    return number_components(root_labels(len(node_ids), sources, targets))
+
+
+def summarize(labels: np.ndarray) -> Dict[str, float]:
+    if not len(labels):
+        return {"componentes": 0, "nodos_principal": 0, "fraccion_principal": 0.0}
+    main = int(np.count_nonzero(labels == MAIN_COMPONENT))
+    return {
+        "componentes": int(labels.max()),
+        "nodos_principal": main,
+        "fraccion_principal": round(main / len(labels), 4),
+    }
@@ -1,136 +1,291 @@
-import json
+import argparse
 import os
+import shutil
 import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Optional
 
 import osmium as o
-import requests
-from tqdm import tqdm
+
+from columnar_format import (
+    DEFAULT_BLOCK_ROWS,
+    EDGE_COLUMNS,
+    ColumnarReader,
+    ColumnarWriter,
+    is_current_format,
+    merge_edge_files,
+)
+from graph_artifact import write_graph_artifact
+from region import REGIONES, Region, describe_region, region_matches, resolve_region, write_region_marker
+from resumable_download import download_file_with_progress
+from road_attributes import HIGHWAY_CLASSES, road_attributes
+from spatial_order import spatially_reorder
 
 URL_CHILE_PBF = "http://download.geofabrik.de/south-america/chile-latest.osm.pbf"
 LOCAL_PBF_FILENAME = "chile-latest.osm.pbf"
-OUTPUT_JSON_FILENAME = "infraestructura.json"
+OUTPUT_DATA_FILENAME = "infraestructura.col"
+GRAPH_ARTIFACT_FILENAME = "grafo.bin"
 
 SCRIPT_DIR = Path(__file__).resolve().parent
+EXTRACT_WORK_DIR = SCRIPT_DIR / "extraccion_tmp"
+
+# Índice de ubicaciones en disco compartido por los workers. sparse_file_array ocupa 16 bytes
+# por nodo y no necesita ordenarse porque los PBF de Geofabrik vienen ordenados por id.
+LOCATION_INDEX_TYPE = os.getenv("INFRA_LOCATION_INDEX", "sparse_file_array")
+# Se conserva tras la extracción: apply_infra_changes.py resuelve en él los nodos de vías que
+# entran a la red sin que sus nodos aparezcan en el archivo de cambios
+LOCATION_INDEX_PATH = Path(os.getenv("INFRA_LOCATION_INDEX_PATH", str(SCRIPT_DIR / "ubicaciones.idx")))
 
-HIGHWAY_TYPES = {
-    "motorway",
-    "trunk",
-    "primary",
-    "secondary",
-    "tertiary",
-    "unclassified",
-    "residential",
-    "motorway_link",
-    "trunk_link",
-    "primary_link",
-    "secondary_link",
-    "tertiary_link",
-    "living_street",
-    "service",
-    "road",
-}
+HIGHWAY_TYPES = frozenset(HIGHWAY_CLASSES)
+
+# Tipo de array.array para acumular cada columna de EDGE_COLUMNS
+ARRAY_TYPECODES = {"<i8": "q", "<f8": "d", "<i2": "h", "u1": "B"}
 
 
 class RoadHandler(o.SimpleHandler):
-    def __init__(self):
+    """
+    Acumula los segmentos en columnas compactas y los vuelca al escritor cada `block_rows`.
+    Con `shards` > 1 solo procesa las vías cuyo id cae en su fragmento (`shard`). Con `region`
+    conserva completas las vías que tienen al menos un nodo dentro de ella.
+    """
+
+    def __init__(
+        self,
+        writer: ColumnarWriter,
+        block_rows: int = DEFAULT_BLOCK_ROWS,
+        shard: int = 0,
+        shards: int = 1,
+        region: Optional[Region] = None,
+    ):
         super().__init__()
-        self.aristas = []
+        self.writer = writer
+        self.block_rows = block_rows
+        self.shard = shard
+        self.shards = shards
+        self.region = region
+        self.total_segments = 0
+        self.clipped_ways = 0
+        self._reset_block()
+
+    def _reset_block(self):
+        self.columns = {name: array(ARRAY_TYPECODES[dtype]) for name, dtype in EDGE_COLUMNS}
+
+    def flush(self):
+        if self.columns["source"]:
+            self.writer.write_edges(self.columns)
+            self._reset_block()
+
+    def _touches_region(self, way_obj) -> bool:
+        return any(
+            node.location.valid() and self.region.contains(node.location.lon, node.location.lat)
+            for node in way_obj.nodes
+        )
 
     def way(self, way_obj):
+        if way_obj.id % self.shards != self.shard:
+            return
         if "highway" not in way_obj.tags:
             return
         if way_obj.tags["highway"] not in HIGHWAY_TYPES:
             return
+        if self.region is not None and not self._touches_region(way_obj):
+            self.clipped_ways += 1
+            return
 
+        columns = self.columns
+        attributes = road_attributes(way_obj.tags)
         try:
             for index in range(len(way_obj.nodes) - 1):
                 source_node = way_obj.nodes[index]
                 target_node = way_obj.nodes[index + 1]
                 length = o.geom.haversine_distance(source_node.location, target_node.location)
-                self.aristas.append(
-                    {
-                        "source": source_node.ref,
-                        "target": target_node.ref,
-                        "costo_longitud_m": round(length, 2),
-                        "geom": [
-                            [source_node.location.lon, source_node.location.lat],
-                            [target_node.location.lon, target_node.location.lat],
-                        ],
-                    }
+                segment = (
+                    source_node.ref,
+                    target_node.ref,
+                    round(length, 2),
+                    source_node.location.lon,
+                    source_node.location.lat,
+                    target_node.location.lon,
+                    target_node.location.lat,
+                    way_obj.id,
+                    *attributes,
                 )
+                for (name, _), value in zip(EDGE_COLUMNS, segment):
+                    columns[name].append(value)
+                self.total_segments += 1
         except o.InvalidLocationError:
             pass
 
+        if len(columns["source"]) >= self.block_rows:
+            self.flush()
 
-def download_file_with_progress(url: str, destination: Path) -> bool:
-    print(f"Descargando archivo desde {url}...")
-    try:
-        with requests.get(url, stream=True, timeout=20) as response:
-            response.raise_for_status()
-            total_size = int(response.headers.get("content-length", 0))
-            with tqdm(total=total_size, unit="iB", unit_scale=True, desc=destination.name) as progress_bar:
-                with open(destination, "wb") as file_handle:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            file_handle.write(chunk)
-                            progress_bar.update(len(chunk))
-        print(f"Archivo descargado exitosamente en '{destination}'.")
-        return True
-    except requests.RequestException as exc:
-        print(f"Error al descargar el archivo: {exc}")
-        return False
-
-
-def extract_and_transform_infrastructure(osm_pbf_path: Path, output_json_path: Path) -> None:
-    print(f"Iniciando la extraccion y transformacion desde '{osm_pbf_path}'...")
-    print("Este proceso puede tardar varios minutos.")
 
-    road_handler = RoadHandler()
-    road_handler.apply_file(str(osm_pbf_path), locations=True)
-    print(f"Procesamiento de aristas completado. Se encontraron {len(road_handler.aristas)} segmentos.")
+def build_location_index(osm_pbf_path: Path, index_path: Path) -> None:
+    """Primera pasada: guarda la ubicación de todos los nodos en un índice en disco."""
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    tmp_path.unlink(missing_ok=True)
+    index = o.index.create_map(f"{LOCATION_INDEX_TYPE},{tmp_path}")
+    locations = o.NodeLocationsForWays(index)
+    o.apply(o.io.Reader(str(osm_pbf_path), o.osm.osm_entity_bits.NODE), locations)
+    # El mapa se cierra al liberarse; solo entonces el índice completo reemplaza al anterior
+    del locations, index
+    os.replace(tmp_path, index_path)
+
+
+def extract_shard(
+    osm_pbf_path: Path,
+    index_path: Path,
+    shard: int,
+    shards: int,
+    output_path: Path,
+    block_rows: int,
+    region: Optional[Region] = None,
+) -> int:
+    """
+    Worker: recorre solo las vías del PBF, resuelve sus nodos en el índice compartido y escribe
+    las aristas de su fragmento en un archivo parcial sin nodos.
+    """
+    index = o.index.create_map(f"{LOCATION_INDEX_TYPE},{index_path}")
+    locations = o.NodeLocationsForWays(index)
+    locations.ignore_errors()
+    with ColumnarWriter(output_path, block_rows=block_rows, with_nodes=False) as writer:
+        road_handler = RoadHandler(writer, block_rows=block_rows, shard=shard, shards=shards, region=region)
+        o.apply(o.io.Reader(str(osm_pbf_path), o.osm.osm_entity_bits.WAY), locations, road_handler)
+        road_handler.flush()
+    return road_handler.total_segments
+
 
-    print("Construyendo diccionario de nodos unicos...")
-    nodos_finales = {}
-    for arista in road_handler.aristas:
-        source_id = arista["source"]
-        target_id = arista["target"]
+def extract_parallel(
+    osm_pbf_path: Path,
+    index_path: Path,
+    output_path: Path,
+    workers: int,
+    block_rows: int,
+    region: Optional[Region] = None,
+) -> None:
+    """
+    Extracción en `workers` procesos sobre el índice de ubicaciones en disco: un fragmento de vías
+    por worker (id de vía módulo `workers`) y una fusión final que deduplica los nodos. Los
+    archivos intermedios van a EXTRACT_WORK_DIR.
+    """
+    start = time.perf_counter()
+    parts = [EXTRACT_WORK_DIR / f"parte_{shard:03d}.col" for shard in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(extract_shard, osm_pbf_path, index_path, shard, workers, part, block_rows, region)
+            for shard, part in enumerate(parts)
+        ]
+        segments = sum(future.result() for future in futures)
+    print(
+        f"Procesamiento de aristas completado en {time.perf_counter() - start:.1f} s con {workers} workers. "
+        f"Se encontraron {segments} segmentos."
+    )
+
+    print("Fusionando archivos parciales y deduplicando nodos...")
+    merge_edge_files(parts, output_path, block_rows=block_rows)
+
+
+def extract_sequential(
+    osm_pbf_path: Path, index_path: Path, output_path: Path, block_rows: int, region: Optional[Region] = None
+) -> None:
+    index = o.index.create_map(f"{LOCATION_INDEX_TYPE},{index_path}")
+    locations = o.NodeLocationsForWays(index)
+    locations.ignore_errors()
+    with ColumnarWriter(output_path, block_rows=block_rows) as writer:
+        road_handler = RoadHandler(writer, block_rows=block_rows, region=region)
+        o.apply(o.io.Reader(str(osm_pbf_path), o.osm.osm_entity_bits.WAY), locations, road_handler)
+        road_handler.flush()
+        print(f"Procesamiento de aristas completado. Se encontraron {road_handler.total_segments} segmentos.")
+        if region is not None:
+            print(f"Se descartaron {road_handler.clipped_ways} vias fuera de la region.")
+        print("Deduplicando nodos y cerrando el archivo columnar...")
 
-        if source_id not in nodos_finales:
-            lon, lat = arista["geom"][0]
-            nodos_finales[source_id] = {"id": source_id, "lon": lon, "lat": lat}
 
-        if target_id not in nodos_finales:
-            lon, lat = arista["geom"][1]
-            nodos_finales[target_id] = {"id": target_id, "lon": lon, "lat": lat}
+def extract_and_transform_infrastructure(osm_pbf_path: Path, output_path: Path, region: Optional[Region] = None) -> None:
+    print(f"Iniciando la extraccion y transformacion desde '{osm_pbf_path}'...")
+    print(f"Region: {describe_region(region)}. Este proceso puede tardar varios minutos.")
 
-    final_structure = {"nodos": list(nodos_finales.values()), "aristas": road_handler.aristas}
+    block_rows = int(os.getenv("INFRA_BLOCK_ROWS", str(DEFAULT_BLOCK_ROWS)))
+    workers = max(1, int(os.getenv("INFRA_EXTRACT_WORKERS", "1")))
+    shutil.rmtree(EXTRACT_WORK_DIR, ignore_errors=True)
+    EXTRACT_WORK_DIR.mkdir(parents=True)
+    try:
+        start = time.perf_counter()
+        print(f"Construyendo indice de ubicaciones de nodos ({LOCATION_INDEX_TYPE}) en '{LOCATION_INDEX_PATH}'...")
+        build_location_index(osm_pbf_path, LOCATION_INDEX_PATH)
+        print(f"Indice construido en {time.perf_counter() - start:.1f} s.")
 
-    print(f"Guardando la infraestructura transformada en '{output_json_path}'...")
-    with open(output_json_path, "w", encoding="utf-8") as file_handle:
-        json.dump(final_structure, file_handle)
+        # La extracción deja los ids de OSM; la renumeración espacial produce el archivo final
+        raw_path = EXTRACT_WORK_DIR / "crudo.col"
+        if workers > 1:
+            extract_parallel(osm_pbf_path, LOCATION_INDEX_PATH, raw_path, workers, block_rows, region)
+        else:
+            extract_sequential(osm_pbf_path, LOCATION_INDEX_PATH, raw_path, block_rows, region)
 
-    print(f"Proceso completado. Archivo '{output_json_path}' generado con exito.")
+        start = time.perf_counter()
+        print("Asignando ids de nodo densos en orden de la curva de Hilbert...")
+        spatially_reorder(raw_path, output_path, block_rows=block_rows)
+        print(f"Renumeracion completada en {time.perf_counter() - start:.1f} s.")
+    finally:
+        shutil.rmtree(EXTRACT_WORK_DIR, ignore_errors=True)
+    write_region_marker(output_path, region)
+
+    with ColumnarReader(output_path) as reader:
+        print(f"Infraestructura transformada: {reader.num_nodes} nodos, {reader.num_edges} aristas en '{output_path}'.")
+
+        graph_path = output_path.parent / GRAPH_ARTIFACT_FILENAME
+        print(f"Escribiendo el artefacto binario del grafo en '{graph_path}'...")
+        resumen = write_graph_artifact(
+            reader, graph_path, directions=reader.edge_column("sentido")
+        )
+    print(f"Artefacto del grafo: {resumen['nodos']} nodos, {resumen['arcos']} arcos, {resumen['bytes']} bytes.")
+
+    print(f"Proceso completado. Archivo '{output_path}' generado con exito.")
 
 
 def file_exists_and_not_empty(path: Path) -> bool:
     return path.exists() and path.stat().st_size > 0
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Extrae la red vial de Chile desde el PBF de Geofabrik.")
+    clip = parser.add_mutually_exclusive_group()
+    clip.add_argument("--region", choices=sorted(REGIONES), help="Region predefinida (o INFRA_REGION)")
+    clip.add_argument("--bbox", help="min_lon,min_lat,max_lon,max_lat (o INFRA_BBOX)")
+    clip.add_argument("--polygon", help="Archivo GeoJSON con un Polygon/MultiPolygon (o INFRA_POLYGON)")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    try:
+        region = resolve_region(args.region, args.bbox, args.polygon)
+    except (OSError, ValueError) as exc:
+        print(f"Region invalida: {exc}")
+        sys.exit(2)
+
     pbf_path = SCRIPT_DIR / LOCAL_PBF_FILENAME
-    json_path = SCRIPT_DIR / OUTPUT_JSON_FILENAME
+    output_path = SCRIPT_DIR / OUTPUT_DATA_FILENAME
 
     force_refresh = any(
         os.getenv(var, "").lower() in {"1", "true", "yes"} for var in ("FORCE_REFRESH_INFRA", "FORCE_REFRESH")
     )
 
-    if file_exists_and_not_empty(json_path) and not force_refresh:
+    same_region = region_matches(output_path, region)
+    current_format = is_current_format(output_path)
+    if file_exists_and_not_empty(output_path) and not force_refresh and same_region and current_format:
         print(
-            f"El archivo transformado '{json_path}' ya existe. Se omite la extraccion "
+            f"El archivo transformado '{output_path}' ya existe. Se omite la extraccion "
             "(usa FORCE_REFRESH_INFRA=1 para forzar una nueva descarga)."
         )
         sys.exit(0)
+    if file_exists_and_not_empty(output_path) and not same_region:
+        print(f"'{output_path}' se extrajo con otra region; se extraera nuevamente.")
+    elif file_exists_and_not_empty(output_path) and not current_format:
+        print(f"'{output_path}' tiene una version de formato anterior; se extraera nuevamente.")
 
     if force_refresh or not file_exists_and_not_empty(pbf_path):
         if not pbf_path.exists():
@@ -138,7 +293,7 @@ if __name__ == "__main__":
         elif pbf_path.stat().st_size == 0:
             print(f"El archivo '{pbf_path}' esta vacio. Se iniciara la descarga nuevamente.")
         else:
-            print(f"Se forzara la descarga de '{pbf_path}'.")
+            print(f"Se comprobara si hay una version nueva de '{pbf_path}'.")
 
         if not download_file_with_progress(URL_CHILE_PBF, pbf_path):
             print("La descarga fallo. No se puede continuar.")
@@ -146,4 +301,4 @@ if __name__ == "__main__":
     else:
         print(f"El archivo de datos '{pbf_path}' ya existe. Se omitira la descarga.")
 
-    extract_and_transform_infrastructure(pbf_path, json_path)
+    extract_and_transform_infrastructure(pbf_path, output_path, region)
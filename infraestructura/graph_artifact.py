@@ -0,0 +1,263 @@
+"""
+Artefacto binario del grafo vial en formato CSR, pensado para abrirse con mmap.
+
+Disposición del archivo (little-endian, secciones alineadas a 8 bytes):
+
+    cabecera (HEADER_STRUCT)
+    node_ids   int64[n]     id de cada nodo en nodos_carreteras, ordenado ascendente (índice = posición)
+    lon        float64[n]
+    lat        float64[n]
+    offsets    int64[n + 1] inicio de los arcos salientes de cada nodo
+    targets    uint32[m]    índice denso del nodo destino de cada arco
+    weights    float32[m]   costo del arco en metros
+    edge_ids   uint32[m]    id de la arista en aristas_carreteras
+
+Sin sentidos, cada arista aporta dos arcos (m = 2 * aristas) y la cabecera lleva
+FLAG_UNDIRECTED; con sentidos (road_attributes: 1, -1 o 0) una vía de sentido único aporta un
+solo arco. El checksum es un CRC32 de todo lo que sigue a la cabecera.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+from columnar_format import ColumnarReader
+
+MAGIC = b"RUTGRAF\x00"
+FORMAT_VERSION = 1
+FLAG_UNDIRECTED = 0x1
+# Los ids de arista vienen de la base (actualización incremental) y no de la posición en el archivo
+FLAG_EXPLICIT_IDS = 0x2
+
+# magic, versión de formato, flags, construido_en, nodos, arcos, aristas, crc32, reservado
+HEADER_STRUCT = struct.Struct("<8sIIQQQQII")
+HEADER_SIZE = 64
+
+# (nombre, typecode de array, elementos por nodo o por arco)
+NODE_SECTIONS = (("node_ids", "q"), ("lon", "d"), ("lat", "d"))
+ARC_SECTIONS = (("targets", "I"), ("weights", "f"), ("edge_ids", "I"))
+
+CHECKSUM_CHUNK = 16 * 1024 * 1024
+
+class GraphArtifactError(ValueError):
+    """El archivo no es un artefacto de grafo válido o está corrupto."""
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _section_layout(num_nodes: int, num_arcs: int) -> Dict[str, Tuple[str, int, int]]:
+    """Calcula (typecode, offset, cantidad) de cada sección a partir de los tamaños."""
+
+    layout: Dict[str, Tuple[str, int, int]] = {}
+    offset = HEADER_SIZE
+    sections = [(name, code, num_nodes) for name, code in NODE_SECTIONS]
+    sections.append(("offsets", "q", num_nodes + 1))
+    sections.extend((name, code, num_arcs) for name, code in ARC_SECTIONS)
+    for name, code, count in sections:
+        offset = _align(offset)
+        layout[name] = (code, offset, count)
+        offset += array(code).itemsize * count
+    return layout
+
+
+def write_graph_artifact(
+    reader: ColumnarReader,
+    output_path: Path,
+    built_at: Optional[int] = None,
+    edge_ids: Optional[Sequence[int]] = None,
+    directions: Optional[Sequence[int]] = None,
+) -> Dict[str, int]:
+    """Construye el CSR a partir del archivo columnar (aristas en el orden de carga) y lo escribe en `output_path`.
+
+    El id de cada arista es su posición 1-based en el archivo, igual que el id que asigna la carga
+    completa a aristas_carreteras, salvo que `edge_ids` los entregue explícitos (p. ej. tras
+    aplicar cambios incrementales). Con `directions` cada arista solo genera los arcos que su
+    sentido permite. Todo se calcula con NumPy sobre las columnas; la escritura es atómica.
+    """
+
+    node_ids = np.concatenate([block["id"] for block in reader.node_blocks()] or [np.empty(0, dtype="<i8")])
+    lon = np.concatenate([block["lon"] for block in reader.node_blocks()] or [np.empty(0, dtype="<f8")])
+    lat = np.concatenate([block["lat"] for block in reader.node_blocks()] or [np.empty(0, dtype="<f8")])
+    if np.any(node_ids[1:] <= node_ids[:-1]):
+        raise ValueError("Los nodos del archivo columnar deben venir ordenados por id y sin repetir")
+
+    sources = reader.edge_column("source")
+    targets = reader.edge_column("target")
+    num_nodes = len(node_ids)
+    num_edges = len(sources)
+    if edge_ids is not None and len(edge_ids) != num_edges:
+        raise ValueError(f"Se esperaban {num_edges} ids de arista y se recibieron {len(edge_ids)}")
+    if directions is not None and len(directions) != num_edges:
+        raise ValueError(f"Se esperaban {num_edges} sentidos de arista y se recibieron {len(directions)}")
+
+    source_idx = np.searchsorted(node_ids, sources)
+    target_idx = np.searchsorted(node_ids, targets)
+    for name, ids, idx in (("source", sources, source_idx), ("target", targets, target_idx)):
+        if len(ids) and (idx.max() >= num_nodes or not np.array_equal(node_ids[idx], ids)):
+            raise ValueError(f"Hay aristas cuyo {name} no está entre los nodos del archivo columnar")
+
+    if directions is None:
+        allowed = np.ones((num_edges, 2), dtype=bool)
+    else:
+        senses = np.asarray(directions)
+        allowed = np.column_stack((senses >= 0, senses <= 0))
+    if edge_ids is None:
+        ids = np.arange(1, num_edges + 1, dtype=np.uint32)
+    else:
+        ids = np.asarray(edge_ids, dtype=np.uint32)
+
+    # Cada arista aporta (u -> v, v -> u) según su sentido; la máscara conserva el orden por arista
+    arc_from = np.column_stack((source_idx, target_idx))[allowed]
+    arc_to = np.column_stack((target_idx, source_idx))[allowed]
+    costs = reader.edge_column("costo_m").astype(np.float32)
+    arc_weights = np.column_stack((costs, costs))[allowed]
+    arc_edges = np.column_stack((ids, ids))[allowed]
+    num_arcs = len(arc_from)
+
+    # Orden estable por nodo de origen y suma de prefijos de los grados
+    order = np.argsort(arc_from, kind="stable")
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(arc_from, minlength=num_nodes), out=offsets[1:])
+
+    sections = {
+        "node_ids": node_ids,
+        "lon": lon,
+        "lat": lat,
+        "offsets": offsets,
+        "targets": arc_to[order],
+        "weights": arc_weights[order],
+        "edge_ids": arc_edges[order],
+    }
+    layout = _section_layout(num_nodes, num_arcs)
+
+    output_path = Path(output_path)
+    tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    checksum = 0
+    with open(tmp_path, "wb") as handle:
+        handle.write(bytes(HEADER_SIZE))
+        for name, (code, offset, _) in layout.items():
+            padding = bytes(offset - handle.tell())
+            data = np.ascontiguousarray(sections[name], dtype=np.dtype(code).newbyteorder("<"))
+            checksum = zlib.crc32(data, zlib.crc32(padding, checksum))
+            handle.write(padding)
+            handle.write(data)
+
+        header = HEADER_STRUCT.pack(
+            MAGIC,
+            FORMAT_VERSION,
+            (FLAG_UNDIRECTED if directions is None else 0) | (FLAG_EXPLICIT_IDS if edge_ids is not None else 0),
+            int(built_at if built_at is not None else time.time()),
+            num_nodes,
+            num_arcs,
+            num_edges,
+            checksum & 0xFFFFFFFF,
+            0,
+        )
+        handle.seek(0)
+        handle.write(header.ljust(HEADER_SIZE, b"\x00"))
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, output_path)
+
+    return {"nodos": num_nodes, "aristas": num_edges, "arcos": num_arcs, "bytes": output_path.stat().st_size}
+
+
+@dataclass(frozen=True)
+class GraphHeader:
+    format_version: int
+    flags: int
+    built_at: int
+    num_nodes: int
+    num_arcs: int
+    num_edges: int
+    checksum: int
+
+
+class GraphArtifact:
+    """Vista de solo lectura sobre un artefacto mapeado en memoria.
+
+    Las secciones se exponen como `memoryview` tipados sobre el mmap, sin copiar: procesos
+    distintos que abren el mismo archivo comparten sus páginas físicas en la caché del SO.
+    """
+
+    def __init__(self, path: Path, verify: bool = False) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if len(self._mmap) < HEADER_SIZE:
+                raise GraphArtifactError(f"{self.path}: archivo truncado")
+            magic, *fields = HEADER_STRUCT.unpack_from(self._mmap, 0)
+            if magic != MAGIC:
+                raise GraphArtifactError(f"{self.path}: no es un artefacto de grafo")
+            self.header = GraphHeader(*fields[:7])
+            if self.header.format_version != FORMAT_VERSION:
+                raise GraphArtifactError(
+                    f"{self.path}: versión de formato {self.header.format_version} no soportada"
+                )
+            if sys.byteorder != "little":
+                raise GraphArtifactError("El artefacto de grafo solo puede mapearse en hosts little-endian")
+
+            layout = _section_layout(self.header.num_nodes, self.header.num_arcs)
+            code, offset, count = layout["edge_ids"]
+            if len(self._mmap) < offset + array(code).itemsize * count:
+                raise GraphArtifactError(f"{self.path}: archivo truncado")
+
+            view = memoryview(self._mmap)
+            self._views = [view]
+            for name, (code, offset, count) in layout.items():
+                section = view[offset : offset + array(code).itemsize * count].cast(code)
+                self._views.append(section)
+                setattr(self, name, section)
+
+            if verify:
+                self.verify()
+        except Exception:
+            self.close()
+            raise
+
+    def verify(self) -> None:
+        """Recalcula el CRC32 del contenido y lo compara con la cabecera."""
+
+        checksum = 0
+        for start in range(HEADER_SIZE, len(self._mmap), CHECKSUM_CHUNK):
+            checksum = zlib.crc32(self._mmap[start : start + CHECKSUM_CHUNK], checksum)
+        if checksum & 0xFFFFFFFF != self.header.checksum:
+            raise GraphArtifactError(f"{self.path}: checksum inválido")
+
+    @property
+    def num_nodes(self) -> int:
+        return self.header.num_nodes
+
+    def neighbors(self, node_index: int) -> Iterator[Tuple[int, float, int]]:
+        """Itera (índice destino, costo, id de arista) de los arcos que salen de `node_index`."""
+
+        for slot in range(self.offsets[node_index], self.offsets[node_index + 1]):
+            yield self.targets[slot], self.weights[slot], self.edge_ids[slot]
+
+    def close(self) -> None:
+        for section in reversed(getattr(self, "_views", [])):
+            section.release()
+        self._views = []
+        if not self._mmap.closed:
+            self._mmap.close()
+
+    def __enter__(self) -> "GraphArtifact":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,29 +1,466 @@
+import argparse
 import os
 import sys
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Callable, Optional
 
-import ijson
+import numpy as np
 import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import execute_batch
+from psycopg2 import errors, sql
 from dotenv import load_dotenv
 
+from binary_copy import CopyBinaryStream, encode_rows, ewkb_points, ewkb_segments
+from columnar_format import ColumnarReader, is_current_format
+from components import component_labels, summarize
+from graph_artifact import FLAG_EXPLICIT_IDS, GraphArtifact, GraphArtifactError, write_graph_artifact
+from region import region_matches, resolve_region
+from road_attributes import HIGHWAY_CLASSES, TRUNK_CLASSES
 
-def node_generator(json_path: Path):
-    """Yield nodes without loading the full JSON into memory."""
-    with open(json_path, "rb") as file_handle:
-        for nodo in ijson.items(file_handle, "nodos.item"):
-            yield nodo["id"], nodo["lon"], nodo["lat"]
+INFRA_DATA_FILENAME = "infraestructura.col"
+GRAPH_ARTIFACT_FILENAME = "grafo.bin"
+COPY_BUFFER_SIZE = 1 << 20
+COMPONENT_BLOCK_ROWS = 1 << 18
 
+# Las recargas se construyen en STAGING_SCHEMA y se intercambian con las tablas de `public`;
+# la versión reemplazada queda en PREVIOUS_SCHEMA para poder revertir al instante.
+LIVE_SCHEMA = "public"
+STAGING_SCHEMA = "infra_staging"
+PREVIOUS_SCHEMA = "infra_anterior"
+INFRA_TABLES = ("nodos_carreteras", "aristas_carreteras")
+
+# Índices secundarios y FKs que se construyen después de la carga.
+# Deben coincidir con database/schema.sql.
+INFRA_INDEXES = {
+    "idx_aristas_source": "CREATE INDEX IF NOT EXISTS idx_aristas_source ON {schema}.aristas_carreteras(source)",
+    "idx_aristas_target": "CREATE INDEX IF NOT EXISTS idx_aristas_target ON {schema}.aristas_carreteras(target)",
+    "idx_aristas_way": "CREATE INDEX IF NOT EXISTS idx_aristas_way ON {schema}.aristas_carreteras(osm_way_id)",
+    "idx_aristas_clase": "CREATE INDEX IF NOT EXISTS idx_aristas_clase ON {schema}.aristas_carreteras(clase_via)",
+    "idx_aristas_geom": "CREATE INDEX IF NOT EXISTS idx_aristas_geom ON {schema}.aristas_carreteras USING GIST(geom)",
+    "idx_nodos_geom": "CREATE INDEX IF NOT EXISTS idx_nodos_geom ON {schema}.nodos_carreteras USING GIST(geom)",
+    "idx_nodos_osm": "CREATE UNIQUE INDEX IF NOT EXISTS idx_nodos_osm ON {schema}.nodos_carreteras(osm_id)",
+}
+# Índice por el que se ordena físicamente aristas_carreteras; los nodos ya llegan en orden de Hilbert
+EDGES_CLUSTER_INDEX = "idx_aristas_source"
+INFRA_FOREIGN_KEYS = {
+    "aristas_carreteras_source_fkey": "FOREIGN KEY (source) REFERENCES {schema}.nodos_carreteras(id)",
+    "aristas_carreteras_target_fkey": "FOREIGN KEY (target) REFERENCES {schema}.nodos_carreteras(id)",
+}
+STAGING_TABLES_DDL = (
+    """
+    CREATE TABLE {schema}.nodos_carreteras (
+        id BIGINT PRIMARY KEY,
+        osm_id BIGINT,
+        geom GEOMETRY(Point, 4326),
+        componente INTEGER
+    )
+    """,
+    """
+    CREATE TABLE {schema}.aristas_carreteras (
+        id SERIAL PRIMARY KEY,
+        source BIGINT,
+        target BIGINT,
+        costo_longitud_m FLOAT,
+        geom GEOMETRY(LineString, 4326),
+        osm_way_id BIGINT,
+        clase_via SMALLINT,
+        sentido SMALLINT NOT NULL DEFAULT 0,
+        velocidad_max SMALLINT NOT NULL DEFAULT 0,
+        peaje BOOLEAN NOT NULL DEFAULT FALSE
+    )
+    """,
+)
+
+
+def connect_db():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST", "localhost"),
+        port=os.getenv("DB_PORT", "5432"),
+    )
+
+
+def node_copy_blocks(reader: ColumnarReader, components: np.ndarray):
+    """Yield node blocks encoded as binary COPY tuples (id, osm id, EWKB point, componente)."""
+    start = 0
+    for block in reader.node_blocks():
+        stop = start + len(block["id"])
+        yield encode_rows(
+            [
+                block["id"].astype(">i8"),
+                block["osm_id"].astype(">i8"),
+                ewkb_points(block["lon"], block["lat"]),
+                components[start:stop].astype(">i4"),
+            ]
+        )
+        start = stop
+
+
+def edge_copy_blocks(reader: ColumnarReader):
+    """
+    Yield edge blocks encoded as binary COPY tuples (id, source, target, costo, EWKB linestring, way id,
+    clase, sentido, velocidad máxima, peaje).
+    Los ids se asignan en orden de escritura, igual que en el artefacto del grafo.
+    """
+    next_id = 1
+    for block in reader.edge_blocks():
+        rows = len(block["source"])
+        yield encode_rows(
+            [
+                np.arange(next_id, next_id + rows, dtype=">i4"),
+                block["source"].astype(">i8"),
+                block["target"].astype(">i8"),
+                block["costo_m"].astype(">f8"),
+                ewkb_segments(block["lon_s"], block["lat_s"], block["lon_t"], block["lat_t"]),
+                block["way_id"].astype(">i8"),
+                block["clase_via"].astype(">i2"),
+                block["sentido"].astype(">i2"),
+                block["velocidad_max"].astype(">i2"),
+                block["peaje"].astype("?"),
+            ]
+        )
+        next_id += rows
+
+
+def component_copy_blocks(node_ids: np.ndarray, components: np.ndarray):
+    """Yield (id, componente) blocks encoded as binary COPY tuples."""
+    for start in range(0, len(node_ids), COMPONENT_BLOCK_ROWS):
+        stop = start + COMPONENT_BLOCK_ROWS
+        yield encode_rows([node_ids[start:stop].astype(">i8"), components[start:stop].astype(">i4")])
+
+
+def copy_binary(cursor, schema: str, table: str, columns, rows) -> int:
+    """Transmite las filas con COPY binario e informa filas/segundo."""
+    stream = CopyBinaryStream(rows)
+    statement = sql.SQL("COPY {}.{} ({}) FROM STDIN WITH (FORMAT binary)").format(
+        sql.Identifier(schema), sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    start = time.perf_counter()
+    cursor.copy_expert(statement, stream, size=COPY_BUFFER_SIZE)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{table}: {stream.rows} filas en {elapsed:.2f} s "
+        f"({stream.rows / elapsed if elapsed else 0:,.0f} filas/s, {stream.bytes / 2**20:.1f} MB)"
+    )
+    return stream.rows
+
+
+def drop_infra_tables(cursor, schema: str) -> None:
+    cursor.execute(
+        sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(
+            sql.SQL(", ").join(sql.Identifier(schema, table) for table in reversed(INFRA_TABLES))
+        )
+    )
+
+
+def infra_tables_exist(cursor, schema: str) -> bool:
+    cursor.execute(
+        "SELECT COUNT(*) FROM pg_tables WHERE schemaname = %s AND tablename = ANY(%s)",
+        (schema, list(INFRA_TABLES)),
+    )
+    return cursor.fetchone()[0] == len(INFRA_TABLES)
+
+
+def prepare_staging_tables(cursor) -> None:
+    """Crea tablas de staging vacías, sin índices secundarios ni FKs, fuera del esquema público."""
+    for schema in (STAGING_SCHEMA, PREVIOUS_SCHEMA):
+        cursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(schema)))
+    drop_infra_tables(cursor, STAGING_SCHEMA)
+    for ddl in STAGING_TABLES_DDL:
+        cursor.execute(ddl.format(schema=STAGING_SCHEMA))
+
+
+def migrate_infra_schema(cursor) -> None:
+    """
+    Agrega a las tablas vigentes de un esquema anterior las columnas que ahora llena la carga y
+    sincroniza la tabla de referencia clases_via.
+    """
+    cursor.execute(
+        """
+        ALTER TABLE aristas_carreteras
+            ADD COLUMN IF NOT EXISTS osm_way_id BIGINT,
+            ADD COLUMN IF NOT EXISTS clase_via SMALLINT,
+            ADD COLUMN IF NOT EXISTS sentido SMALLINT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS velocidad_max SMALLINT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS peaje BOOLEAN NOT NULL DEFAULT FALSE
+        """
+    )
+    cursor.execute(
+        """
+        ALTER TABLE nodos_carreteras
+            ADD COLUMN IF NOT EXISTS osm_id BIGINT,
+            ADD COLUMN IF NOT EXISTS componente INTEGER
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS clases_via (
+            id SMALLINT PRIMARY KEY,
+            nombre TEXT NOT NULL UNIQUE,
+            troncal BOOLEAN NOT NULL DEFAULT FALSE
+        )
+        """
+    )
+    # Los códigos de clase_via se definen en road_attributes.HIGHWAY_CLASSES
+    cursor.executemany(
+        """
+        INSERT INTO clases_via (id, nombre, troncal) VALUES (%s, %s, %s)
+        ON CONFLICT (id) DO UPDATE SET nombre = EXCLUDED.nombre, troncal = EXCLUDED.troncal
+        """,
+        [(code, name, name in TRUNK_CLASSES) for code, name in enumerate(HIGHWAY_CLASSES, start=1)],
+    )
+
+
+def missing_indexes_or_constraints(cursor, schema: str) -> bool:
+    for index in INFRA_INDEXES:
+        cursor.execute("SELECT to_regclass(%s) IS NULL", (f"{schema}.{index}",))
+        if cursor.fetchone()[0]:
+            return True
+    cursor.execute(
+        "SELECT COUNT(*) FROM pg_constraint "
+        "WHERE conname = ANY(%s) AND convalidated AND conrelid = to_regclass(%s)",
+        (list(INFRA_FOREIGN_KEYS), f"{schema}.aristas_carreteras"),
+    )
+    return cursor.fetchone()[0] < len(INFRA_FOREIGN_KEYS)
+
+
+def build_index(name: str, statement: str) -> float:
+    """Construye un índice en su propia conexión para poder levantar varios a la vez."""
+    start = time.perf_counter()
+    conn = connect_db()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SET maintenance_work_mem = %s", (os.getenv("INFRA_MAINTENANCE_WORK_MEM", "512MB"),))
+                cur.execute(statement)
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+    print(f"Indice {name} construido en {elapsed:.2f} s")
+    return elapsed
+
+
+def cluster_infra_tables(conn, schema: str) -> None:
+    """
+    Ordena físicamente las aristas por nodo de origen. Como los ids de nodo siguen la curva de
+    Hilbert, las aristas de una misma zona quedan en páginas contiguas. nodos_carreteras se copió
+    ya en ese orden, así que solo se registra su índice de CLUSTER para futuros reordenamientos.
+    """
+    start = time.perf_counter()
+    build_index(EDGES_CLUSTER_INDEX, INFRA_INDEXES[EDGES_CLUSTER_INDEX].format(schema=schema))
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SET maintenance_work_mem = %s", (os.getenv("INFRA_MAINTENANCE_WORK_MEM", "512MB"),))
+            cur.execute(
+                sql.SQL("CLUSTER {} USING {}").format(
+                    sql.Identifier(schema, "aristas_carreteras"), sql.Identifier(EDGES_CLUSTER_INDEX)
+                )
+            )
+            cur.execute(
+                sql.SQL("ALTER TABLE {} CLUSTER ON {}").format(
+                    sql.Identifier(schema, "nodos_carreteras"), sql.Identifier("nodos_carreteras_pkey")
+                )
+            )
+    print(f"Tablas de {schema} ordenadas fisicamente en {time.perf_counter() - start:.2f} s")
+
+
+def rebuild_indexes_and_constraints(conn, schema: str) -> None:
+    """
+    Construye los índices en paralelo (INFRA_INDEX_WORKERS conexiones), agrega las FKs
+    y actualiza las estadísticas. Es idempotente: también repara una carga interrumpida.
+    """
+    start = time.perf_counter()
+    workers = max(1, int(os.getenv("INFRA_INDEX_WORKERS", "4")))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(build_index, name, stmt.format(schema=schema)) for name, stmt in INFRA_INDEXES.items()]
+        # result() propaga el primer error de construcción
+        for future in futures:
+            future.result()
+
+    edges_table = sql.Identifier(schema, "aristas_carreteras")
+    with conn:
+        with conn.cursor() as cur:
+            for constraint, definition in INFRA_FOREIGN_KEYS.items():
+                cur.execute(
+                    "SELECT 1 FROM pg_constraint WHERE conname = %s AND conrelid = to_regclass(%s)",
+                    (constraint, f"{schema}.aristas_carreteras"),
+                )
+                if cur.fetchone():
+                    continue
+                # NOT VALID + VALIDATE evita bloquear escrituras mientras se verifican las filas
+                cur.execute(
+                    sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID").format(
+                        edges_table, sql.Identifier(constraint), sql.SQL(definition.format(schema=schema))
+                    )
+                )
+                cur.execute(
+                    sql.SQL("ALTER TABLE {} VALIDATE CONSTRAINT {}").format(edges_table, sql.Identifier(constraint))
+                )
+
+    previous_autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for table in INFRA_TABLES:
+                cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(schema, table)))
+    finally:
+        conn.autocommit = previous_autocommit
+    print(f"Indices, FKs y estadisticas de {schema} listos en {time.perf_counter() - start:.2f} s")
+
+
+def move_infra_tables(cursor, source_schema: str, target_schema: str) -> None:
+    # Índices, FKs, secuencias y estadísticas se mueven junto con cada tabla
+    for table in INFRA_TABLES:
+        cursor.execute(
+            sql.SQL("ALTER TABLE {} SET SCHEMA {}").format(
+                sql.Identifier(source_schema, table), sql.Identifier(target_schema)
+            )
+        )
 
-def edge_generator(json_path: Path):
-    """Yield edges without loading the full JSON into memory."""
-    with open(json_path, "rb") as file_handle:
-        for arista in ijson.items(file_handle, "aristas.item"):
-            coords = ", ".join(f"{lon} {lat}" for lon, lat in arista["geom"])
-            linestring_wkt = f"LINESTRING({coords})"
-            yield arista["source"], arista["target"], arista["costo_longitud_m"], linestring_wkt
+
+def lock_timeout(cursor) -> None:
+    # Si una consulta larga retiene las tablas, el intercambio falla en vez de bloquear a todos los lectores
+    cursor.execute("SET LOCAL lock_timeout = %s", (os.getenv("INFRA_SWAP_LOCK_TIMEOUT", "5s"),))
+
+
+def run_with_lock_retries(conn, swap: Callable[[Any], Optional[int]]) -> Optional[int]:
+    """
+    Ejecuta `swap` en una transacción corta con lock_timeout. Si una consulta larga retiene las
+    tablas, reintenta hasta INFRA_SWAP_RETRIES veces con espera creciente antes de rendirse, para
+    no perder unas tablas de staging ya cargadas e indexadas.
+    """
+    retries = max(1, int(os.getenv("INFRA_SWAP_RETRIES", "5")))
+    for attempt in range(1, retries + 1):
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    lock_timeout(cur)
+                    return swap(cur)
+        except errors.LockNotAvailable as exc:
+            if attempt == retries:
+                raise
+            wait = min(2 ** attempt, 30)
+            print(f"Las tablas vigentes siguen bloqueadas (intento {attempt}/{retries}): {str(exc).strip()}")
+            print(f"Reintentando el intercambio en {wait} s...")
+            time.sleep(wait)
+    return None
+
+
+def swap_staging_into_live(conn) -> Optional[int]:
+    """
+    Publica las tablas de staging en una transacción corta: las vigentes pasan a PREVIOUS_SCHEMA
+    y la versión del grafo se incrementa en la misma transacción.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            # La versión anterior a la anterior se descarta fuera de la transacción del intercambio
+            drop_infra_tables(cur, PREVIOUS_SCHEMA)
+
+    def swap(cur) -> Optional[int]:
+        if infra_tables_exist(cur, LIVE_SCHEMA):
+            move_infra_tables(cur, LIVE_SCHEMA, PREVIOUS_SCHEMA)
+        move_infra_tables(cur, STAGING_SCHEMA, LIVE_SCHEMA)
+        return bump_data_version(cur, "infraestructura")
+
+    start = time.perf_counter()
+    version = run_with_lock_retries(conn, swap)
+    print(f"Intercambio de tablas completado en {(time.perf_counter() - start) * 1000:.0f} ms")
+    return version
+
+
+def rollback_to_previous(conn) -> Optional[int]:
+    """
+    Intercambia las tablas vigentes con las de PREVIOUS_SCHEMA. Repetirlo rehace el cambio.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            if not infra_tables_exist(cur, PREVIOUS_SCHEMA):
+                raise RuntimeError(f"No hay una version anterior del grafo en el esquema {PREVIOUS_SCHEMA}.")
+            drop_infra_tables(cur, STAGING_SCHEMA)
+
+    def swap(cur) -> Optional[int]:
+        move_infra_tables(cur, LIVE_SCHEMA, STAGING_SCHEMA)
+        move_infra_tables(cur, PREVIOUS_SCHEMA, LIVE_SCHEMA)
+        move_infra_tables(cur, STAGING_SCHEMA, PREVIOUS_SCHEMA)
+        return bump_data_version(cur, "infraestructura")
+
+    return run_with_lock_retries(conn, swap)
+
+
+def artifact_has_explicit_ids(graph_path: Path) -> bool:
+    try:
+        with GraphArtifact(graph_path) as artifact:
+            return bool(artifact.header.flags & FLAG_EXPLICIT_IDS)
+    except GraphArtifactError:
+        return True
+
+
+def components_missing(cursor) -> bool:
+    """True si los nodos vigentes no tienen componente (carga anterior a su cálculo)."""
+    cursor.execute("SELECT componente IS NULL FROM nodos_carreteras LIMIT 1")
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def osm_ids_missing(cursor) -> bool:
+    """True si los nodos vigentes no tienen osm_id (carga anterior a la renumeración densa)."""
+    # Con ids de OSM en la base los ids densos del archivo no coincidirían: hay que recargar
+    cursor.execute("SELECT osm_id IS NULL FROM nodos_carreteras LIMIT 1")
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def refresh_component_labels(conn, data_path: Path) -> int:
+    """
+    Recalcula las componentes desde el archivo columnar y actualiza solo los nodos vigentes cuya
+    componente cambió. Returns la cantidad de nodos actualizados.
+    """
+    with ColumnarReader(data_path) as reader:
+        components = component_labels(reader)
+        node_ids = np.concatenate([block["id"] for block in reader.node_blocks()] or [np.empty(0, dtype="<i8")])
+    resumen = summarize(components)
+    print(f"{resumen['componentes']} componentes; la principal tiene {resumen['nodos_principal']} nodos.")
+
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE componentes_nuevas (id BIGINT, componente INTEGER) ON COMMIT DROP")
+            copy_binary(
+                cur, "pg_temp", "componentes_nuevas", ("id", "componente"), component_copy_blocks(node_ids, components)
+            )
+            lock_timeout(cur)
+            cur.execute(
+                """
+                UPDATE nodos_carreteras n
+                SET componente = c.componente
+                FROM componentes_nuevas c
+                WHERE n.id = c.id AND n.componente IS DISTINCT FROM c.componente
+                """
+            )
+            return cur.rowcount
+
+
+def ensure_graph_artifact(data_path: Path, positional_ids: bool = False) -> None:
+    """
+    Genera el artefacto binario del grafo junto al archivo columnar si falta o es más antiguo que este.
+    Los ids de arista coinciden con los asignados por la carga (orden de escritura). Tras una carga
+    completa (`positional_ids`) también se regenera el que dejó una actualización incremental con
+    los ids dispersos de la base.
+    """
+    graph_path = data_path.parent / GRAPH_ARTIFACT_FILENAME
+    if file_exists_and_not_empty(graph_path) and graph_path.stat().st_mtime >= data_path.stat().st_mtime:
+        if not (positional_ids and artifact_has_explicit_ids(graph_path)):
+            return
+
+    print(f"Generando artefacto binario del grafo en {graph_path}...")
+    with ColumnarReader(data_path) as reader:
+        resumen = write_graph_artifact(
+            reader, graph_path, directions=reader.edge_column("sentido")
+        )
+    print(f"Artefacto del grafo: {resumen['nodos']} nodos, {resumen['arcos']} arcos, {resumen['bytes']} bytes.")
 
 
 def table_has_rows(cursor, table_name: str) -> bool:
@@ -31,27 +468,40 @@ def table_has_rows(cursor, table_name: str) -> bool:
     return bool(cursor.fetchone()[0])
 
 
+def bump_data_version(cursor, capa: str) -> Optional[int]:
+    """Incrementa la versión de la capa para que la aplicación web invalide sus cachés."""
+    cursor.execute("SELECT to_regproc('incrementar_version_datos') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return None
+    cursor.execute("SELECT incrementar_version_datos(%s)", (capa,))
+    return cursor.fetchone()[0]
+
+
 def file_exists_and_not_empty(path: Path) -> bool:
     return path.exists() and path.stat().st_size > 0
 
 
-def ensure_infrastructure_json_exists(json_path: Path) -> bool:
+def ensure_infrastructure_file_exists(data_path: Path, outdated: bool = False) -> bool:
     """
-    Verifica que el archivo JSON de infraestructura exista.
-    Si no existe, intenta ejecutar extract_transform_infra.py para generarlo.
+    Verifica que el archivo columnar de infraestructura exista.
+    Si no existe o está desactualizado (otra región u otra versión de formato), ejecuta
+    extract_transform_infra.py para generarlo.
     
     Returns:
         True si el archivo existe o se generó exitosamente
         False si hubo un error
     """
-    if file_exists_and_not_empty(json_path):
-        print(f"Archivo de infraestructura encontrado: {json_path}")
+    if file_exists_and_not_empty(data_path) and not outdated:
+        print(f"Archivo de infraestructura encontrado: {data_path}")
         return True
     
-    print(f"No se encontró '{json_path}'.")
+    if outdated:
+        print(f"'{data_path}' está desactualizado.")
+    else:
+        print(f"No se encontró '{data_path}'.")
     print("Intentando generar el archivo ejecutando 'extract_transform_infra.py'...")
     
-    extract_script = json_path.parent / "extract_transform_infra.py"
+    extract_script = data_path.parent / "extract_transform_infra.py"
     
     if not extract_script.exists():
         print(f"ERROR: No se encontró el script de extracción: {extract_script}")
@@ -70,8 +520,8 @@ def ensure_infrastructure_json_exists(json_path: Path) -> bool:
         print(result.stdout)
         
         # Verificar que se haya generado el archivo
-        if file_exists_and_not_empty(json_path):
-            print(f"Archivo de infraestructura generado exitosamente: {json_path}")
+        if file_exists_and_not_empty(data_path):
+            print(f"Archivo de infraestructura generado exitosamente: {data_path}")
             return True
         else:
             print(f"ERROR: El script se ejecutó pero no generó el archivo esperado.")
@@ -86,9 +536,10 @@ def ensure_infrastructure_json_exists(json_path: Path) -> bool:
         return False
 
 
-def load_infrastructure_to_db(json_path: Path) -> bool:
+def load_infrastructure_to_db(data_path: Path) -> bool:
     """
-    Load road infrastructure from the JSON file using batched inserts.
+    Load road infrastructure from the columnar file into staging tables using binary COPY,
+    build their indexes there and swap them into the live schema in a short transaction.
     Returns True when the load completes or is skipped because data already exists.
     Returns False if an error occurs or the input file is missing.
     """
@@ -98,18 +549,22 @@ def load_infrastructure_to_db(json_path: Path) -> bool:
         os.getenv(var, "").lower() in {"1", "true", "yes"} for var in ("FORCE_REFRESH_INFRA", "FORCE_REFRESH")
     )
 
-    json_path = Path(json_path)
+    data_path = Path(data_path)
+    start = time.perf_counter()
+
+    # La región se pasa al extractor por el entorno (INFRA_REGION / INFRA_BBOX / INFRA_POLYGON)
+    try:
+        region_changed = not region_matches(data_path, resolve_region())
+    except (OSError, ValueError) as exc:
+        print(f"Región inválida: {exc}")
+        return False
+    format_changed = file_exists_and_not_empty(data_path) and not is_current_format(data_path)
+    outdated = region_changed or format_changed
 
     # Conectar a la base de datos
     conn = None
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST", "localhost"),
-            port=os.getenv("DB_PORT", "5432"),
-        )
+        conn = connect_db()
     except psycopg2.Error as exc:
         print(f"Error al conectar con la base de datos: {exc}")
         return False
@@ -119,46 +574,106 @@ def load_infrastructure_to_db(json_path: Path) -> bool:
             with conn.cursor() as cur:
                 nodos_presentes = table_has_rows(cur, "nodos_carreteras")
                 aristas_presentes = table_has_rows(cur, "aristas_carreteras")
+                migrate_infra_schema(cur)
+                repair_pending = missing_indexes_or_constraints(cur, LIVE_SCHEMA)
+                labels_pending = components_missing(cur)
+                numbering_changed = osm_ids_missing(cur)
 
-                # Si ya hay datos y no se fuerza refresh, saltar
-                if nodos_presentes and aristas_presentes and not force_refresh:
-                    print(
-                        "Las tablas nodos_carreteras y aristas_carreteras ya contienen datos. "
-                        "Se omite la carga (usa FORCE_REFRESH_INFRA=1 para forzar)."
-                    )
-                    return True
+        # Si ya hay datos y no se fuerza refresh, saltar
+        if nodos_presentes and aristas_presentes and not force_refresh and not outdated and not numbering_changed:
+            print(
+                "Las tablas nodos_carreteras y aristas_carreteras ya contienen datos. "
+                "Se omite la carga (usa FORCE_REFRESH_INFRA=1 para forzar)."
+            )
+            if repair_pending:
+                print("Faltan indices o FKs de una carga interrumpida; reconstruyendo...")
+                rebuild_indexes_and_constraints(conn, LIVE_SCHEMA)
+            if file_exists_and_not_empty(data_path):
+                ensure_graph_artifact(data_path)
+                if labels_pending:
+                    print("Los nodos no tienen componente conexa; calculándola...")
+                    print(f"{refresh_component_labels(conn, data_path)} nodos actualizados.")
+            return True
+
+        # Verificar/generar el archivo columnar si es necesario
+        if region_changed:
+            print("La región configurada cambió; se extraerá y cargará nuevamente la red vial.")
+        elif format_changed:
+            print("El archivo de infraestructura usa un formato anterior; se extraerá y cargará nuevamente.")
+        elif numbering_changed:
+            print("Los nodos cargados usan ids de OSM; se cargarán nuevamente con ids densos.")
+        if not ensure_infrastructure_file_exists(data_path, outdated):
+            print(
+                f"No se pudo obtener el archivo de infraestructura. "
+                "Verifica que extract_transform_infra.py esté disponible y funcione correctamente."
+            )
+            return False
 
-                # Verificar/generar el archivo JSON si es necesario
-                if not ensure_infrastructure_json_exists(json_path):
+        # La carga va a tablas de staging; las vigentes siguen atendiendo consultas hasta el intercambio
+        with conn:
+            with conn.cursor() as cur:
+                print(f"Preparando tablas de staging en el esquema {STAGING_SCHEMA}...")
+                prepare_staging_tables(cur)
+
+                with ColumnarReader(data_path) as reader:
+                    print("Calculando componentes conexas de la red...")
+                    components = component_labels(reader)
+                    resumen = summarize(components)
                     print(
-                        f"No se pudo obtener el archivo de infraestructura. "
-                        "Verifica que extract_transform_infra.py esté disponible y funcione correctamente."
+                        f"{resumen['componentes']} componentes; la principal tiene {resumen['nodos_principal']} "
+                        f"nodos ({resumen['fraccion_principal']:.1%})."
+                    )
+                    print("Copiando nodos (COPY binario)...")
+                    total_rows = copy_binary(
+                        cur,
+                        STAGING_SCHEMA,
+                        "nodos_carreteras",
+                        ("id", "osm_id", "geom", "componente"),
+                        node_copy_blocks(reader, components),
                     )
-                    return False
+                    print("Copiando aristas (COPY binario)...")
+                    total_rows += copy_binary(
+                        cur,
+                        STAGING_SCHEMA,
+                        "aristas_carreteras",
+                        (
+                            "id",
+                            "source",
+                            "target",
+                            "costo_longitud_m",
+                            "geom",
+                            "osm_way_id",
+                            "clase_via",
+                            "sentido",
+                            "velocidad_max",
+                            "peaje",
+                        ),
+                        edge_copy_blocks(reader),
+                    )
+                # Los ids se enviaron explícitos; la secuencia continúa tras el último
+                cur.execute(
+                    sql.SQL(
+                        "SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {}"
+                    ).format(sql.Identifier(STAGING_SCHEMA, "aristas_carreteras")),
+                    (f"{STAGING_SCHEMA}.aristas_carreteras",),
+                )
 
-                print("Vaciando tablas de infraestructura (nodos_carreteras, aristas_carreteras)...")
-                cur.execute("TRUNCATE TABLE nodos_carreteras, aristas_carreteras RESTART IDENTITY CASCADE;")
+        load_elapsed = time.perf_counter() - start
+        print(f"COPY completado: {total_rows} filas en {load_elapsed:.2f} s ({total_rows / load_elapsed:,.0f} filas/s)")
 
-                print("Insertando nodos (esto puede tardar varios minutos)...")
-                execute_batch(
-                    cur,
-                    "INSERT INTO nodos_carreteras (id, geom) VALUES (%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326));",
-                    node_generator(json_path),
-                    page_size=5000,
-                )
+        # CLUSTER reescribe la tabla: conviene hacerlo antes de construir el resto de los índices
+        cluster_infra_tables(conn, STAGING_SCHEMA)
+        rebuild_indexes_and_constraints(conn, STAGING_SCHEMA)
 
-                print("Insertando aristas (esto puede tardar varios minutos)...")
-                execute_batch(
-                    cur,
-                    (
-                        "INSERT INTO aristas_carreteras (source, target, costo_longitud_m, geom) "
-                        "VALUES (%s, %s, %s, ST_GeomFromText(%s, 4326));"
-                    ),
-                    edge_generator(json_path),
-                    page_size=5000,
-                )
+        # El intercambio publica el grafo ya indexado; la versión anterior queda para rollback
+        version = swap_staging_into_live(conn)
+        print(f"Grafo publicado como version {version}; la anterior queda en el esquema {PREVIOUS_SCHEMA}.")
 
-        print("Carga de datos de infraestructura completada con exito.")
+        print(f"Carga de datos de infraestructura completada con exito en {time.perf_counter() - start:.2f} s.")
+        try:
+            ensure_graph_artifact(data_path, positional_ids=True)
+        except OSError as exc:
+            print(f"Advertencia: no se pudo generar el artefacto del grafo: {exc}")
         return True
     except (Exception, psycopg2.Error) as exc:
         print(f"Error durante la carga de infraestructura: {exc}")
@@ -169,7 +684,39 @@ def load_infrastructure_to_db(json_path: Path) -> bool:
             print("Conexion a la base de datos cerrada.")
 
 
+def rollback_infrastructure() -> bool:
+    """Vuelve a publicar la versión anterior del grafo conservada en PREVIOUS_SCHEMA."""
+    load_dotenv()
+    try:
+        conn = connect_db()
+    except psycopg2.Error as exc:
+        print(f"Error al conectar con la base de datos: {exc}")
+        return False
+
+    try:
+        version = rollback_to_previous(conn)
+        print(f"Grafo anterior restaurado como version {version}.")
+        print(f"Advertencia: {GRAPH_ARTIFACT_FILENAME} sigue correspondiendo al archivo columnar actual.")
+        return True
+    except (Exception, psycopg2.Error) as exc:
+        print(f"Error al restaurar la version anterior del grafo: {exc}")
+        return False
+    finally:
+        conn.close()
+
+
 if __name__ == "__main__":
-    json_file_path = Path(__file__).resolve().parent / "infraestructura.json"
-    success = load_infrastructure_to_db(json_file_path)
-    sys.exit(0 if success else 1)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Carga la red vial en PostgreSQL/PostGIS.")
+    parser.add_argument(
+        "--rollback",
+        action="store_true",
+        help=f"intercambia el grafo vigente con la version anterior ({PREVIOUS_SCHEMA})",
+    )
+    args = parser.parse_args()
+
+    if args.rollback:
+        success = rollback_infrastructure()
+    else:
+        data_file_path = Path(__file__).resolve().parent / INFRA_DATA_FILENAME
+        success = load_infrastructure_to_db(data_file_path)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,147 @@
+"""
+Regiones de recorte para extraer solo parte de la red vial.
+
+Una región es un bbox o un polígono (GeoJSON Polygon/MultiPolygon). El extractor conserva
+completa toda vía con al menos un nodo dentro, de modo que las vías que cruzan el borde
+mantienen conectado el grafo regional. Junto al archivo columnar se guarda la descripción de
+la región con que se extrajo (`<archivo>.region`) para detectar cuándo hay que volver a extraer.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+COUNTRY_DESCRIPTION = "chile"
+
+BBox = Tuple[float, float, float, float]
+Ring = Tuple[Tuple[float, float], ...]
+
+# (min_lon, min_lat, max_lon, max_lat) aproximados
+REGIONES = {
+    "metropolitana": (-71.72, -34.30, -69.76, -32.92),
+    "valparaiso": (-72.00, -33.97, -69.98, -32.02),
+    "biobio": (-73.80, -38.50, -71.00, -36.95),
+    "zona_norte": (-71.70, -29.50, -67.00, -17.40),
+    "zona_centro": (-72.20, -36.50, -69.70, -29.50),
+    "zona_sur": (-74.50, -44.00, -70.80, -36.50),
+    "zona_austral": (-76.00, -56.00, -66.40, -44.00),
+}
+
+
+@dataclass(frozen=True)
+class Region:
+    name: str
+    bbox: BBox
+    # Anillos de todos los polígonos (exteriores y huecos); vacío si la región es solo el bbox
+    rings: Tuple[Ring, ...] = ()
+
+    def contains(self, lon: float, lat: float) -> bool:
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+            return False
+        if not self.rings:
+            return True
+        # Regla par-impar sobre todos los anillos: los huecos quedan fuera
+        inside = False
+        for ring in self.rings:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+        return inside
+
+    def describe(self) -> str:
+        description = f"{self.name} bbox={','.join(f'{value:.5f}' for value in self.bbox)} anillos={len(self.rings)}"
+        if self.rings:
+            # Editar vértices sin cambiar el bbox ni la cantidad de anillos también invalida la extracción
+            digest = hashlib.blake2b(json.dumps(self.rings).encode("utf-8"), digest_size=8).hexdigest()
+            description += f" vertices={digest}"
+        return description
+
+
+def parse_bbox(raw: str) -> BBox:
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in raw.split(","))
+    except ValueError:
+        raise ValueError("El bbox debe tener el formato min_lon,min_lat,max_lon,max_lat") from None
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise ValueError("El bbox debe cumplir min_lon < max_lon y min_lat < max_lat")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _polygons(geometry: dict) -> Sequence[Sequence[Sequence[Sequence[float]]]]:
+    if geometry.get("type") == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry.get("type") == "MultiPolygon":
+        return geometry["coordinates"]
+    raise ValueError(f"Geometría no soportada para el recorte: {geometry.get('type')}")
+
+
+def load_polygon(path: Path) -> Region:
+    """Lee un Polygon/MultiPolygon GeoJSON (geometría, Feature o FeatureCollection)."""
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    if data.get("type") == "FeatureCollection":
+        geometries = [feature["geometry"] for feature in data["features"]]
+    elif data.get("type") == "Feature":
+        geometries = [data["geometry"]]
+    else:
+        geometries = [data]
+
+    rings = tuple(
+        tuple((float(lon), float(lat)) for lon, lat, *_ in ring)
+        for geometry in geometries
+        for polygon in _polygons(geometry)
+        for ring in polygon
+    )
+    if not rings:
+        raise ValueError(f"{path}: el polígono no tiene coordenadas")
+    lons = [lon for ring in rings for lon, _ in ring]
+    lats = [lat for ring in rings for _, lat in ring]
+    return Region(Path(path).stem, (min(lons), min(lats), max(lons), max(lats)), rings)
+
+
+def resolve_region(
+    region: Optional[str] = None, bbox: Optional[str] = None, polygon: Optional[str] = None
+) -> Optional[Region]:
+    """
+    Región pedida por argumentos o, si no se pasa ninguno, por INFRA_REGION / INFRA_BBOX / INFRA_POLYGON.
+    Devuelve None para procesar todo el país.
+    """
+    if not (region or bbox or polygon):
+        region, bbox, polygon = (os.getenv(var) for var in ("INFRA_REGION", "INFRA_BBOX", "INFRA_POLYGON"))
+    if sum(value is not None and value != "" for value in (region, bbox, polygon)) > 1:
+        raise ValueError("Usa solo una de las opciones de región, bbox o polígono")
+
+    if polygon:
+        return load_polygon(Path(polygon))
+    if bbox:
+        return Region("bbox", parse_bbox(bbox))
+    if region:
+        key = region.strip().lower()
+        if key not in REGIONES:
+            raise ValueError(f"Región desconocida '{region}'. Opciones: {', '.join(sorted(REGIONES))}")
+        return Region(key, REGIONES[key])
+    return None
+
+
+def describe_region(region: Optional[Region]) -> str:
+    return region.describe() if region is not None else COUNTRY_DESCRIPTION
+
+
+def region_marker_path(data_path: Path) -> Path:
+    return data_path.with_name(data_path.name + ".region")
+
+
+def write_region_marker(data_path: Path, region: Optional[Region]) -> None:
+    region_marker_path(data_path).write_text(describe_region(region) + "\n", encoding="utf-8")
+
+
+def region_matches(data_path: Path, region: Optional[Region]) -> bool:
+    """True si `data_path` se extrajo con la misma región (sin marcador se asume todo el país)."""
+    try:
+        extracted = region_marker_path(data_path).read_text(encoding="utf-8").strip()
+    except OSError:
+        extracted = COUNTRY_DESCRIPTION
+    return extracted == describe_region(region)
@@ -0,0 +1,179 @@
+"""
+Descarga reanudable y condicional de archivos grandes (el PBF de Geofabrik).
+
+- Escribe en `<destino>.part` y, si la descarga se corta, la retoma con `Range` (validada con
+  `If-Range` para no mezclar dos versiones del archivo).
+- Guarda ETag y Last-Modified en `<destino>.meta.json` y los envía como `If-None-Match` /
+  `If-Modified-Since`: si el servidor responde 304 el archivo local sigue vigente.
+- Verifica el MD5 contra el `.md5` publicado junto al archivo antes de reemplazar el destino.
+
+Solo depende de `requests` y de la URL recibida, de modo que puede probarse contra un servidor
+HTTP local.
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import requests
+from tqdm import tqdm
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+WRITE_BUFFER_SIZE = 8 << 20
+HASH_READ_SIZE = 8 << 20
+
+
+class DownloadError(Exception):
+    """La descarga no pudo completarse o el archivo no pasó la verificación."""
+
+
+def _meta_path(destination: Path) -> Path:
+    return destination.with_name(destination.name + ".meta.json")
+
+
+def _part_path(destination: Path) -> Path:
+    return destination.with_name(destination.name + ".part")
+
+
+def _read_meta(path: Path) -> Dict[str, str]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _validators(response: requests.Response) -> Dict[str, str]:
+    headers = (("etag", "ETag"), ("last_modified", "Last-Modified"))
+    return {key: response.headers[header] for key, header in headers if header in response.headers}
+
+
+def _hash_file(path: Path, digest) -> None:
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(HASH_READ_SIZE), b""):
+            digest.update(chunk)
+
+
+def fetch_published_md5(session: requests.Session, md5_url: str, timeout: float) -> Optional[str]:
+    """MD5 publicado (formato `md5sum`: "<hash>  <archivo>"), o None si no está disponible."""
+    try:
+        response = session.get(md5_url, timeout=timeout)
+        response.raise_for_status()
+    except requests.RequestException as exc:
+        print(f"Advertencia: no se pudo obtener el MD5 publicado ({md5_url}): {exc}")
+        return None
+    fields = response.text.split()
+    return fields[0].lower() if fields else None
+
+
+def _download_attempt(
+    session: requests.Session,
+    url: str,
+    destination: Path,
+    validators: Dict[str, str],
+    chunk_size: int,
+    timeout: float,
+) -> Optional[Dict[str, str]]:
+    """
+    Un intento de descarga hacia el `.part`. Devuelve los validadores de la versión descargada,
+    o None si el servidor indicó que el destino no cambió (304).
+    """
+    part_path = _part_path(destination)
+    part_meta_path = _meta_path(part_path)
+    headers = {}
+    if destination.exists() and destination.stat().st_size > 0 and not part_path.exists():
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    part_validators = _read_meta(part_meta_path)
+    if offset and (part_validators.get("etag") or part_validators.get("last_modified")):
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = part_validators.get("etag") or part_validators["last_modified"]
+    else:
+        offset = 0
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return None
+        if response.status_code == 416 and offset:
+            # El .part ya está completo
+            return part_validators
+        response.raise_for_status()
+
+        if response.status_code == 206:
+            mode = "ab"
+            total = offset + int(response.headers.get("Content-Length", 0))
+            print(f"Reanudando descarga desde {offset / 2**20:.1f} MB.")
+        else:
+            # 200: el servidor ignoró el Range o el archivo cambió; se empieza de cero
+            mode, offset = "wb", 0
+            total = int(response.headers.get("Content-Length", 0))
+
+        new_validators = _validators(response)
+        part_meta_path.write_text(json.dumps(new_validators), encoding="utf-8")
+        with open(part_path, mode, buffering=WRITE_BUFFER_SIZE) as handle, tqdm(
+            total=total or None, initial=offset, unit="iB", unit_scale=True, desc=destination.name
+        ) as progress_bar:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                handle.write(chunk)
+                progress_bar.update(len(chunk))
+
+        if total and part_path.stat().st_size != total:
+            raise DownloadError(f"Descarga incompleta: {part_path.stat().st_size} de {total} bytes")
+        return new_validators
+
+
+def download_file_with_progress(
+    url: str,
+    destination: Path,
+    md5_url: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+    retries: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    timeout: float = 30,
+) -> bool:
+    """
+    Descarga `url` en `destination` si cambió desde la última vez. Returns True si el destino
+    quedó vigente (descargado o sin cambios) y False si falló tras agotar los reintentos.
+    """
+    destination = Path(destination)
+    md5_url = md5_url if md5_url is not None else url + ".md5"
+    retries = retries if retries is not None else int(os.getenv("INFRA_DOWNLOAD_RETRIES", "3"))
+    chunk_size = chunk_size or int(float(os.getenv("INFRA_DOWNLOAD_CHUNK_MB", "1")) * DEFAULT_CHUNK_SIZE)
+    session = session or requests.Session()
+    part_path = _part_path(destination)
+    validators = _read_meta(_meta_path(destination))
+
+    print(f"Descargando archivo desde {url}...")
+    for attempt in range(1, retries + 1):
+        try:
+            new_validators = _download_attempt(session, url, destination, validators, chunk_size, timeout)
+            if new_validators is None:
+                print(f"'{destination}' no cambio en el servidor; se conserva la copia local.")
+                return True
+
+            expected_md5 = fetch_published_md5(session, md5_url, timeout) if md5_url else None
+            if expected_md5:
+                digest = hashlib.md5()
+                _hash_file(part_path, digest)
+                if digest.hexdigest() != expected_md5:
+                    part_path.unlink(missing_ok=True)
+                    _meta_path(part_path).unlink(missing_ok=True)
+                    raise DownloadError(f"MD5 no coincide (esperado {expected_md5}, obtenido {digest.hexdigest()})")
+                print("MD5 verificado.")
+
+            os.replace(part_path, destination)
+            _meta_path(destination).write_text(json.dumps(new_validators), encoding="utf-8")
+            _meta_path(part_path).unlink(missing_ok=True)
+            print(f"Archivo descargado exitosamente en '{destination}'.")
+            return True
+        except (requests.RequestException, DownloadError, OSError) as exc:
+            print(f"Error al descargar el archivo (intento {attempt}/{retries}): {exc}")
+            if attempt < retries:
+                time.sleep(min(2 ** attempt, 30))
+    return False
@@ -0,0 +1,90 @@
+"""
+Atributos de las vías OSM que se conservan en cada arista, codificados como enteros pequeños.
+
+- clase_via: código de HIGHWAY_CLASSES (1 = motorway ... 15 = road).
+- sentido: 0 doble sentido, 1 solo en el sentido de la geometría (source -> target), -1 solo el inverso.
+- velocidad_max: km/h según `maxspeed` (0 = sin dato).
+- peaje: True si la vía tiene `toll=yes`.
+
+La tabla `clases_via` replica HIGHWAY_CLASSES en la base; el ruteo jerárquico usa su columna
+`troncal` para decidir qué aristas relaja lejos del origen y el destino.
+"""
+
+from typing import Dict, Tuple
+
+HIGHWAY_CLASSES = (
+    "motorway",
+    "trunk",
+    "primary",
+    "secondary",
+    "tertiary",
+    "unclassified",
+    "residential",
+    "motorway_link",
+    "trunk_link",
+    "primary_link",
+    "secondary_link",
+    "tertiary_link",
+    "living_street",
+    "service",
+    "road",
+)
+HIGHWAY_CLASS_CODES: Dict[str, int] = {name: code for code, name in enumerate(HIGHWAY_CLASSES, start=1)}
+
+# Clases que el ruteo jerárquico sigue relajando lejos de los extremos (con sus enlaces)
+TRUNK_CLASSES = frozenset(
+    {"motorway", "trunk", "primary", "motorway_link", "trunk_link", "primary_link"}
+)
+
+ONEWAY_FORWARD = 1
+ONEWAY_REVERSE = -1
+BIDIRECTIONAL = 0
+
+MPH_TO_KMH = 1.609344
+# Límites implícitos (`maxspeed=CL:urban`, etc.) según la Ley de Tránsito
+IMPLICIT_MAXSPEEDS = {"urban": 50, "rural": 100, "motorway": 120, "living_street": 20}
+
+# (clase_via, sentido, velocidad_max, peaje)
+RoadAttributes = Tuple[int, int, int, bool]
+
+
+def oneway_direction(tags) -> int:
+    value = tags.get("oneway", "")
+    if value in {"yes", "true", "1"}:
+        return ONEWAY_FORWARD
+    if value in {"-1", "reverse"}:
+        return ONEWAY_REVERSE
+    if value == "no":
+        return BIDIRECTIONAL
+    # Sentido único implícito en OSM
+    if tags.get("highway") == "motorway" or tags.get("junction") in {"roundabout", "circular"}:
+        return ONEWAY_FORWARD
+    return BIDIRECTIONAL
+
+
+def parse_maxspeed(value: str) -> int:
+    """km/h de una etiqueta `maxspeed`; 0 si falta o no se reconoce."""
+    if not value:
+        return 0
+    value = value.strip().lower()
+    if ":" in value:
+        return IMPLICIT_MAXSPEEDS.get(value.split(":", 1)[1], 0)
+    factor = 1.0
+    if value.endswith("mph"):
+        factor, value = MPH_TO_KMH, value[:-3].strip()
+    elif value.endswith("km/h"):
+        value = value[:-4].strip()
+    try:
+        speed = round(float(value.split(";")[0]) * factor)
+    except ValueError:
+        return 0
+    return speed if 0 < speed < 32767 else 0
+
+
+def road_attributes(tags) -> RoadAttributes:
+    return (
+        HIGHWAY_CLASS_CODES.get(tags.get("highway"), 0),
+        oneway_direction(tags),
+        parse_maxspeed(tags.get("maxspeed", "")),
+        tags.get("toll") == "yes",
+    )
@@ -0,0 +1,81 @@
+"""
+Renumeración densa y espacialmente ordenada de los nodos de la red vial.
+
+Los ids de OSM son enteros de 64 bits dispersos y su orden no guarda relación con la posición.
+Tras la extracción, `spatially_reorder` asigna a cada nodo un id denso 1..n siguiendo la curva de
+Hilbert sobre sus coordenadas, reescribe los extremos de las aristas con esos ids y conserva el id
+original en la columna `osm_id`. Nodos cercanos quedan con ids cercanos, de modo que los arreglos
+indexados por id, las páginas de nodos_carreteras y (tras CLUSTER) las de aristas_carreteras
+agrupan la misma zona.
+"""
+
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+from columnar_format import DEFAULT_BLOCK_ROWS, ColumnarReader, ColumnarWriter
+
+# Celdas por lado de la grilla de la curva (2**16 => ~60 m por celda sobre el largo de Chile)
+HILBERT_ORDER = 16
+
+
+def hilbert_keys(lon: np.ndarray, lat: np.ndarray, order: int = HILBERT_ORDER) -> np.ndarray:
+    """Posición de cada punto sobre la curva de Hilbert de una grilla cuadrada de 2**order celdas por lado."""
+
+    side = 1 << order
+    if not len(lon):
+        return np.empty(0, dtype=np.int64)
+    # La misma escala en ambos ejes para que la curva no deforme distancias
+    min_lon, min_lat = lon.min(), lat.min()
+    extent = max(lon.max() - min_lon, lat.max() - min_lat) or 1.0
+    scale = (side - 1) / extent
+    x = ((lon - min_lon) * scale).astype(np.int64)
+    y = ((lat - min_lat) * scale).astype(np.int64)
+
+    keys = np.zeros(len(x), dtype=np.int64)
+    s = side >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+        # Rotación del cuadrante para que la curva sea continua
+        flip = ~ry & rx
+        x = np.where(flip, s - 1 - x, x)
+        y = np.where(flip, s - 1 - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+    return keys
+
+
+def spatially_reorder(input_path: Path, output_path: Path, block_rows: int = DEFAULT_BLOCK_ROWS) -> Dict[str, int]:
+    """
+    Reescribe un archivo columnar con ids de nodo densos en orden de Hilbert. Las aristas conservan
+    su orden (y por lo tanto sus ids); solo se traducen sus extremos, bloque a bloque.
+    """
+
+    with ColumnarReader(input_path) as reader:
+        osm_ids = np.concatenate([block["osm_id"] for block in reader.node_blocks()] or [np.empty(0, dtype="<i8")])
+        lon = np.concatenate([block["lon"] for block in reader.node_blocks()] or [np.empty(0, dtype="<f8")])
+        lat = np.concatenate([block["lat"] for block in reader.node_blocks()] or [np.empty(0, dtype="<f8")])
+
+        order = np.argsort(hilbert_keys(lon, lat), kind="stable")
+        dense = np.empty(len(order), dtype=np.int64)
+        dense[order] = np.arange(1, len(order) + 1, dtype=np.int64)
+
+        with ColumnarWriter(output_path, block_rows=block_rows, with_nodes=False) as writer:
+            for block in reader.edge_blocks():
+                columns = dict(block)
+                columns["source"] = dense[np.searchsorted(osm_ids, block["source"])]
+                columns["target"] = dense[np.searchsorted(osm_ids, block["target"])]
+                writer.write_edges(columns)
+            # Las vistas del último bloque deben soltarse antes de cerrar el mmap
+            block = columns = None
+
+            for start in range(0, len(order), block_rows):
+                chunk = order[start : start + block_rows]
+                writer.write_nodes(
+                    {"id": dense[chunk], "osm_id": osm_ids[chunk], "lon": lon[chunk], "lat": lat[chunk]}
+                )
+    return {"aristas": writer.num_edges, "nodos": writer.num_nodes, "bytes": writer.path.stat().st_size}
@@ -1,16 +1,54 @@
 from __future__ import annotations
 
+import json
 import logging
 import os
 import subprocess
 import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, List, Sequence, Set
+from typing import Dict, Iterable, List, Optional, Sequence, Set
 
 from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent
+# Se carga antes de definir TASKS para que los TTL puedan configurarse desde .env
+load_dotenv()
+WEB_SERVER_MODES = {"dev", "prefork"}
+STARTUP_MODES = {"blocking", "fast"}
+SCRAPER_TIMEOUT_S = float(os.getenv("SCRAPER_TIMEOUT_S", "300"))
+FRESHNESS_STATE_PATH = Path(os.getenv("FRESHNESS_STATE_PATH", BASE_DIR / ".estado_fuentes.json"))
+
+
+def web_server_mode() -> str:
+    """Modo de servidor web: `dev` (Flask integrado) o `prefork` (gunicorn con estado precargado)."""
+    mode = os.getenv("WEB_SERVER_MODE", "dev").strip().lower()
+    if mode not in WEB_SERVER_MODES:
+        logging.getLogger("bootstrap").warning("WEB_SERVER_MODE=%s no reconocido; se usa dev.", mode)
+        return "dev"
+    return mode
+
+
+def startup_mode() -> str:
+    """`blocking` refresca los datos antes de levantar la web; `fast` la levanta primero."""
+    mode = os.getenv("STARTUP_MODE", "blocking").strip().lower()
+    if mode not in STARTUP_MODES:
+        logging.getLogger("bootstrap").warning("STARTUP_MODE=%s no reconocido; se usa blocking.", mode)
+        return "blocking"
+    return mode
+
+
+def task_parallelism() -> int:
+    return max(1, int(os.getenv("TASK_PARALLELISM", "4")))
+
+
+def force_refresh() -> bool:
+    return any(os.getenv(var, "").lower() in {"1", "true", "yes"} for var in ("FORCE_REFRESH", "FORCE_REFRESH_AMENAZAS"))
 
 
 def configure_logging() -> None:
@@ -30,46 +68,46 @@ class ScriptTask:
     args: Sequence[str] = field(default_factory=tuple)
     optional: bool = False
     long_running: bool = False
+    prefork_script: Optional[Path] = None
+    # Claves (`key`) de las tareas que deben terminar antes de iniciar esta
+    depends_on: Sequence[str] = field(default_factory=tuple)
+    timeout_s: Optional[float] = None
+    # Frescura: se omite si la última ejecución exitosa tiene menos de `ttl_s` segundos y es
+    # posterior a la de todas sus dependencias.
+    ttl_s: Optional[float] = None
+
+    @property
+    def key(self) -> str:
+        return self.script.stem
+
+    def resolved_script(self) -> Path:
+        """Script efectivo: `prefork_script` si existe y WEB_SERVER_MODE=prefork."""
+        if self.prefork_script is not None and web_server_mode() == "prefork":
+            return self.prefork_script
+        return self.script
 
     def command(self) -> List[str]:
         """Construye el comando a ejecutar para el script."""
-        if self.script.suffix == ".py":
-            return [sys.executable, str(self.script)]
-        return [str(self.script)]
+        script = self.resolved_script()
+        if script.suffix == ".py":
+            return [sys.executable, str(script)]
+        return [str(script)]
 
 
-# ORDEN CORRECTO DE EJECUCIÓN:
-# 1. AMENAZAS (metadata) - Se ejecutan siempre para actualizar datos
-# 2. INFRAESTRUCTURA - Se ejecuta solo si no existen los datos
+# DEPENDENCIAS DE EJECUCIÓN:
+# 1. AMENAZAS (metadata) - Descarga concurrente y carga directa a BD en un solo proceso
+# 2. INFRAESTRUCTURA - Independiente de amenazas; se carga solo si no existen los datos
 # 3. APLICACIÓN WEB - Se ejecuta al final
 TASKS: Sequence[ScriptTask] = (
     # ==== FASE 1: AMENAZAS (METADATA) ====
+    # Descarga todas las fuentes en paralelo y las carga directo a la BD; cada fuente
+    # tiene su propio TTL (SISMOS_TTL_S, ...) y las vigentes se omiten
     ScriptTask(
-        name="Amenazas - Sismos",
-        script=BASE_DIR / "Amenazas" / "3a_sismos.py",
-        working_dir=BASE_DIR / "Amenazas",
-    ),
-    ScriptTask(
-        name="Amenazas - Inundaciones",
-        script=BASE_DIR / "Amenazas" / "3b_inundaciones.py",
-        working_dir=BASE_DIR / "Amenazas",
-    ),
-    ScriptTask(
-        name="Amenazas - Incendios",
-        script=BASE_DIR / "Amenazas" / "3c_incendios.py",
-        working_dir=BASE_DIR / "Amenazas",
-    ),
-    ScriptTask(
-        name="Amenazas - Trafico",
-        script=BASE_DIR / "Amenazas" / "3d_trafico.py",
-        working_dir=BASE_DIR / "Amenazas",
-        optional=True,  # puede requerir API key de Google Maps
-    ),
-    ScriptTask(
-        name="Carga amenazas a BD",
-        script=BASE_DIR / "Amenazas" / "load_amenazas_to_db.py",
+        name="Amenazas - Descarga y carga",
+        script=BASE_DIR / "Amenazas" / "actualizar_amenazas.py",
         working_dir=BASE_DIR / "Amenazas",
-        optional=True,  # puede fallar si no se generaron datos nuevos
+        optional=True,  # una fuente caída no debe impedir levantar la web
+        timeout_s=SCRAPER_TIMEOUT_S,
     ),
     # ==== FASE 2: INFRAESTRUCTURA ====
     ScriptTask(
@@ -77,12 +115,21 @@ TASKS: Sequence[ScriptTask] = (
         script=BASE_DIR / "infraestructura" / "load_infra_to_db.py",
         working_dir=BASE_DIR / "infraestructura",
     ),
+    # Aplica los .osc pendientes de INFRA_CAMBIOS_DIR sobre la red ya cargada (no hace nada si no hay)
+    ScriptTask(
+        name="Infraestructura - cambios OSM",
+        script=BASE_DIR / "infraestructura" / "apply_infra_changes.py",
+        working_dir=BASE_DIR / "infraestructura",
+        optional=True,
+        depends_on=("load_infra_to_db",),
+    ),
     # ==== FASE 3: APLICACIÓN WEB ====
     ScriptTask(
         name="Aplicacion web",
         script=BASE_DIR / "Sitio_web" / "app.py",
         working_dir=BASE_DIR,
         long_running=True,
+        prefork_script=BASE_DIR / "Sitio_web" / "serve.py",
     ),
 )
 
@@ -97,33 +144,288 @@ def should_skip(task: ScriptTask, skip_tokens: Set[str]) -> bool:
     return bool(skip_tokens & identifiers)
 
 
-def execute_task(task: ScriptTask) -> None:
+def load_freshness_state() -> Dict[str, Dict[str, float]]:
+    try:
+        return json.loads(FRESHNESS_STATE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+_freshness_lock = threading.Lock()
+
+
+def record_success(task: ScriptTask, duration_s: float) -> None:
+    """Guarda el marcador de frescura de la tarea (última ejecución exitosa y TTL)."""
+    with _freshness_lock:
+        state = load_freshness_state()
+        state[task.key] = {
+            "last_success": time.time(),
+            "ttl_s": task.ttl_s if task.ttl_s is not None and task.ttl_s != float("inf") else None,
+            "duration_s": round(duration_s, 3),
+        }
+        tmp_path = FRESHNESS_STATE_PATH.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(state, indent=2), encoding="utf-8")
+        os.replace(tmp_path, FRESHNESS_STATE_PATH)
+
+
+def is_fresh(task: ScriptTask, state: Dict[str, Dict[str, float]]) -> bool:
+    if task.ttl_s is None or force_refresh():
+        return False
+    marker = state.get(task.key)
+    if not marker:
+        return False
+    last_success = marker["last_success"]
+    if time.time() - last_success >= task.ttl_s:
+        return False
+    return all(state.get(key, {}).get("last_success", 0) <= last_success for key in task.depends_on)
+
+
+def execute_task(task: ScriptTask) -> str:
+    """Ejecuta la tarea y devuelve su estado: `ok`, `vigente`, `omitida`, `fallida` o `timeout`.
+
+    Los fallos de tareas requeridas se propagan como excepción.
+    """
     logger = logging.getLogger("bootstrap")
 
-    if not task.script.exists():
-        message = f"No se encontro el script {task.script}"
+    script = task.resolved_script()
+    if not script.exists():
+        message = f"No se encontro el script {script}"
         if task.optional:
             logger.warning("%s; se omite por ser opcional.", message)
-            return
+            return "omitida"
         raise FileNotFoundError(message)
 
+    if is_fresh(task, load_freshness_state()):
+        logger.info("Datos de %s aun vigentes (TTL %.0f s); se omite.", task.name, task.ttl_s)
+        return "vigente"
+
     cmd = task.command() + list(task.args)
     logger.info("Ejecutando %s -> %s", task.name, " ".join(cmd))
 
+    started = time.monotonic()
     try:
-        subprocess.run(cmd, cwd=str(task.working_dir), check=True)
+        subprocess.run(cmd, cwd=str(task.working_dir), check=True, timeout=task.timeout_s)
+    except subprocess.TimeoutExpired:
+        if task.optional:
+            logger.warning("El script opcional %s excedio %.0f s. Continuando...", task.name, task.timeout_s)
+            return "timeout"
+        logger.error("El script %s excedio su limite de %.0f s.", task.name, task.timeout_s)
+        raise
     except subprocess.CalledProcessError as exc:
         if task.optional:
             logger.warning("El script opcional %s fallo con codigo %s. Continuando...", task.name, exc.returncode)
-            return
+            return "fallida"
         logger.error("El script %s finalizo con codigo %s.", task.name, exc.returncode)
         raise
+    record_success(task, time.monotonic() - started)
+    return "ok"
+
+
+@dataclass
+class TaskResult:
+    task: ScriptTask
+    status: str
+    started: float
+    finished: float
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+
+TASK_ERRORS = (FileNotFoundError, subprocess.CalledProcessError, subprocess.TimeoutExpired)
+
+
+def dependency_graph(tasks: Sequence[ScriptTask]) -> Dict[str, List[str]]:
+    """Dependencias por clave, ignorando las tareas omitidas; falla si hay ciclos o claves repetidas."""
+    keys = [task.key for task in tasks]
+    if len(set(keys)) != len(keys):
+        raise ValueError("Hay tareas con la misma clave de script.")
+    deps = {task.key: [dep for dep in task.depends_on if dep in keys] for task in tasks}
+
+    visited: Dict[str, int] = {}
+
+    def visit(key: str, path: List[str]) -> None:
+        if visited.get(key) == 2:
+            return
+        if visited.get(key) == 1:
+            raise ValueError("Ciclo de dependencias: " + " -> ".join(path + [key]))
+        visited[key] = 1
+        for dep in deps[key]:
+            visit(dep, path + [key])
+        visited[key] = 2
+
+    for key in keys:
+        visit(key, [])
+    return deps
+
+
+def run_dag(tasks: Sequence[ScriptTask], parallelism: int) -> Dict[str, TaskResult]:
+    """Ejecuta las tareas respetando `depends_on`, con hasta `parallelism` en paralelo.
+
+    Ante el fallo de una tarea requerida no se inician tareas nuevas: se espera a las que
+    están corriendo y se propaga el error tras el resumen de tiempos.
+    """
+    deps = dependency_graph(tasks)
+    pending = {task.key: task for task in tasks}
+    results: Dict[str, TaskResult] = {}
+    running: Dict[Future, ScriptTask] = {}
+    failure: Optional[BaseException] = None
+    origin = time.monotonic()
+
+    def timed(task: ScriptTask) -> TaskResult:
+        started = time.monotonic() - origin
+        status = execute_task(task)
+        return TaskResult(task, status, started, time.monotonic() - origin)
+
+    with ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix="task") as pool:
+        while pending or running:
+            if failure is None:
+                for key in list(pending):
+                    if len(running) >= parallelism:
+                        break
+                    if all(dep in results for dep in deps[key]):
+                        task = pending.pop(key)
+                        running[pool.submit(timed, task)] = task
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    results[task.key] = future.result()
+                except TASK_ERRORS as exc:
+                    now = time.monotonic() - origin
+                    results[task.key] = TaskResult(task, "fallida", now, now)
+                    failure = failure or exc
+
+    log_timing_summary(results, deps)
+    if failure is not None:
+        raise failure
+    return results
+
+
+def critical_path(results: Dict[str, TaskResult], deps: Dict[str, List[str]]) -> List[str]:
+    """Cadena de dependencias de mayor duración acumulada entre las tareas ejecutadas."""
+    totals: Dict[str, float] = {}
+    previous: Dict[str, Optional[str]] = {}
+
+    def total(key: str) -> float:
+        if key not in totals:
+            best = max((dep for dep in deps[key] if dep in results), key=total, default=None)
+            previous[key] = best
+            totals[key] = results[key].duration + (totals[best] if best else 0.0)
+        return totals[key]
+
+    if not results:
+        return []
+    key: Optional[str] = max(results, key=total)
+    path: List[str] = []
+    while key is not None:
+        path.append(key)
+        key = previous[key]
+    return list(reversed(path))
+
+
+def log_timing_summary(results: Dict[str, TaskResult], deps: Dict[str, List[str]]) -> None:
+    logger = logging.getLogger("bootstrap")
+    if not results:
+        return
+    logger.info("Resumen de tiempos:")
+    for result in sorted(results.values(), key=lambda item: item.started):
+        logger.info(
+            "  %-28s %-8s inicio %7.1f s  duracion %7.1f s",
+            result.task.name,
+            result.status,
+            result.started,
+            result.duration,
+        )
+    path = critical_path(results, deps)
+    total = sum(results[key].duration for key in path)
+    wall = max(result.finished for result in results.values())
+    logger.info(
+        "Ruta critica (%.1f s de %.1f s totales): %s",
+        total,
+        wall,
+        " -> ".join(results[key].task.name for key in path),
+    )
+
+
+def wait_until_ready(process: subprocess.Popen, started: float) -> None:
+    """Consulta WEB_READY_URL hasta que responda y reporta el tiempo hasta estar listo."""
+    logger = logging.getLogger("bootstrap")
+    url = os.getenv("WEB_READY_URL", f"http://127.0.0.1:{os.getenv('WEB_PORT', '5000')}/api/estado")
+    deadline = time.monotonic() + float(os.getenv("WEB_READY_TIMEOUT_S", "300"))
+
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as response:
+                if response.status < 500:
+                    logger.info("Aplicacion web lista en %.2f s (%s).", time.monotonic() - started, url)
+                    return
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.25)
+    logger.warning("La aplicacion web no respondio en %s.", url)
+
+
+def start_long_running(task: ScriptTask, started: float) -> subprocess.Popen:
+    logger = logging.getLogger("bootstrap")
+    script = task.resolved_script()
+    if not script.exists():
+        raise FileNotFoundError(f"No se encontro el script {script}")
+
+    cmd = task.command() + list(task.args)
+    logger.info("")
+    logger.info("="*60)
+    logger.info("Iniciando tarea final de larga ejecucion: %s -> %s", task.name, " ".join(cmd))
+    logger.info("="*60)
+    process = subprocess.Popen(cmd, cwd=str(task.working_dir))
+    threading.Thread(target=wait_until_ready, args=(process, started), name="web-ready", daemon=True).start()
+    return process
+
+
+def wait_long_running(task: ScriptTask, process: subprocess.Popen) -> None:
+    try:
+        returncode = process.wait()
+    except KeyboardInterrupt:
+        process.terminate()
+        process.wait()
+        raise
+    if returncode != 0:
+        logging.getLogger("bootstrap").error("El script %s finalizo con codigo %s.", task.name, returncode)
+        raise subprocess.CalledProcessError(returncode, task.command())
+
+
+def refresh_in_background(tasks: Sequence[ScriptTask], process: subprocess.Popen) -> None:
+    """Refresca las fuentes mientras la web ya sirve los últimos datos cargados.
+
+    Con REFRESH_INTERVAL_S > 0 repite el ciclo mientras el servidor siga vivo; las fuentes
+    vigentes se omiten por su marcador de frescura.
+    """
+    logger = logging.getLogger("bootstrap")
+    interval = float(os.getenv("REFRESH_INTERVAL_S", "0"))
+
+    while process.poll() is None:
+        cycle_started = time.monotonic()
+        try:
+            run_dag(tasks, task_parallelism())
+        except TASK_ERRORS as exc:
+            # La web sigue sirviendo los datos anteriores; se reintenta en el próximo ciclo
+            logger.error("Fallo el refresco en segundo plano: %s", exc)
+        logger.info("Ciclo de refresco en segundo plano completado en %.1f s.", time.monotonic() - cycle_started)
+        if interval <= 0:
+            return
+        time.sleep(interval)
 
 
 def run_tasks() -> None:
     logger = logging.getLogger("bootstrap")
     skip_tokens = parse_skip_list()
     long_running: ScriptTask | None = None
+    started = time.monotonic()
+    mode = startup_mode()
 
     logger.info("="*60)
     logger.info("INICIANDO PROCESO DE BOOTSTRAP DEL PROYECTO")
@@ -131,10 +433,13 @@ def run_tasks() -> None:
     logger.info("")
     logger.info("Orden de ejecucion:")
     logger.info("  1. Amenazas (metadata) - Actualizacion de datos")
-    logger.info("  2. Infraestructura vial - Carga si es necesario")
-    logger.info("  3. Aplicacion web - Servidor Flask")
+    logger.info("  2. Infraestructura vial - Carga si es necesario (en paralelo con 1)")
+    logger.info("  3. Aplicacion web - Servidor Flask (modo %s)", web_server_mode())
+    if mode == "fast":
+        logger.info("Arranque rapido: la web se levanta primero y 1-2 se refrescan en segundo plano.")
     logger.info("")
 
+    refresh_tasks: List[ScriptTask] = []
     for task in TASKS:
         if should_skip(task, skip_tokens):
             logger.info("Saltando tarea %s por configuracion.", task.name)
@@ -144,18 +449,24 @@ def run_tasks() -> None:
             long_running = task
             continue
 
-        execute_task(task)
+        refresh_tasks.append(task)
+
+    if mode == "fast" and long_running:
+        process = start_long_running(long_running, started)
+        threading.Thread(
+            target=refresh_in_background, args=(refresh_tasks, process), name="refresh", daemon=True
+        ).start()
+        wait_long_running(long_running, process)
+        return
+
+    run_dag(refresh_tasks, task_parallelism())
 
     if long_running:
-        logger.info("")
-        logger.info("="*60)
-        logger.info("Iniciando tarea final de larga ejecucion: %s", long_running.name)
-        logger.info("="*60)
-        execute_task(long_running)
+        process = start_long_running(long_running, started)
+        wait_long_running(long_running, process)
 
 
 def main() -> None:
-    load_dotenv()
     configure_logging()
 
     try:
@@ -163,7 +474,10 @@ def main() -> None:
     except FileNotFoundError as exc:
         logging.error(str(exc))
         sys.exit(1)
-    except subprocess.CalledProcessError:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        sys.exit(1)
+    except ValueError as exc:
+        logging.error(str(exc))
         sys.exit(1)
     except KeyboardInterrupt:
         logging.warning("Ejecucion interrumpida por el usuario.")